@@ -9,7 +9,6 @@ import logging
 import signal
 
 from cassandra import ConsistencyLevel
-from cassandra.concurrent import execute_concurrent_with_args
 from ccmlib.node import NodeError, TimeoutError, ToolError
 from ccmlib.node import TimeoutError
 
@@ -18,7 +17,8 @@ import pytest
 from dtest import Tester, create_ks, create_cf, data_size
 from tools.assertions import (assert_almost_equal, assert_bootstrap_state, assert_not_running,
                               assert_one, assert_stderr_clean)
-from tools.data import query_c1c2
+from tools.data import bulk_load, query_c1c2
+from tools.dataset_cache import load_or_create_dataset
 from tools.intervention import InterruptBootstrap, KillOnBootstrap
 from tools.misc import new_node
 from tools.misc import generate_ssl_stores
@@ -26,6 +26,10 @@ from tools.misc import generate_ssl_stores
 since = pytest.mark.since
 logger = logging.getLogger(__name__)
 
+# identifies the ks.cf datasets written by create_cf with c1 and c2 columns in the dataset cache
+C1C2_SCHEMA = "CREATE TABLE ks.cf (key varchar PRIMARY KEY, c1 text, c2 text)"
+
+
 class TestBootstrap(Tester):
     byteman_submit_path_pre_4_0 = './byteman/pre4.0/stream_failure.btm'
     byteman_submit_path_4_0 = './byteman/4.0/stream_failure.btm'
@@ -85,8 +89,11 @@ class TestBootstrap(Tester):
         empty_size = data_size(node1, 'ks','cf')
         logger.debug("node1 empty size for ks.cf: %s" % float(empty_size))
 
-        insert_statement = session.prepare("INSERT INTO ks.cf (key, c1, c2) VALUES (?, 'value1', 'value2')")
-        execute_concurrent_with_args(session, insert_statement, [['k%d' % k] for k in range(keys)])
+        def populate(session, rows, seed):
+            insert_statement = session.prepare("INSERT INTO ks.cf (key, c1, c2) VALUES (?, 'value1', 'value2')")
+            bulk_load(session, insert_statement, (['k%d' % k] for k in range(rows)))
+
+        load_or_create_dataset(self, session, 'ks', 'cf', schema=C1C2_SCHEMA, rows=keys, populate=populate)
 
         node1.flush()
         node1.compact()
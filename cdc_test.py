@@ -16,9 +16,8 @@ from cassandra.concurrent import (execute_concurrent,
                                   execute_concurrent_with_args)
 from ccmlib.node import Node
 
-from cqlsh_tests.cqlsh_tools import assert_resultset_contains
 from dtest import Tester, create_ks, logger
-from tools.assertions import assert_length_equal
+from tools.assertions import assert_length_equal, assert_rows_contain
 from tools.data import rows_to_list
 from tools.files import size_of_files_in_dir
 from tools.funcutils import get_rate_limited_function
@@ -319,7 +318,8 @@ class TestCDC(Tester):
 
         for enable in alter_path:
             set_cdc(enable)
-            assert_resultset_contains(session.execute('SELECT * FROM ' + table_name), data)
+            assert_rows_contain(session.execute('SELECT * FROM ' + table_name), data,
+                                key_columns=('a', 'b'), allow_extra=False)
 
     def test_cdc_enabled_data_readable_on_round_trip(self):
         """
@@ -17,19 +17,21 @@ from netifaces import AF_INET
 from psutil import virtual_memory
 
 import netifaces as ni
-import ccmlib.repository
 from ccmlib.common import validate_install_dir, is_win, get_version_from_build
 
 from dtest_config import DTestConfig
 from dtest_setup import DTestSetup
 from dtest_setup_overrides import DTestSetupOverrides
+from tools.loopback import loopback_ip_prefix
+from tools.versions import resolve_version
 
 # Python 3 imports
 from itertools import zip_longest
 
 logger = logging.getLogger(__name__)
 
-def check_required_loopback_interfaces_available():
+
+def check_required_loopback_interfaces_available(loopback_block=0):
     """
     We need at least 3 loopback interfaces configured to run almost all dtests. On Linux, loopback
     interfaces are automatically created as they are used, but on Mac they need to be explicitly
@@ -38,10 +40,13 @@ def check_required_loopback_interfaces_available():
     give the user some helpful advice on how to get their machine into a good known config
     """
     if platform.system() == "Darwin":
-        if len(ni.ifaddresses('lo0')[AF_INET]) < 9:
+        ip_prefix = loopback_ip_prefix(loopback_block)
+        addresses = [a['addr'] for a in ni.ifaddresses('lo0')[AF_INET]]
+        if len([a for a in addresses if a.startswith(ip_prefix)]) < 9:
             pytest.exit("At least 9 loopback interfaces are required to run dtests. "
                             "On Mac you can create the required loopback interfaces by running "
-                            "'for i in {1..9}; do sudo ifconfig lo0 alias 127.0.0.$i up; done;'")
+                            "'for i in {{1..9}}; do sudo ifconfig lo0 alias {prefix}$i up; done;'"
+                            .format(prefix=ip_prefix))
 
 def pytest_addoption(parser):
     parser.addoption("--use-vnodes", action="store_true", default=False,
@@ -80,6 +85,20 @@ def pytest_addoption(parser):
                      help="Enable JaCoCo Code Coverage Support")
     parser.addoption("--upgrade-version-selection", action="store", default="indev",
                      help="Specify whether to run indev, releases, or both")
+    parser.addoption("--dataset-cache-dir", action="store", default=None,
+                     help="Directory used to cache the flushed sstables of pre-generated test datasets. "
+                          "When set, tests using tools.dataset_cache load their data from the cache instead "
+                          "of writing it through CQL on every run")
+    parser.addoption("--copy-benchmark-dir", action="store", default=None,
+                     help="Run the cqlsh COPY benchmark matrix and write its report for the Cassandra build "
+                          "under test into this directory")
+    parser.addoption("--loopback-block", action="store", default=0,
+                     help="Run test clusters on the 127.0.N.x loopback addresses instead of 127.0.0.x, "
+                          "with their JMX ports shifted to match, so several dtest runs can share a machine")
+    parser.addoption("--log-dir", action="store", default="logs",
+                     help="Directory the logs of test clusters are saved to")
+    parser.addoption("--last-test-dir", action="store", default="last_test_dir",
+                     help="File recording the directory of the last test's cluster")
 
 
 def sufficient_system_resources_for_resource_intensive_tests():
@@ -220,8 +239,8 @@ def check_logs_for_errors(dtest_setup):
 
 
 def copy_logs(request, cluster, directory=None, name=None):
-    """Copy the current cluster's log files somewhere, by default to LOG_SAVED_DIR with a name of 'last'"""
-    log_saved_dir = "logs"
+    """Copy the current cluster's log files somewhere, by default to --log-dir with a name of 'last'"""
+    log_saved_dir = request.config.getoption("--log-dir")
     try:
         os.mkdir(log_saved_dir)
     except OSError:
@@ -373,13 +392,11 @@ def fixture_since(request, fixture_dtest_setup):
         # are excluded by the annotation
         if hasattr(request.cls, "UPGRADE_PATH"):
             upgrade_path = request.cls.UPGRADE_PATH
-            ccm_repo_cache_dir, _ = ccmlib.repository.setup(upgrade_path.starting_meta.version)
-            starting_version = get_version_from_build(ccm_repo_cache_dir)
+            starting_version = resolve_version(upgrade_path.starting_meta.version).version
             skip_msg = _skip_msg(starting_version, since, max_version)
             if skip_msg:
                 pytest.skip(skip_msg)
-            ccm_repo_cache_dir, _ = ccmlib.repository.setup(upgrade_path.upgrade_meta.version)
-            ending_version = get_version_from_build(ccm_repo_cache_dir)
+            ending_version = resolve_version(upgrade_path.upgrade_meta.version).version
             skip_msg = _skip_msg(ending_version, since, max_version)
             if skip_msg:
                 pytest.skip(skip_msg)
@@ -415,7 +432,7 @@ def dtest_config(request):
     dtest_config.setup(request)
 
     # if we're on mac, check that we have the required loopback interfaces before doing anything!
-    check_required_loopback_interfaces_available()
+    check_required_loopback_interfaces_available(dtest_config.loopback_block)
 
     try:
         if dtest_config.cassandra_dir is not None:
@@ -426,6 +443,19 @@ def dtest_config(request):
     yield dtest_config
 
 
+def _module_has_upgrade_test_class(module, cache):
+    """
+    Returns whether any class of module is marked as upgrade_test, memoized in cache by module name.
+    """
+    if module is None:
+        return False
+    if module.__name__ not in cache:
+        cache[module.__name__] = any(mark.name == "upgrade_test"
+                                     for _, cls in inspect.getmembers(module, inspect.isclass)
+                                     for mark in getattr(cls, "pytestmark", []))
+    return cache[module.__name__]
+
+
 def pytest_collection_modifyitems(items, config):
     """
     This function is called upon during the pytest test collection phase and allows for modification
@@ -455,12 +485,19 @@ def pytest_collection_modifyitems(items, config):
     sufficient_system_resources_resource_intensive = sufficient_system_resources_for_resource_intensive_tests()
     logger.debug("has sufficient resources? %s" % sufficient_system_resources_resource_intensive)
 
+    force_resource_intensive = config.getoption("--force-resource-intensive-tests")
+    skip_resource_intensive = config.getoption("--skip-resource-intensive-tests")
+    use_vnodes = config.getoption("--use-vnodes")
+    execute_upgrade_tests = config.getoption("--execute-upgrade-tests")
+    use_off_heap_memtables = config.getoption("use_off_heap_memtables")
+    # modules are shared by many items, so their classes are only inspected once
+    upgrade_modules = {}
+
     for item in items:
         deselect_test = False
+        markers = {marker.name for marker in item.iter_markers()}
 
-        if item.get_closest_marker("resource_intensive") and not collect_only:
-            force_resource_intensive = config.getoption("--force-resource-intensive-tests")
-            skip_resource_intensive = config.getoption("--skip-resource-intensive-tests")
+        if "resource_intensive" in markers and not collect_only:
             if not force_resource_intensive:
                 if skip_resource_intensive:
                     deselect_test = True
@@ -470,37 +507,28 @@ def pytest_collection_modifyitems(items, config):
                     deselect_test = True
                     logger.info("SKIP: Deselecting resource_intensive test %s due to insufficient system resources" % item.name)
 
-        if item.get_closest_marker("no_vnodes"):
-            if config.getoption("--use-vnodes"):
+        if "no_vnodes" in markers:
+            if use_vnodes:
                 deselect_test = True
                 logger.info("SKIP: Deselecting test %s as the test requires vnodes to be disabled. To run this test, "
                       "re-run without the --use-vnodes command line argument" % item.name)
 
-        if item.get_closest_marker("vnodes"):
-            if not config.getoption("--use-vnodes"):
+        if "vnodes" in markers:
+            if not use_vnodes:
                 deselect_test = True
                 logger.info("SKIP: Deselecting test %s as the test requires vnodes to be enabled. To run this test, "
                             "re-run with the --use-vnodes command line argument" % item.name)
 
-        for test_item_class in inspect.getmembers(item.module, inspect.isclass):
-            if not hasattr(test_item_class[1], "pytestmark"):
-                continue
-
-            for module_pytest_mark in test_item_class[1].pytestmark:
-                if module_pytest_mark.name == "upgrade_test":
-                    if not config.getoption("--execute-upgrade-tests"):
-                        deselect_test = True
-
-        if item.get_closest_marker("upgrade_test"):
-            if not config.getoption("--execute-upgrade-tests"):
+        if not execute_upgrade_tests:
+            if "upgrade_test" in markers or _module_has_upgrade_test_class(item.module, upgrade_modules):
                 deselect_test = True
 
-        if item.get_closest_marker("no_offheap_memtables"):
-            if config.getoption("use_off_heap_memtables"):
+        if "no_offheap_memtables" in markers:
+            if use_off_heap_memtables:
                 deselect_test = True
 
         # deselect cqlsh tests that depend on fixing a driver behavior
-        if item.get_closest_marker("depends_driver"):
+        if "depends_driver" in markers:
             deselect_test = True
 
         if deselect_test:
@@ -1,7 +1,3 @@
-import queue
-import sys
-import threading
-import time
 import pytest
 import logging
 from collections import OrderedDict, namedtuple
@@ -10,11 +6,12 @@ from copy import deepcopy
 from cassandra import ConsistencyLevel, consistency_value_to_name
 from cassandra.query import BatchStatement, BatchType, SimpleStatement
 
-from tools.assertions import (assert_all, assert_length_equal, assert_none,
-                              assert_unavailable)
-from dtest import MultiError, Tester, create_ks, create_cf
+from tools.assertions import (UNAVAILABLE_ERRORS, assert_all, assert_length_equal,
+                              assert_none)
+from dtest import Tester, create_ks, create_cf
 from tools.data import (create_c1c2_table, insert_c1c2, insert_columns,
                         query_c1c2, rows_to_list)
+from tools.fanout import Request, run_scenarios_async
 from tools.jmxutils import JolokiaAgent, make_mbean, remove_perf_disable_shared_mem
 
 since = pytest.mark.since
@@ -182,26 +179,40 @@ class TestHelper(Tester):
         else:
             return " speculative_retry =  'NONE'"
 
-    def insert_user(self, session, userid, age, consistency, serial_consistency=None):
+    def insert_user_statement(self, userid, age, consistency, serial_consistency=None):
         text = "INSERT INTO users (userid, firstname, lastname, age) VALUES ({}, 'first{}', 'last{}', {}) {}"\
             .format(userid, userid, userid, age, "IF NOT EXISTS" if serial_consistency else "")
-        statement = SimpleStatement(text, consistency_level=consistency, serial_consistency_level=serial_consistency)
-        session.execute(statement)
+        return SimpleStatement(text, consistency_level=consistency, serial_consistency_level=serial_consistency)
 
-    def update_user(self, session, userid, age, consistency, serial_consistency=None, prev_age=None):
+    def insert_user(self, session, userid, age, consistency, serial_consistency=None):
+        session.execute(self.insert_user_statement(userid, age, consistency, serial_consistency))
+
+    def update_user_statement(self, userid, age, consistency, serial_consistency=None, prev_age=None):
         text = "UPDATE users SET age = {} WHERE userid = {}".format(age, userid)
         if serial_consistency and prev_age:
             text = text + " IF age = {}".format(prev_age)
-        statement = SimpleStatement(text, consistency_level=consistency, serial_consistency_level=serial_consistency)
-        session.execute(statement)
+        return SimpleStatement(text, consistency_level=consistency, serial_consistency_level=serial_consistency)
+
+    def update_user(self, session, userid, age, consistency, serial_consistency=None, prev_age=None):
+        session.execute(self.update_user_statement(userid, age, consistency, serial_consistency, prev_age))
+
+    def delete_user_statement(self, userid, consistency):
+        return SimpleStatement("DELETE FROM users where userid = {}".format(userid), consistency_level=consistency)
 
     def delete_user(self, session, userid, consistency):
-        statement = SimpleStatement("DELETE FROM users where userid = {}".format(userid), consistency_level=consistency)
-        session.execute(statement)
+        session.execute(self.delete_user_statement(userid, consistency))
+
+    def query_user_statement(self, userid, consistency):
+        return SimpleStatement("SELECT userid, age FROM users where userid = {}".format(userid), consistency_level=consistency)
 
     def query_user(self, session, userid, age, consistency, check_ret=True):
-        statement = SimpleStatement("SELECT userid, age FROM users where userid = {}".format(userid), consistency_level=consistency)
-        res = session.execute(statement)
+        res = session.execute(self.query_user_statement(userid, consistency))
+        return self.check_user(session, res, userid, age, consistency, check_ret)
+
+    def check_user(self, session, res, userid, age, consistency, check_ret=True):
+        """
+        Checks the rows returned by a query_user_statement executed via session
+        """
         expected = [[userid, age]] if age else []
         ret = rows_to_list(res) == expected
         if check_ret:
@@ -220,15 +231,27 @@ class TestHelper(Tester):
 
         session.execute(create_cmd)
 
-    def update_counter(self, session, id, consistency, serial_consistency=None):
+    def update_counter_statement(self, id, consistency, serial_consistency=None):
         text = "UPDATE counters SET c = c + 1 WHERE id = {}".format(id)
-        statement = SimpleStatement(text, consistency_level=consistency, serial_consistency_level=serial_consistency)
+        return SimpleStatement(text, consistency_level=consistency, serial_consistency_level=serial_consistency)
+
+    def update_counter(self, session, id, consistency, serial_consistency=None):
+        statement = self.update_counter_statement(id, consistency, serial_consistency)
         session.execute(statement)
         return statement
 
+    def query_counter_statement(self, id, consistency):
+        return SimpleStatement("SELECT * from counters WHERE id = {}".format(id), consistency_level=consistency)
+
     def query_counter(self, session, id, val, consistency, check_ret=True):
-        statement = SimpleStatement("SELECT * from counters WHERE id = {}".format(id), consistency_level=consistency)
-        ret = rows_to_list(session.execute(statement))
+        res = session.execute(self.query_counter_statement(id, consistency))
+        return self.check_counter(session, res, id, val, consistency, check_ret)
+
+    def check_counter(self, session, res, id, val, consistency, check_ret=True):
+        """
+        Checks the rows returned by a query_counter_statement executed via session
+        """
+        ret = rows_to_list(res)
         if check_ret:
             assert ret[0][1] == val, "Got {} from {}, expected {} at {}".format(ret[0][1],
                                                                                         session.cluster.contact_points,
@@ -245,7 +268,7 @@ class TestAvailability(TestHelper):
     def _test_simple_strategy(self, combinations):
         """
         Helper test function for a single data center: invoke _test_insert_query_from_node() for each node
-        and each combination, progressively stopping nodes.
+        with all the combinations, progressively pausing nodes.
         """
         cluster = self.cluster
         nodes = self.nodes
@@ -255,16 +278,15 @@ class TestAvailability(TestHelper):
         for node in range(nodes):
             logger.debug('Testing node {} in single dc with {} nodes alive'.format(node, num_alive))
             session = self.patient_exclusive_cql_connection(cluster.nodelist()[node], self.ksname)
-            for combination in combinations:
-                self._test_insert_query_from_node(session, 0, [rf], [num_alive], *combination)
+            self._test_insert_query_from_node(session, 0, [rf], [num_alive], combinations)
 
-            self.cluster.nodelist()[node].stop()
+            self.pause_node(self.cluster.nodelist()[node])
             num_alive -= 1
 
     def _test_network_topology_strategy(self, combinations):
         """
         Helper test function for multiple data centers, invoke _test_insert_query_from_node() for each node
-        in each dc and each combination, progressively stopping nodes.
+        in each dc with all the combinations, progressively pausing nodes.
         """
         cluster = self.cluster
         nodes = self.nodes
@@ -279,34 +301,51 @@ class TestAvailability(TestHelper):
                 logger.debug('Testing node {} in dc {} with {} nodes alive'.format(n, i, nodes_alive))
                 node = n + sum(nodes[:i])
                 session = self.patient_exclusive_cql_connection(cluster.nodelist()[node], self.ksname)
-                for combination in combinations:
-                    self._test_insert_query_from_node(session, i, rf_factors, nodes_alive, *combination)
+                self._test_insert_query_from_node(session, i, rf_factors, nodes_alive, combinations)
 
-                self.cluster.nodelist()[node].stop(wait_other_notice=True)
+                self.pause_node(self.cluster.nodelist()[node])
                 nodes_alive[i] -= 1
 
-    def _test_insert_query_from_node(self, session, dc_idx, rf_factors, num_nodes_alive, write_cl, read_cl, serial_cl=None, check_ret=True):
+    def _test_insert_query_from_node(self, session, dc_idx, rf_factors, num_nodes_alive, combinations):
         """
-        Test availability for read and write via the session passed in as a parameter.
+        Test availability for read and write via the session passed in as a parameter, for all combinations at once.
+        Each combination uses keys of its own, so its reads only see its own writes.
         """
-        logger.debug("Connected to %s for %s/%s/%s" %
-                 (session.cluster.contact_points, consistency_value_to_name(write_cl), consistency_value_to_name(read_cl), consistency_value_to_name(serial_cl)))
-
-        start = 0
-        end = 100
-        age = 30
+        scenarios = []
+        for i, combination in enumerate(combinations):
+            # 100 keys to insert and query, and one for the requests that should fail
+            scenarios.extend(self._insert_query_scenarios(session, dc_idx, rf_factors, num_nodes_alive, i * 101, *combination))
+        run_scenarios_async(scenarios)
 
-        if self._should_succeed(write_cl, rf_factors, num_nodes_alive, dc_idx):
-            for n in range(start, end):
-                self.insert_user(session, n, age, write_cl, serial_cl)
-        else:
-            assert_unavailable(self.insert_user, session, end, age, write_cl, serial_cl)
+    def _insert_query_scenarios(self, session, dc_idx, rf_factors, num_nodes_alive, start, write_cl, read_cl, serial_cl=None, check_ret=True):
+        """
+        Return the scenarios inserting and querying keys start to start + 99 at the given consistency levels, or
+        checking that a write or read fails if not enough nodes are alive for it.
+        """
+        cls = "%s/%s/%s" % (consistency_value_to_name(write_cl), consistency_value_to_name(read_cl), consistency_value_to_name(serial_cl))
+        logger.debug("Connected to %s for %s" % (session.cluster.contact_points, cls))
 
-        if self._should_succeed(read_cl, rf_factors, num_nodes_alive, dc_idx):
-            for n in range(start, end):
-                self.query_user(session, n, age, read_cl, check_ret)
-        else:
-            assert_unavailable(self.query_user, session, end, age, read_cl, check_ret)
+        end = start + 100
+        age = 30
+        write_succeeds = self._should_succeed(write_cl, rf_factors, num_nodes_alive, dc_idx)
+        read_succeeds = self._should_succeed(read_cl, rf_factors, num_nodes_alive, dc_idx)
+
+        def insert_query(n):
+            if write_succeeds:
+                yield [Request(session, self.insert_user_statement(n, age, write_cl, serial_cl))]
+            if read_succeeds:
+                responses = yield [Request(session, self.query_user_statement(n, read_cl))]
+                self.check_user(session, responses[0].rows, n, age, read_cl, check_ret)
+
+        def unavailable(statement):
+            yield [Request(session, statement, UNAVAILABLE_ERRORS)]
+
+        scenarios = [("{} key {}".format(cls, n), insert_query(n)) for n in range(start, end)]
+        if not write_succeeds:
+            scenarios.append(("{} write".format(cls), unavailable(self.insert_user_statement(end, age, write_cl, serial_cl))))
+        if not read_succeeds:
+            scenarios.append(("{} read".format(cls), unavailable(self.query_user_statement(end, read_cl))))
+        return scenarios
 
     def test_simple_strategy(self):
         """
@@ -428,9 +467,11 @@ class TestAccuracy(TestHelper):
             self.write_cl = write_cl
             self.read_cl = read_cl
             self.serial_cl = serial_cl
+            self.description = '{}/{}/{}'.format(consistency_value_to_name(write_cl), consistency_value_to_name(read_cl),
+                                                 consistency_value_to_name(serial_cl))
 
-            logger.debug('Testing accuracy with WRITE/READ/SERIAL consistency set to {}/{}/{} (keys : {} to {})'
-                      .format(consistency_value_to_name(write_cl), consistency_value_to_name(read_cl), consistency_value_to_name(serial_cl), start, end - 1))
+            logger.debug('Testing accuracy with WRITE/READ/SERIAL consistency set to {} (keys : {} to {})'.format(
+                self.description, start, end - 1))
 
         def get_expected_consistency(self, idx):
             return self.outer.get_expected_consistency(idx, self.rf_factors, self.write_cl, self.read_cl)
@@ -441,6 +482,8 @@ class TestAccuracy(TestHelper):
             and check that when strong_consistency is true (R + W > N) we read back the latest value from all sessions.
             If strong_consistency is false we instead check that we read back the latest value from at least
             the number of nodes we wrote to.
+
+            :return: the scenarios validating each key, to be run with run_scenarios_async
             """
             outer = self.outer
             sessions = self.sessions
@@ -452,26 +495,29 @@ class TestAccuracy(TestHelper):
 
             def check_all_sessions(idx, n, val):
                 expected_consistency = self.get_expected_consistency(idx)
+                responses = yield [Request(s, outer.query_user_statement(n, read_cl)) for s in sessions]
                 num = 0
-                for s in sessions:
-                    if outer.query_user(s, n, val, read_cl, check_ret=expected_consistency.is_strong):
+                for s, response in zip(sessions, responses):
+                    if outer.check_user(s, response.rows, n, val, read_cl, check_ret=expected_consistency.is_strong):
                         num += 1
                 assert num >= expected_consistency.num_write_nodes, "Failed to read value from sufficient number of nodes," + \
                                      " required {} but got {} - [{}, {}]".format(expected_consistency.num_write_nodes, num, n, val)
 
-            for n in range(start, end):
+            def validate(n):
                 age = 30
                 for s in range(0, len(sessions)):
-                    outer.insert_user(sessions[s], n, age, write_cl, serial_cl)
-                    check_all_sessions(s, n, age)
+                    yield [Request(sessions[s], outer.insert_user_statement(n, age, write_cl, serial_cl))]
+                    yield from check_all_sessions(s, n, age)
                     if serial_cl is None:
                         age += 1
                 for s in range(0, len(sessions)):
-                    outer.update_user(sessions[s], n, age, write_cl, serial_cl, age - 1)
-                    check_all_sessions(s, n, age)
+                    yield [Request(sessions[s], outer.update_user_statement(n, age, write_cl, serial_cl, age - 1))]
+                    yield from check_all_sessions(s, n, age)
                     age += 1
-                outer.delete_user(sessions[0], n, write_cl)
-                check_all_sessions(s, n, None)
+                yield [Request(sessions[0], outer.delete_user_statement(n, write_cl))]
+                yield from check_all_sessions(s, n, None)
+
+            return [("{} key {}".format(self.description, n), validate(n)) for n in range(start, end)]
 
         def validate_counters(self):
             """
@@ -479,6 +525,8 @@ class TestAccuracy(TestHelper):
             and check that when strong_consistency is true (R + W > N) we read back the latest value from all sessions.
             If strong_consistency is false we instead check that we read back the latest value from at least
             the number of nodes we wrote to.
+
+            :return: the scenarios validating each key, to be run with run_scenarios_async
             """
             outer = self.outer
             sessions = self.sessions
@@ -490,26 +538,30 @@ class TestAccuracy(TestHelper):
 
             def check_all_sessions(idx, n, val):
                 expected_consistency = self.get_expected_consistency(idx)
+                responses = yield [Request(s, outer.query_counter_statement(n, read_cl)) for s in sessions]
                 results = []
-                for s in sessions:
-                    results.append(outer.query_counter(s, n, val, read_cl, check_ret=expected_consistency.is_strong))
+                for s, response in zip(sessions, responses):
+                    results.append(outer.check_counter(s, response.rows, n, val, read_cl, check_ret=expected_consistency.is_strong))
 
                 assert results.count(val) >= expected_consistency.num_write_nodes, "Failed to read value from sufficient number of nodes, required {} nodes to have a" + \
                                      " counter value of {} at key {}, instead got these values: {}".format(expected_consistency.num_write_nodes, val, n, results)
 
-            for n in range(start, end):
+            def validate(n):
                 c = 1
                 for s in range(0, len(sessions)):
-                    outer.update_counter(sessions[s], n, write_cl, serial_cl)
-                    check_all_sessions(s, n, c)
+                    yield [Request(sessions[s], outer.update_counter_statement(n, write_cl, serial_cl))]
+                    yield from check_all_sessions(s, n, c)
                     # Update the counter again at CL ALL to make sure all nodes are on the same page
                     # since a counter update requires a read
-                    outer.update_counter(sessions[s], n, ConsistencyLevel.ALL)
+                    yield [Request(sessions[s], outer.update_counter_statement(n, ConsistencyLevel.ALL))]
                     c += 2  # the counter was updated twice
 
+            return [("{} key {}".format(self.description, n), validate(n)) for n in range(start, end)]
+
     def _run_test_function_in_parallel(self, valid_fcn, nodes, rf_factors, combinations):
         """
-        Run a test function in parallel.
+        Run a test function for all combinations at once: the keys of all combinations are validated
+        concurrently, each key's writes and reads in turn.
         """
 
         requires_local_reads = False
@@ -527,41 +579,16 @@ class TestAccuracy(TestHelper):
 
         self._start_cluster(save_sessions=True, requires_local_reads=requires_local_reads)
 
-        input_queue = queue.Queue()
-        exceptions_queue = queue.Queue()
-
-        def run():
-            while not input_queue.empty():
-                try:
-                    v = TestAccuracy.Validation(self, self.sessions, nodes, rf_factors, *input_queue.get(block=False))
-                    valid_fcn(v)
-                except queue.Empty:
-                    pass
-                except Exception:
-                    exceptions_queue.put(sys.exc_info())
-
+        scenarios = []
         start = 0
         num_keys = 50
         for combination in combinations:
-            input_queue.put((start, start + num_keys) + combination)
+            validation = TestAccuracy.Validation(self, self.sessions, nodes, rf_factors, start, start + num_keys, *combination)
+            scenarios.extend(valid_fcn(validation))
             start += num_keys
 
-        threads = []
-        for n in range(0, 8):
-            t = threading.Thread(target=run)
-            t.setDaemon(True)
-            t.start()
-            threads.append(t)
-
-        logger.debug("Waiting for workers to complete")
-        while exceptions_queue.empty():
-            time.sleep(0.1)
-            if len([t for t in threads if t.isAlive()]) == 0:
-                break
-
-        if not exceptions_queue.empty():
-            _, exceptions, tracebacks = list(zip(*exceptions_queue.queue))
-            raise MultiError(exceptions=exceptions, tracebacks=tracebacks)
+        logger.debug("Waiting for {} keys to be validated".format(len(scenarios)))
+        run_scenarios_async(scenarios)
 
     @pytest.mark.resource_intensive
     def test_simple_strategy_users(self):
@@ -1,12 +1,26 @@
 from __future__ import unicode_literals
 
+import contextlib
 import csv
+import hashlib
+import heapq
+import itertools
+import json
+import locale
+import os
 import random
-from typing import List
+import re
+import selectors
+import string
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+from statistics import median
 
 import cassandra
-
-from cassandra.cluster import ResultSet
+from ccmlib import extension
+from ccmlib.node import ToolError
 
 
 class DummyColorMap(object):
@@ -27,13 +41,116 @@ def csv_rows(filename, delimiter=None):
             yield row
 
 
+def _row_key(row):
+    # unambiguous single line encoding of a csv row, also used as sort key
+    return json.dumps(row, ensure_ascii=False, default=repr)
+
+
+def csv_rows_digest(rows):
+    """
+    Returns an order independent digest of a multiset of csv rows as (row count, sum of row hashes).
+    Two iterables of rows have the same digest iff they hold the same rows, barring hash collisions.
+    """
+    count, total = 0, 0
+    for row in rows:
+        count += 1
+        total += int.from_bytes(hashlib.sha256(_row_key(row).encode('utf-8')).digest()[:16], 'big')
+    return count, total % (1 << 128)
+
+
+def _external_sort(rows, stack, chunk_rows):
+    """
+    Sorts row keys using runs of at most chunk_rows rows spilled to temporary files, which
+    are registered on stack so that they are removed once the caller is done.
+    """
+    runs = []
+    rows = iter(rows)
+    while True:
+        chunk = sorted(_row_key(row) for row in itertools.islice(rows, chunk_rows))
+        if not chunk:
+            break
+        run = stack.enter_context(tempfile.TemporaryFile('w+', encoding='utf-8'))
+        run.writelines(key + '\n' for key in chunk)
+        run.seek(0)
+        runs.append(line.rstrip('\n') for line in run)
+    return heapq.merge(*runs)
+
+
+def _sorted_diff(keys1, keys2, max_diff):
+    """
+    Walks two sorted streams of row keys and returns the keys found in only one of them, as
+    (total, first max_diff) for each side.
+    """
+    only1, only2 = [0, []], [0, []]
+
+    def add(side, key):
+        side[0] += 1
+        if len(side[1]) < max_diff:
+            side[1].append(key)
+
+    missing = object()
+    keys1, keys2 = iter(keys1), iter(keys2)
+    key1, key2 = next(keys1, missing), next(keys2, missing)
+    while key1 is not missing or key2 is not missing:
+        if key2 is missing or (key1 is not missing and key1 < key2):
+            add(only1, key1)
+            key1 = next(keys1, missing)
+        elif key1 is missing or key2 < key1:
+            add(only2, key2)
+            key2 = next(keys2, missing)
+        else:
+            key1, key2 = next(keys1, missing), next(keys2, missing)
+    return only1, only2
+
+
+def assert_csv_rows_equal(rows1, rows2, ordered=False, max_diff=20, chunk_rows=100000):
+    """
+    Asserts that two sources of csv rows hold the same rows, in any order unless ordered is set.
+
+    Rows are streamed: an unordered comparison only keeps a multiset digest of each side in
+    memory, and on mismatch both sides are read again and externally sorted in chunks of
+    chunk_rows rows to report at most max_diff rows found on only one side.
+    @param rows1 Callable returning a fresh iterable of rows (lists of strings) on every call
+    @param rows2 Callable returning a fresh iterable of rows (lists of strings) on every call
+    @param ordered Optional boolean flag, require the rows to be in the same order
+    @param max_diff Maximum number of differing rows to show per side
+    @param chunk_rows Maximum number of rows sorted in memory at a time when building the diff
+    """
+    if ordered:
+        missing = object()
+        for i, (row1, row2) in enumerate(itertools.zip_longest(rows1(), rows2(), fillvalue=missing)):
+            assert row1 == row2, 'CSV rows differ at row {}: {} != {}'.format(
+                i, 'no row' if row1 is missing else row1, 'no row' if row2 is missing else row2)
+        return
+
+    digest1, digest2 = csv_rows_digest(rows1()), csv_rows_digest(rows2())
+    if digest1 == digest2:
+        return
+
+    with contextlib.ExitStack() as stack:
+        only1, only2 = _sorted_diff(_external_sort(rows1(), stack, chunk_rows),
+                                    _external_sort(rows2(), stack, chunk_rows), max_diff)
+    raise AssertionError('CSV rows differ ({} vs {} rows).\n'
+                         'Only in first ({} rows, showing {}):\n{}\n'
+                         'Only in second ({} rows, showing {}):\n{}'
+                         .format(digest1[0], digest2[0],
+                                 only1[0], len(only1[1]), '\n'.join(only1[1]),
+                                 only2[0], len(only2[1]), '\n'.join(only2[1])))
+
+
+def _file_lines(filename):
+    # each line as a single column row, for assert_csv_rows_equal
+    with open(filename, 'r') as f:
+        for line in f:
+            yield [line]
+
+
 def assert_csvs_items_equal(filename1, filename2):
-    with open(filename1, 'r') as x, open(filename2, 'r') as y:
-        list_x = list(x.readlines())
-        list_y = list(y.readlines())
-        list_x.sort()
-        list_y.sort()
-        assert list_x == list_y
+    """
+    Asserts that two csv files hold the same lines, in any order, without loading them in memory.
+    Lines are compared as written, so quoting and whitespace differences between the files fail.
+    """
+    assert_csv_rows_equal(lambda: _file_lines(filename1), lambda: _file_lines(filename2))
 
 
 def random_list(gen=None, n=None):
@@ -100,25 +217,231 @@ def unmonkeypatch_driver(cache):
         cassandra.deserializers.DesDateType = cache['DesDateType']
 
 
-def assert_resultset_contains(got: ResultSet, expected: List[tuple]) -> None:
+# cqlsh commands whose effect outlives the command batch that issued them
+_SESSION_STATE_COMMANDS = re.compile(r'^\s*(use|consistency|serial|paging|tracing|capture|expand|login|source)\b',
+                                     re.IGNORECASE)
+
+
+class CqlshSession(object):
     """
-    So this is slow. I would hope a ResultSet has the capability of pulling data by PK or clustering,
-    however I'm not finding it atm. As such, this method isn't intended for use with large datasets.
-    :param got: ResultSet, expect schema of [a, b]
-    :param expected: list of tuples with 2 members corresponding with a/b schema of ResultSet
+    Keeps one cqlsh process connected to a node and runs command batches through it, so
+    that running many small batches doesn't pay for a new interpreter, cqlshlib import and
+    driver connection every time.
+
+    execute() mirrors node.run_cqlsh: it returns (stdout, stderr, rc) for a batch of ';'
+    separated commands, where the output also includes what cqlsh printed at startup, as
+    a fresh process would. After each batch a HELP command for a random topic is sent;
+    cqlsh answers it on stderr, which marks the end of the batch's output on both streams
+    since cqlsh runs unbuffered and single threaded.
+
+    The process is restarted when the cqlsh options, the content of a --cqlshrc file or
+    the node process change, and after a batch that changed session state (USE,
+    CONSISTENCY, TRACING, ...), so every batch starts from the state a fresh cqlsh has.
+    cqlsh only learns about schema changes made by other clients through debounced schema
+    events, so when schema_version is given the process is also restarted if the schema
+    changed since the end of the last batch, e.g. after the test created a table with its
+    own session.
+    @param node Node cqlsh connects to
+    @param schema_version Optional function returning the cluster's current schema version
     """
-    # Adding a touch of sanity check so people don't mis-use this. n^2 is bad.
-    assert len(expected) <= 1000, 'This is a slow comparison method. Don\'t use for > 1000 tuples.'
 
-    # First quick check: if we have a different count, we can just die.
-    assert len(got.current_rows) == len(expected)
+    def __init__(self, node, schema_version=None):
+        self.node = node
+        self.schema_version = schema_version
+        self._process = None
+        self._key = None
+        self._startup = ('', '')
+        self._dirty = False
+        self._schema_version = None
+
+    def _session_key(self, cqlsh_options):
+        cqlshrc_files = [option.split('=', 1)[1] for option in cqlsh_options if option.startswith('--cqlshrc=')]
+        cqlshrc_mtimes = [os.stat(f).st_mtime_ns if os.path.exists(f) else None for f in cqlshrc_files]
+        return tuple(cqlsh_options), tuple(cqlshrc_mtimes), self.node.pid
+
+    def _start(self, cqlsh_options):
+        env = self.node.get_env()
+        extension.append_to_client_env(self.node, env)
+        # cqlsh must not buffer its output, the end of batch detection relies on it
+        env['PYTHONUNBUFFERED'] = '1'
+        if self.node.get_base_cassandra_version() >= 2.1:
+            host, port = self.node.network_interfaces['binary']
+        else:
+            host, port = self.node.network_interfaces['thrift']
+        args = list(cqlsh_options)
+        extension.append_to_cqlsh_args(self.node, env, args)
+        args += [host, str(port)]
+
+        self._process = subprocess.Popen([self.node.get_tool('cqlsh')] + args, env=env, bufsize=0,
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._dirty = False
+        self._startup = ('', '')
+        self._startup = self._send([])[:2]
+
+    def close(self):
+        if self._process is not None:
+            if self._process.poll() is None:
+                try:
+                    self._process.stdin.write(b'quit;\n')
+                    self._process.stdin.close()
+                    self._process.wait(timeout=10)
+                except (OSError, subprocess.TimeoutExpired):
+                    self._process.kill()
+                    self._process.wait()
+            for stream in (self._process.stdin, self._process.stdout, self._process.stderr):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+            self._process = None
+
+    def _send(self, cmds):
+        sentinel = 'dtest_end_of_batch_' + ''.join(random.choice(string.ascii_lowercase) for _ in range(12))
+        lines = ''.join(cmd + ';\n' for cmd in cmds) + 'HELP {};\n'.format(sentinel)
+        try:
+            self._process.stdin.write(lines.encode(locale.getpreferredencoding(False)))
+        except OSError:
+            # cqlsh exited, the output read below shows why
+            pass
+
+        out, err, found = self._read_until(sentinel.encode('ascii'))
+        return self._startup[0] + out, self._startup[1] + err, found
+
+    def _read_until(self, sentinel):
+        out, err = bytearray(), bytearray()
+        streams = {self._process.stdout.fileno(): out, self._process.stderr.fileno(): err}
+        with selectors.DefaultSelector() as selector:
+            for fd in streams:
+                selector.register(fd, selectors.EVENT_READ)
+
+            found = False
+            while not found and selector.get_map():
+                for key, _ in selector.select():
+                    data = os.read(key.fd, 64 * 1024)
+                    if not data:
+                        selector.unregister(key.fd)
+                    streams[key.fd].extend(data)
+                found = sentinel in err
 
-    for t in expected:
-        assert len(t) == 2, 'Got unexpected tuple len. Expected 2, got tuple: {}'.format(t)
-        found = False
-        for row in got.current_rows:
             if found:
-                break
-            if row.a == t[0] and row.b == t[1]:
-                found = True
-        assert found, 'Failed to find expected row: {}'.format(t)
+                # anything cqlsh printed before the sentinel is already in the stdout pipe
+                while self._process.stdout.fileno() in selector.get_map() and selector.select(timeout=0):
+                    data = os.read(self._process.stdout.fileno(), 64 * 1024)
+                    if not data:
+                        break
+                    out.extend(data)
+                err = err[:err.rfind(b'\n', 0, err.find(sentinel)) + 1]
+
+        return self._decode(out), self._decode(err), found
+
+    @staticmethod
+    def _decode(output):
+        # same as reading a universal_newlines pipe, which node.run_cqlsh does
+        text = output.decode(locale.getpreferredencoding(False))
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+
+    def execute(self, cmds, cqlsh_options=None):
+        """
+        Runs cmds and returns (stdout, stderr, rc) like node.run_cqlsh.
+        @param cmds String of ';' separated cqlsh commands
+        @param cqlsh_options Optional list of cqlsh command line options
+        """
+        key = self._session_key(cqlsh_options or [])
+        schema_changed = self.schema_version is not None and self.schema_version() != self._schema_version
+        if self._process is None or key != self._key or self._dirty or schema_changed or \
+                self._process.poll() is not None:
+            self.close()
+            self._key = key
+            self._start(cqlsh_options or [])
+
+        cmds = [cmd.strip() for cmd in cmds.split(';') if cmd.strip()]
+        out, err, found = self._send(cmds)
+        self._dirty = any(_SESSION_STATE_COMMANDS.match(cmd) for cmd in cmds)
+        # schema changes made by the batch itself are known to this cqlsh
+        if self.schema_version is not None:
+            self._schema_version = self.schema_version()
+
+        if not found:
+            # the batch ended cqlsh (e.g. with EXIT), as it would have without a session
+            rc = self._process.wait()
+            self.close()
+            if rc != 0:
+                raise ToolError(['cqlsh', cmds, cqlsh_options], rc, out, err)
+        return out, err, 0
+
+
+CopyRateSample = namedtuple('CopyRateSample', ('rows', 'rate', 'avg_rate'))
+CopySummary = namedtuple('CopySummary', ('rows', 'files', 'seconds', 'skipped'))
+CopyBenchmarkRun = namedtuple('CopyBenchmarkRun', ('direction', 'options', 'rows', 'seconds', 'wall_seconds',
+                                                   'rows_per_second', 'min_rate', 'median_rate', 'max_rate'))
+
+_rate_line = re.compile(r'Processed: (\d+) rows; Rate:\s*([\d.]+) rows/s; Avg\. rate:\s*([\d.]+) rows/s')
+_copy_summary = re.compile(r'(\d+) rows (?:exported to|imported from) (\d+) files? in (.+?)(?: \((\d+) skipped\))?\.\s*$',
+                           re.MULTILINE)
+_interval_part = re.compile(r'([\d.]+) (day|hour|minute|second)s?')
+_interval_units = {'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}
+
+
+def parse_copy_rate_file(filename):
+    """
+    Returns the CopyRateSamples reported in a COPY RATEFILE, in the order they were written.
+    """
+    with open(filename, 'r') as f:
+        return [CopyRateSample(int(m.group(1)), float(m.group(2)), float(m.group(3)))
+                for m in (_rate_line.search(line) for line in f) if m]
+
+
+def parse_copy_summary(output):
+    """
+    Parses the summary cqlsh prints at the end of a COPY, e.g. '1000 rows imported from 1 files in
+    2 minutes and 1.234 seconds (0 skipped).', into a CopySummary, or returns None if there is none.
+    """
+    matches = list(_copy_summary.finditer(output))
+    if not matches:
+        return None
+    m = matches[-1]
+    seconds = sum(float(value) * _interval_units[unit] for value, unit in _interval_part.findall(m.group(3)))
+    return CopySummary(rows=int(m.group(1)), files=int(m.group(2)), seconds=seconds,
+                       skipped=int(m.group(4)) if m.group(4) else 0)
+
+
+def copy_option_matrix(**values):
+    """
+    Yields every combination of COPY options as a dict, e.g.
+    copy_option_matrix(NUMPROCESSES=[1, 4], CHUNKSIZE=[1000]) yields
+    {'NUMPROCESSES': 1, 'CHUNKSIZE': 1000} and {'NUMPROCESSES': 4, 'CHUNKSIZE': 1000}.
+    """
+    names = sorted(values)
+    for combination in itertools.product(*(values[name] for name in names)):
+        yield dict(zip(names, combination))
+
+
+def copy_benchmark_run(direction, options, output, ratefile, wall_seconds):
+    """
+    Builds a CopyBenchmarkRun from the stdout of a COPY command and its rate file.
+    """
+    summary = parse_copy_summary(output)
+    assert summary is not None, 'No COPY summary in output: {}'.format(output)
+    rates = [sample.rate for sample in parse_copy_rate_file(ratefile) if sample.rate > 0] or [0]
+    seconds = summary.seconds or wall_seconds
+    return CopyBenchmarkRun(direction=direction, options=options, rows=summary.rows, seconds=seconds,
+                            wall_seconds=wall_seconds, rows_per_second=summary.rows / seconds if seconds else 0,
+                            min_rate=min(rates), median_rate=median(rates), max_rate=max(rates))
+
+
+def write_copy_benchmark_report(directory, cassandra_version, runs, build=None):
+    """
+    Writes the runs of a COPY benchmark to <directory>/copy_benchmark_<version>[_<build>].json, so
+    that reports of different Cassandra builds sit side by side and can be compared run by run.
+    @return the path of the report
+    """
+    name = 'copy_benchmark_{}'.format(cassandra_version)
+    if build:
+        name += '_' + re.sub(r'[^\w.-]', '_', build)
+    path = os.path.join(directory, name + '.json')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump({'cassandra_version': str(cassandra_version), 'build': build, 'time': time.time(),
+                   'runs': [run._asdict() for run in runs]}, f, indent=2, sort_keys=True)
+    return path
@@ -30,12 +30,14 @@ from ccmlib.common import is_win
 
 from .cqlsh_test_types import (Address, Datetime, ImmutableDict,
                                ImmutableSet, Name, UTC)
-from .cqlsh_tools import (DummyColorMap, assert_csvs_items_equal,
-                          csv_rows, monkeypatch_driver, random_list,
-                          unmonkeypatch_driver, write_rows_to_csv)
+from .cqlsh_tools import (CqlshSession, DummyColorMap, assert_csv_rows_equal, assert_csvs_items_equal,
+                          copy_benchmark_run, copy_option_matrix, csv_rows,
+                          monkeypatch_driver, random_list, unmonkeypatch_driver,
+                          write_copy_benchmark_report, write_rows_to_csv)
 from dtest import (Tester, create_ks)
 from dtest import (FlakyRetryPolicy, Tester, create_ks)
 from tools.data import rows_to_list
+from tools.git import cassandra_git_branch
 from tools.metadata_wrapper import (UpdatingClusterMetadataWrapper,
                                     UpdatingTableMetadataWrapper)
 
@@ -62,6 +64,13 @@ class TestCqlshCopy(Tester):
         yield
         self.delete_temp_files()
 
+    @pytest.fixture(scope='function', autouse=True)
+    def fixture_cqlsh_session(self):
+        self._cqlsh_session = None
+        yield
+        if self._cqlsh_session is not None:
+            self._cqlsh_session.close()
+
     @classmethod
     def setUpClass(cls):
         cls._cached_driver_methods = monkeypatch_driver()
@@ -153,7 +162,8 @@ class TestCqlshCopy(Tester):
                   auth_enabled=False, show_output=True, retry_on_request_timeout=True):
         """
         Run cqlsh on node1 adding the debug and cqlshrc to the clqsh options, unless the caller
-        has specified its own options.
+        has specified its own options. Commands go through a CqlshSession kept for the whole test,
+        which restarts cqlsh when the schema changed since the last batch.
         """
         if cqlsh_options is None:
             cqlsh_options = []
@@ -168,17 +178,22 @@ class TestCqlshCopy(Tester):
             cqlsh_options.append('--username=cassandra')
             cqlsh_options.append('--password=cassandra')
 
+        if self._cqlsh_session is None or self._cqlsh_session.node is not self.node1:
+            if self._cqlsh_session is not None:
+                self._cqlsh_session.close()
+            self._cqlsh_session = CqlshSession(self.node1, schema_version=self._schema_version)
+
         if retry_on_request_timeout:
             num_attempts = 0
             while num_attempts < 5:
-                ret = self.node1.run_cqlsh(cmds=cmds, cqlsh_options=cqlsh_options)
+                ret = self._cqlsh_session.execute(cmds, cqlsh_options=cqlsh_options)
 
                 if not re.search(r"Client request timeout", ret[0]):
                     break
 
                 num_attempts += 1
         else:
-            ret = self.node1.run_cqlsh(cmds=cmds, cqlsh_options=cqlsh_options)
+            ret = self._cqlsh_session.execute(cmds, cqlsh_options=cqlsh_options)
 
         if show_output:
             logger.debug('Output:\n{}'.format(ret[0]))  # show stdout of copy cmd
@@ -186,6 +201,9 @@ class TestCqlshCopy(Tester):
 
         return ret
 
+    def _schema_version(self):
+        return self.session.execute("SELECT schema_version FROM system.local").one().schema_version
+
     @property
     def default_time_format(self):
         """
@@ -319,27 +337,10 @@ class TestCqlshCopy(Tester):
             else:
                 raise RuntimeError("table_name is required if cql_type_names are not specified")
 
-        processed_results = list(self.result_to_csv_rows(results, cql_type_names, nullval=nullval))
-        csv_results = list(csv_rows(csv_filename))
-
-        self.maxDiff = None
-
-        try:
-            if sort_data:
-                assert sorted(csv_results) == sorted(processed_results)
-            else:
-                assert csv_results == processed_results
-        except Exception as e:
-            if len(csv_results) != len(processed_results):
-                logger.warning("Different # of entries. CSV: " + str(len(csv_results)) +
-                        " vs results: " + str(len(processed_results)))
-            elif csv_results[0] is not None:
-                for x in range(0, len(csv_results[0])):
-                    if csv_results[0][x] != processed_results[0][x]:
-                        logger.warning("Mismatch at index: " + str(x))
-                        logger.warning("Value in csv: " + str(csv_results[0][x]))
-                        logger.warning("Value in result: " + str(processed_results[0][x]))
-            raise e
+        # results is formatted lazily, and again only if a diff has to be reported
+        assert_csv_rows_equal(lambda: csv_rows(csv_filename),
+                              lambda: self.iter_result_csv_rows(results, cql_type_names, nullval=nullval),
+                              ordered=not sort_data)
 
     def make_csv_formatter(self, time_format, nullval):
         with self._cqlshlib() as cqlshlib:  # noqa
@@ -397,9 +398,9 @@ class TestCqlshCopy(Tester):
 
         return formatter
 
-    def result_to_csv_rows(self, results, cql_type_names, time_format=None, nullval=''):
+    def iter_result_csv_rows(self, results, cql_type_names, time_format=None, nullval=''):
         """
-        Given an object returned from a CQL query, returns a string formatted by
+        Given an object returned from a CQL query, yields its rows formatted by
         the cqlsh formatting utilities.
         """
         # This has no real dependencies on Tester except that self._cqlshlib has
@@ -408,7 +409,6 @@ class TestCqlshCopy(Tester):
         if not time_format:
             time_format = self.default_time_format
 
-        processed = []
         format_fn = self.make_csv_formatter(time_format, nullval)
 
         # build the typemap once ahead of time to speed up formatting
@@ -423,8 +423,10 @@ class TestCqlshCopy(Tester):
         for i, row in enumerate(results):
             formatted_row = [format_fn(v, t, cql_type_map.get(t))
                              for v, t in zip(row, cql_type_names)]
-            processed.append(formatted_row)
-        return processed
+            yield formatted_row
+
+    def result_to_csv_rows(self, results, cql_type_names, time_format=None, nullval=''):
+        return list(self.iter_result_csv_rows(results, cql_type_names, time_format=time_format, nullval=nullval))
 
     @pytest.mark.depends_cqlshlib
     def test_list_data(self):
@@ -2636,6 +2638,49 @@ class TestCqlshCopy(Tester):
         self._test_bulk_round_trip(nodes=3, partitioner="murmur3", num_operations=250000,
                                    copy_from_options={'MAXINFLIGHTMESSAGES': 64, 'MAXPENDINGCHUNKS': 1})
 
+    @pytest.mark.resource_intensive
+    def test_copy_benchmark_matrix(self):
+        """
+        Measure COPY TO and COPY FROM throughput over a fixed stress dataset, sweeping the options
+        that affect it, and write a report for the Cassandra build under test. Each run still checks
+        that every row was copied. Only runs when --copy-benchmark-dir is given.
+        """
+        if self.dtest_config.copy_benchmark_dir is None:
+            pytest.skip("COPY benchmarks only run with --copy-benchmark-dir")
+
+        num_records = 100000
+        stress_table = 'keyspace1.standard1'
+        self.prepare(nodes=1, configuration_options={'truncate_request_timeout_in_ms': 60000})
+        self.node1.stress(['write', 'n={} cl=ALL'.format(num_records), 'no-warmup', '-rate', 'threads=50'])
+
+        csvfile = self.get_temp_file()
+        runs = []
+
+        def run_copy(direction, options):
+            ratefile = self.get_temp_file()
+            cmd = "COPY {} {} '{}' WITH RATEFILE='{}' AND REPORTFREQUENCY=0.25".format(
+                stress_table, direction, csvfile.name, ratefile.name)
+            cmd += ''.join(' AND {} = {}'.format(k, v) for k, v in sorted(options.items()))
+            start = time.time()
+            out, _, _ = self.run_cqlsh(cmds=cmd, show_output=False)
+            run = copy_benchmark_run(direction, options, out, ratefile.name, time.time() - start)
+            assert run.rows == num_records, out
+            logger.debug('COPY {} with {}: {:.0f} rows/s'.format(direction, options, run.rows_per_second))
+            runs.append(run)
+
+        for options in copy_option_matrix(NUMPROCESSES=[1, 4, 8], PAGESIZE=[1000, 5000]):
+            run_copy('TO', options)
+
+        for options in copy_option_matrix(NUMPROCESSES=[1, 4], CHUNKSIZE=[1000, 5000], MAXBATCHSIZE=[10, 20],
+                                          INGESTRATE=[100000, 500000], PREPAREDSTATEMENTS=[True, False]):
+            self.session.execute("TRUNCATE {}".format(stress_table))
+            run_copy('FROM', options)
+
+        build = cassandra_git_branch(self.dtest_config.cassandra_dir) if self.dtest_config.cassandra_dir else None
+        report = write_copy_benchmark_report(self.dtest_config.copy_benchmark_dir, self.cluster.version(), runs,
+                                             build=build)
+        logger.debug('Wrote COPY benchmark report {}'.format(report))
+
     def prepare_copy_to_with_failures(self):
         """
         Create a cluster for testing COPY TO with failure injection, we need at least 3 token ranges
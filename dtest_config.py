@@ -1,8 +1,8 @@
 import subprocess
 import os
-import ccmlib.repository
 
 from ccmlib.common import is_win, get_version_from_build
+from tools.versions import resolve_version
 
 class DTestConfig:
     def __init__(self):
@@ -20,6 +20,11 @@ class DTestConfig:
         self.disable_active_log_watching = False
         self.keep_test_dir = False
         self.enable_jacoco_code_coverage = False
+        self.dataset_cache_dir = None
+        self.copy_benchmark_dir = None
+        self.loopback_block = 0
+        self.log_dir = "logs"
+        self.last_test_dir = "last_test_dir"
         self.jemalloc_path = find_libjemalloc()
 
     def setup(self, request):
@@ -40,6 +45,13 @@ class DTestConfig:
         self.disable_active_log_watching = request.config.getoption("--disable-active-log-watching")
         self.keep_test_dir = request.config.getoption("--keep-test-dir")
         self.enable_jacoco_code_coverage = request.config.getoption("--enable-jacoco-code-coverage")
+        if request.config.getoption("--dataset-cache-dir") is not None:
+            self.dataset_cache_dir = os.path.expanduser(request.config.getoption("--dataset-cache-dir"))
+        if request.config.getoption("--copy-benchmark-dir") is not None:
+            self.copy_benchmark_dir = os.path.expanduser(request.config.getoption("--copy-benchmark-dir"))
+        self.loopback_block = int(request.config.getoption("--loopback-block"))
+        self.log_dir = request.config.getoption("--log-dir")
+        self.last_test_dir = request.config.getoption("--last-test-dir")
 
     def get_version_from_build(self):
         # There are times when we want to know the C* version we're testing against
@@ -48,8 +60,7 @@ class DTestConfig:
         # get the version from build.xml in the C* repository specified by
         # CASSANDRA_VERSION or CASSANDRA_DIR.
         if self.cassandra_version is not None:
-            ccm_repo_cache_dir, _ = ccmlib.repository.setup(self.cassandra_version)
-            return get_version_from_build(ccm_repo_cache_dir)
+            return resolve_version(self.cassandra_version).version
         elif self.cassandra_dir is not None:
             return get_version_from_build(self.cassandra_dir)
 
@@ -25,9 +25,14 @@ from distutils.version import LooseVersion
 
 from tools.context import log_filter
 from tools.funcutils import merge_dicts
+from tools.loopback import use_loopback_block
 
 logger = logging.getLogger(__name__)
 
+# how long nodes get to notice a node was paused or resumed, with phi_convict_threshold at 5
+# conviction usually takes a few seconds
+NODE_PAUSE_NOTICE_TIMEOUT = 60
+
 
 def retry_till_success(fun, *args, **kwargs):
     timeout = kwargs.pop('timeout', 60)
@@ -52,12 +57,14 @@ class DTestSetup(object):
         self.cluster_name = cluster_name
         self.ignore_log_patterns = []
         self.cluster = None
+        self.own_cluster = None
         self.cluster_options = []
         self.replacement_node = None
         self.allow_log_errors = False
         self.connections = []
+        self.paused_nodes = OrderedDict()
 
-        self.log_saved_dir = "logs"
+        self.log_saved_dir = dtest_config.log_dir if dtest_config is not None else "logs"
         try:
             os.mkdir(self.log_saved_dir)
         except OSError:
@@ -68,7 +75,7 @@ class DTestSetup(object):
         self.enable_for_jolokia = False
         self.subprocs = []
         self.log_watch_thread = None
-        self.last_test_dir = "last_test_dir"
+        self.last_test_dir = dtest_config.last_test_dir if dtest_config is not None else "last_test_dir"
         self.jvm_args = []
         self.create_cluster_func = None
         self.iterations = 0
@@ -337,6 +344,71 @@ class DTestSetup(object):
         if os.path.exists(self.last_test_dir):
             os.remove(self.last_test_dir)
 
+    def borrow_cluster(self, cluster):
+        """
+        Makes the test run against a cluster owned by a longer lived fixture instead of its own. The
+        borrowed cluster's logs are checked and saved after the test like those of the test's own
+        cluster would be, but cleanup leaves it running and removes the test's own (unused) cluster.
+        """
+        if self.own_cluster is None:
+            self.own_cluster = self.cluster
+        self.cluster = cluster
+
+    def pause_node(self, node, wait_other_notice=True):
+        """
+        Makes node unavailable by freezing its JVM with SIGSTOP, which is much quicker than stopping and
+        later restarting it. Nodes left paused are resumed when the cluster is cleaned up.
+        :param wait_other_notice: wait for the failure detectors of the other live nodes to convict node
+        """
+        others = [other for other in self.cluster.nodelist()
+                  if other is not node and other not in self.paused_nodes and other.is_live()]
+        marks = [(other, other.mark_log()) for other in others]
+
+        logger.debug("Pausing {}".format(node.name))
+        node.pause()
+        self.paused_nodes[node] = marks
+
+        if wait_other_notice:
+            for other, mark in marks:
+                other.watch_log_for_death(node, from_mark=mark, timeout=NODE_PAUSE_NOTICE_TIMEOUT)
+
+    def resume_node(self, node, wait_other_notice=True):
+        """
+        Resumes a node paused by pause_node
+        :param wait_other_notice: wait for the live nodes that saw node DOWN to see it UP again through gossip
+        """
+        self.resume_nodes([node], wait_other_notice=wait_other_notice)
+
+    def resume_nodes(self, nodes, wait_other_notice=True):
+        """
+        Resumes nodes paused by pause_node all at once, so that none of them convicts another one still paused
+        :param wait_other_notice: wait for the live nodes, resumed ones included, that last saw a resumed node
+                                  DOWN to see it UP again through gossip
+        """
+        nodes = list(nodes)
+        pause_marks = {node: dict(self.paused_nodes.pop(node)) for node in nodes}
+        others = [other for other in self.cluster.nodelist() if other not in self.paused_nodes and other.is_live()]
+
+        # nodes live when a node was paused convicted it after their pause mark, the others (e.g. a node
+        # resumed before it) may have at any time, and only their last word on it tells whether they wait
+        waits = []
+        for other in others:
+            mark = other.mark_log()
+            for node in nodes:
+                if other is not node:
+                    status = other.grep_log("{}.* now (dead|DOWN|UP)".format(node.address()),
+                                            from_mark=pause_marks[node].get(other))
+                    if status and status[-1][1].group(1) != 'UP':
+                        waits.append((other, node, mark))
+
+        logger.debug("Resuming {}".format(', '.join(node.name for node in nodes)))
+        for node in nodes:
+            node.resume()
+
+        if wait_other_notice:
+            for other, node, mark in waits:
+                other.watch_log_for_alive(node, from_mark=mark, timeout=NODE_PAUSE_NOTICE_TIMEOUT)
+
     def stop_active_log_watch(self):
         """
         Joins the log watching thread, which will then exit.
@@ -348,6 +420,14 @@ class DTestSetup(object):
         self.log_watch_thread.join(timeout=60)
 
     def cleanup_cluster(self):
+        # a paused JVM would only act on the signals stopping it once resumed
+        for node in self.paused_nodes:
+            node.resume()
+        self.paused_nodes = OrderedDict()
+
+        if self.own_cluster is not None:
+            self.cluster, self.own_cluster = self.own_cluster, None
+
         with log_filter('cassandra'):  # quiet noise from driver when nodes start going down
             if self.dtest_config.keep_test_dir:
                 self.cluster.stop(gently=self.dtest_config.enable_jacoco_code_coverage)
@@ -473,6 +553,7 @@ class DTestSetup(object):
 
         cluster.set_datadir_count(dtest_setup.dtest_config.data_dir_count)
         cluster.set_environment_variable('CASSANDRA_LIBJEMALLOC', dtest_setup.dtest_config.jemalloc_path)
+        use_loopback_block(cluster, dtest_setup.dtest_config.loopback_block)
 
         return cluster
 
@@ -48,24 +48,25 @@ class TestHintedHandoffConfig(Tester):
 
     def _do_hinted_handoff(self, node1, node2, enabled, keyspace='ks'):
         """
-        Test that if we stop one node the other one
-        will store hints only when hinted handoff is enabled
+        Test that if we pause one node the other one
+        will store hints only when hinted handoff is enabled.
+        Leaves node1 paused.
         """
         session = self.patient_exclusive_cql_connection(node1)
         create_ks(session, keyspace, 2)
         create_c1c2_table(self, session)
 
-        node2.stop(wait_other_notice=True)
+        self.pause_node(node2)
 
         insert_c1c2(session, n=100, consistency=ConsistencyLevel.ONE)
 
         log_mark = node1.mark_log()
-        node2.start(wait_other_notice=True)
+        self.resume_node(node2)
 
         if enabled:
             node1.watch_log_for(["Finished hinted"], from_mark=log_mark, timeout=120)
 
-        node1.stop(wait_other_notice=True)
+        self.pause_node(node1)
 
         # Check node2 for all the keys that should have been delivered via HH if enabled or not if not enabled
         session = self.patient_exclusive_cql_connection(node2, keyspace=keyspace)
@@ -139,7 +140,7 @@ class TestHintedHandoffConfig(Tester):
         res = self._launch_nodetool_cmd(node, 'getmaxhintwindow')
         assert 'Current max hint window: 300000 ms' == res.rstrip()
         self._do_hinted_handoff(node1, node2, True)
-        node1.start(wait_other_notice=True)
+        self.resume_node(node1)
         self._launch_nodetool_cmd(node, 'setmaxhintwindow 1')
         res = self._launch_nodetool_cmd(node, 'getmaxhintwindow')
         assert 'Current max hint window: 1 ms' == res.rstrip()
@@ -1,13 +1,18 @@
 
+from collections import namedtuple
 from unittest import TestCase
 
 from cassandra import AlreadyExists, InvalidRequest, Unauthorized, Unavailable
 from mock import Mock
 
+from cassandra.util import OrderedMapSerializedKey, SortedSet
+from cassandra.cqltypes import Int32Type
 from tools.assertions import (assert_all, assert_almost_equal, assert_exception,
                               assert_invalid, assert_length_equal, assert_none,
-                              assert_one, assert_row_count, assert_stderr_clean,
-                              assert_unauthorized, assert_unavailable)
+                              assert_lists_equal_ignoring_order, assert_one,
+                              assert_row_count, assert_rows_contain,
+                              assert_rows_equal_ignoring_order,
+                              assert_stderr_clean, assert_unauthorized, assert_unavailable)
 import pytest
 
 class TestAssertStderrClean(TestCase):
@@ -113,3 +118,63 @@ class TestAssertionMethods(TestCase):
     def test_almost_equal_expect_failure(self):
         with pytest.raises(AssertionError):
             assert_almost_equal(1, 1.3, error=.1)
+
+
+class TestAssertRowsEqualIgnoringOrder(TestCase):
+
+    def test_order_is_ignored(self):
+        assert_rows_equal_ignoring_order(iter([[2, 'b'], [1, 'a']]), [[1, 'a'], [2, 'b']])
+
+    def test_missing_duplicate_is_detected(self):
+        with pytest.raises(AssertionError):
+            assert_rows_equal_ignoring_order([[1, 'a']], [[1, 'a'], [1, 'a']])
+        with pytest.raises(AssertionError):
+            assert_rows_equal_ignoring_order([[1, 'a'], [1, 'a']], [[1, 'a']])
+
+    def test_collections_match_regardless_of_container_type(self):
+        driver_map = OrderedMapSerializedKey(Int32Type, 4)
+        driver_map._insert_unchecked(10, Int32Type.serialize(10, 4), 11)
+        assert_rows_equal_ignoring_order([[0, driver_map, SortedSet([1, 2]), [3, 4]]],
+                                         [[0, {10: 11}, {2, 1}, (3, 4)]])
+
+    def test_diff_is_bounded(self):
+        with pytest.raises(AssertionError) as e:
+            assert_rows_equal_ignoring_order([[i] for i in range(1000)], [], max_diff=5)
+        assert '1000 unexpected rows' in str(e.value)
+        assert '[5]' not in str(e.value)
+
+
+class TestAssertListsEqualIgnoringOrder(TestCase):
+
+    def test_lists_of_dicts(self):
+        assert_lists_equal_ignoring_order([{'id': 2, 'v': 'b'}, {'id': 1, 'v': 'a'}],
+                                          [{'id': 1, 'v': 'a'}, {'id': 2, 'v': 'b'}], sort_key='id')
+
+    def test_failure_reports_items_by_sort_key(self):
+        expected = [{'id': i, 'v': 'x'} for i in (30, 4, 100, 2, 7)]
+        with pytest.raises(AssertionError) as e:
+            assert_lists_equal_ignoring_order(expected, expected[:1], sort_key='id')
+        assert "missing from the second: [(('id', 2), ('v', 'x')), (('id', 4), ('v', 'x')), (('id', 7), ('v', 'x')), " \
+            "(('id', 100), ('v', 'x'))]" in str(e.value)
+
+
+class TestAssertRowsContain(TestCase):
+
+    def setUp(self):
+        row = namedtuple('row', ['a', 'b', 'c'])
+        self.rows = [row(i, i + 1, 'x') for i in range(5000)]
+
+    def test_subset_on_key_columns(self):
+        assert_rows_contain(iter(self.rows), [(10, 11), (4999, 5000)], key_columns=('a', 'b'))
+
+    def test_all_missing_and_extra_rows_are_reported(self):
+        expected = [(i, i + 1) for i in range(2, 5000)] + [(-1, 0)]
+        with pytest.raises(AssertionError) as e:
+            assert_rows_contain(self.rows, expected, key_columns=('a', 'b'), allow_extra=False)
+        assert '1 rows were missing: [(-1, 0)]' in str(e.value)
+        assert '2 rows were not expected: [(0, 1), (1, 2)]' in str(e.value)
+
+    def test_whole_rows_by_default(self):
+        assert_rows_contain(self.rows, [(0, 1, 'x')])
+        with pytest.raises(AssertionError):
+            assert_rows_contain(self.rows, [(0, 1, 'y')])
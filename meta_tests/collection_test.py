@@ -0,0 +1,81 @@
+import inspect
+import logging
+import time
+import types
+from unittest import TestCase
+
+import pytest
+from mock import Mock, patch
+
+import conftest
+
+logger = logging.getLogger(__name__)
+
+
+class _Item(object):
+    """Minimal stand-in for a collected pytest item"""
+
+    def __init__(self, name, module, markers=()):
+        self.name = name
+        self.module = module
+        self._markers = [getattr(pytest.mark, m).mark for m in markers]
+
+    def iter_markers(self):
+        return iter(self._markers)
+
+
+def _module(name, num_classes, upgrade=False):
+    module = types.ModuleType(name)
+    for i in range(num_classes):
+        marks = [pytest.mark.upgrade_test.mark] if upgrade and i == num_classes - 1 else []
+        setattr(module, 'TestClass{}'.format(i), type('TestClass{}'.format(i), (object,), {'pytestmark': marks}))
+    return module
+
+
+def _config(**options):
+    defaults = {"--collect-only": True, "--cassandra-dir": None, "--cassandra-version": '4.0',
+                "--use-off-heap-memtables": False, "use_off_heap_memtables": False,
+                "--force-resource-intensive-tests": False, "--skip-resource-intensive-tests": False,
+                "--use-vnodes": False, "--execute-upgrade-tests": False}
+    defaults.update(options)
+    return Mock(**{'getoption.side_effect': lambda name: defaults[name]})
+
+
+class TestCollectionModifyItems(TestCase):
+
+    def _collect(self, items, **options):
+        config = _config(**options)
+        with patch('conftest.sufficient_system_resources_for_resource_intensive_tests', return_value=True):
+            conftest.pytest_collection_modifyitems(items, config)
+        return items, config.hook.pytest_deselected.call_args[1]['items']
+
+    def test_deselection(self):
+        regular, upgrade = _module('regular', 3), _module('upgrade', 3, upgrade=True)
+        items = [_Item('plain', regular), _Item('vnodes', regular, ['vnodes']),
+                 _Item('no_vnodes', regular, ['no_vnodes']), _Item('driver', regular, ['depends_driver']),
+                 _Item('marked_upgrade', regular, ['upgrade_test']), _Item('in_upgrade_module', upgrade)]
+
+        selected, deselected = self._collect(list(items))
+        assert [i.name for i in selected] == ['plain', 'no_vnodes']
+        assert [i.name for i in deselected] == ['vnodes', 'driver', 'marked_upgrade', 'in_upgrade_module']
+
+        selected, _ = self._collect(list(items), **{"--execute-upgrade-tests": True, "--use-vnodes": True})
+        assert [i.name for i in selected] == ['plain', 'vnodes', 'marked_upgrade', 'in_upgrade_module']
+
+    def test_collection_time_is_linear_in_items(self):
+        """
+        Benchmark of the collection hook over modules shaped like the generated upgrade test modules:
+        each module is only inspected once no matter how many items it holds.
+        """
+        modules = [_module('upgrade_module_{}'.format(m), num_classes=200, upgrade=True) for m in range(5)]
+        items = [_Item('test_{}'.format(i), modules[i % len(modules)], ['since']) for i in range(5000)]
+
+        with patch('conftest.inspect.getmembers', wraps=inspect.getmembers) as getmembers:
+            start = time.time()
+            selected, deselected = self._collect(items)
+            elapsed = time.time() - start
+
+        logger.info("Filtered {} items in {:.3f}s".format(len(deselected), elapsed))
+        assert not selected and len(deselected) == 5000
+        assert getmembers.call_count == len(modules)
+        assert elapsed < 2
@@ -0,0 +1,198 @@
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+import pytest
+from ccmlib.node import ToolError
+from mock import Mock
+from cqlsh_tests.cqlsh_tools import (CopySummary, CqlshSession, assert_csv_rows_equal, assert_csvs_items_equal,
+                                     copy_benchmark_run, copy_option_matrix, csv_rows_digest, parse_copy_summary,
+                                     write_copy_benchmark_report)
+
+# answers like cqlsh reading from a pipe: HELP on an unknown topic goes to stderr
+_FAKE_CQLSH = '''#!{python}
+import os
+import sys
+sys.stderr.write('started with %s, pid %d\\n' % (' '.join(sys.argv[1:]), os.getpid()))
+for line in sys.stdin:
+    cmd = line.strip().rstrip(';')
+    if cmd.lower().startswith('help '):
+        sys.stderr.write('*** No help on %s\\n' % cmd[5:])
+    elif cmd == 'exit':
+        sys.exit(0)
+    elif cmd == 'crash':
+        sys.exit(2)
+    elif cmd.startswith('err '):
+        sys.stderr.write(cmd[4:] + '\\n')
+    else:
+        sys.stdout.write('ran %s\\r\\n' % cmd)
+'''
+
+
+class TestCqlshSession(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        cqlsh = os.path.join(self.tmpdir, 'cqlsh')
+        with open(cqlsh, 'w') as f:
+            f.write(_FAKE_CQLSH.format(python=sys.executable))
+        os.chmod(cqlsh, 0o755)
+
+        self.node = Mock(pid=1, network_interfaces={'binary': ('127.0.0.1', 9042)},
+                         **{'get_tool.return_value': cqlsh,
+                            'get_env.return_value': dict(os.environ),
+                            'get_base_cassandra_version.return_value': 4.0})
+        self.session = CqlshSession(self.node)
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _startup(self):
+        return self.session.execute('')[1]
+
+    def test_batches_share_one_process(self):
+        out, err, rc = self.session.execute('select 1; select 2;', cqlsh_options=['--debug'])
+        assert out == 'ran select 1\nran select 2\n'
+        assert err.startswith('started with --debug 127.0.0.1 9042')
+        assert rc == 0
+
+        out, err, _ = self.session.execute('select 3; err oops', cqlsh_options=['--debug'])
+        assert out == 'ran select 3\n'
+        # every batch sees the startup output, like a fresh cqlsh would
+        assert err.splitlines()[1:] == ['oops']
+        assert self.session.execute('', cqlsh_options=['--debug'])[1] == err.splitlines(True)[0]
+
+    def test_restart_on_option_or_state_change(self):
+        first = self._startup()
+        assert self._startup() == first
+
+        self.session.execute('select 1', cqlsh_options=['--debug'])
+        second = self._startup()
+        assert second != first
+
+        self.session.execute('USE ks; select 1')
+        assert self._startup() != second
+
+    def test_restart_on_cqlshrc_change(self):
+        cqlshrc = os.path.join(self.tmpdir, 'cqlshrc')
+        open(cqlshrc, 'w').close()
+        options = ['--cqlshrc={}'.format(cqlshrc)]
+        first = self.session.execute('', cqlsh_options=options)[1]
+
+        os.utime(cqlshrc, ns=(0, 0))
+        assert self.session.execute('', cqlsh_options=options)[1] != first
+
+    def test_restart_on_schema_change_between_batches(self):
+        versions = iter(['v1', 'v1', 'v1', 'v2', 'v2', 'v2', 'v3', 'v3'])
+        self.session.schema_version = lambda: next(versions)
+        first = self._startup()
+
+        # the batch itself changed the schema
+        self.session.execute('create table t')
+        assert self._startup() == first
+
+        # another client changed the schema in between
+        assert self._startup() != first
+
+    def test_exit_ends_the_session(self):
+        first = self._startup()
+        out, _, rc = self.session.execute('select 1; exit; select 2')
+        assert (out, rc) == ('ran select 1\n', 0)
+        assert self._startup() != first
+
+        with pytest.raises(ToolError) as e:
+            self.session.execute('crash')
+        assert e.value.exit_status == 2
+
+
+class TestCopyBenchmark(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_copy_summary(self):
+        assert parse_copy_summary('Starting copy...\n\n1000 rows exported to 1 files in 1.250 seconds.\n') == \
+            CopySummary(rows=1000, files=1, seconds=1.25, skipped=0)
+        summary = parse_copy_summary('200000 rows imported from 2 files in 1 minute and 2.5 seconds (3 skipped).')
+        assert summary == CopySummary(rows=200000, files=2, seconds=62.5, skipped=3)
+        assert parse_copy_summary('Failed to import') is None
+
+    def test_benchmark_run_from_rate_file(self):
+        ratefile = os.path.join(self.tmpdir, 'rates')
+        with open(ratefile, 'w') as f:
+            f.write('Processed: 2000 rows; Rate:    4000 rows/s; Avg. rate:    4000 rows/s\r\n')
+            f.write('Processed: 5000 rows; Rate:    6000 rows/s; Avg. rate:    5000 rows/s\r\n')
+            f.write('Processed: 6000 rows; Rate:    2000 rows/s; Avg. rate:    4000 rows/s\r\n')
+
+        run = copy_benchmark_run('FROM', {'NUMPROCESSES': 4}, '6000 rows imported from 1 files in 1.5 seconds (0 skipped).',
+                                 ratefile, wall_seconds=2.0)
+        assert (run.rows, run.seconds, run.rows_per_second) == (6000, 1.5, 4000)
+        assert (run.min_rate, run.median_rate, run.max_rate) == (2000, 4000, 6000)
+
+        report = write_copy_benchmark_report(os.path.join(self.tmpdir, 'reports'), '4.0', [run], build='cassandra-4.0')
+        assert os.path.basename(report) == 'copy_benchmark_4.0_cassandra-4.0.json'
+        with open(report) as f:
+            assert json.load(f)['runs'][0]['options'] == {'NUMPROCESSES': 4}
+
+    def test_option_matrix(self):
+        assert list(copy_option_matrix(NUMPROCESSES=[1, 4], CHUNKSIZE=[1000])) == \
+            [{'NUMPROCESSES': 1, 'CHUNKSIZE': 1000}, {'NUMPROCESSES': 4, 'CHUNKSIZE': 1000}]
+
+
+class TestCsvComparison(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _csv(self, name, rows, **writer_opts):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            csv.writer(f, **writer_opts).writerows(rows)
+        return path
+
+    def test_same_rows_in_any_order(self):
+        rows = [[str(i), 'value\n{}'.format(i % 7), ''] for i in range(1000)]
+        assert_csvs_items_equal(self._csv('a', rows), self._csv('b', list(reversed(rows))))
+
+    def test_duplicates_count(self):
+        with pytest.raises(AssertionError):
+            assert_csvs_items_equal(self._csv('a', [['1'], ['1'], ['2']]), self._csv('b', [['1'], ['2'], ['2']]))
+
+    def test_lines_are_compared_as_written(self):
+        rows = [['1', 'a b'], ['2', '']]
+        with pytest.raises(AssertionError):
+            assert_csvs_items_equal(self._csv('a', rows), self._csv('b', rows, quoting=csv.QUOTE_ALL))
+        with pytest.raises(AssertionError):
+            assert_csvs_items_equal(self._csv('a', rows), self._csv('b', [['1', 'a b '], ['2', '']]))
+
+    def test_bounded_diff_on_mismatch(self):
+        rows1 = [[str(i)] for i in range(100)]
+        rows2 = [[str(i)] for i in range(10, 105)]
+        with pytest.raises(AssertionError) as e:
+            assert_csv_rows_equal(lambda: iter(rows1), lambda: iter(rows2), max_diff=3, chunk_rows=7)
+        message = str(e.value)
+        assert 'Only in first (10 rows, showing 3):\n["0"]\n["1"]\n["2"]\n' in message
+        assert 'Only in second (5 rows, showing 3):\n["100"]\n["101"]\n["102"]' in message
+
+    def test_ordered(self):
+        assert_csv_rows_equal(lambda: [['1'], ['2']], lambda: [['1'], ['2']], ordered=True)
+        with pytest.raises(AssertionError) as e:
+            assert_csv_rows_equal(lambda: [['1'], ['2']], lambda: [['2'], ['1']], ordered=True)
+        assert 'at row 0' in str(e.value)
+        with pytest.raises(AssertionError):
+            assert_csv_rows_equal(lambda: [['1']], lambda: [['1'], ['2']], ordered=True)
+
+    def test_digest_is_order_independent(self):
+        assert csv_rows_digest([['a', 'b'], ['c']]) == csv_rows_digest([['c'], ['a', 'b']])
+        assert csv_rows_digest([['a', 'b']]) != csv_rows_digest([['a'], ['b']])
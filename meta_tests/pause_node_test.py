@@ -0,0 +1,91 @@
+import re
+import tempfile
+from unittest import TestCase
+
+from mock import Mock
+
+from dtest_setup import NODE_PAUSE_NOTICE_TIMEOUT, DTestSetup
+
+
+class TestPauseNode(TestCase):
+
+    def setUp(self):
+        log_dir = tempfile.mkdtemp()
+        self.dtest_setup = DTestSetup(dtest_config=Mock(log_dir=log_dir, keep_test_dir=True,
+                                                        enable_jacoco_code_coverage=False))
+        self.nodes = [self._node('node{}'.format(i)) for i in range(1, 4)]
+        self.dtest_setup.cluster = Mock(**{'nodelist.return_value': self.nodes})
+
+    def _node(self, name):
+        node = Mock(**{'is_live.return_value': True, 'mark_log.return_value': name + '-mark',
+                       'address.return_value': name})
+        node.name = name
+        # the log lines node wrote, grepped like ccm does
+        node.log = []
+        node.grep_log.side_effect = lambda expr, from_mark=None: [(line, re.search(expr, line)) for line in node.log
+                                                                  if re.search(expr, line)]
+        return node
+
+    def test_pause_waits_for_live_nodes_to_convict(self):
+        node1, node2, node3 = self.nodes
+        node3.is_live.return_value = False
+
+        self.dtest_setup.pause_node(node1)
+
+        node1.pause.assert_called_once_with()
+        node2.watch_log_for_death.assert_called_once_with(node1, from_mark='node2-mark',
+                                                          timeout=NODE_PAUSE_NOTICE_TIMEOUT)
+        node3.watch_log_for_death.assert_not_called()
+        assert list(self.dtest_setup.paused_nodes) == [node1]
+
+    def test_resume_waits_for_nodes_that_saw_node_down(self):
+        node1, node2, node3 = self.nodes
+        self.dtest_setup.pause_node(node1, wait_other_notice=False)
+        self.dtest_setup.pause_node(node2, wait_other_notice=False)
+        node3.log = ['node1 is now DOWN']
+        node2.mark_log.return_value = 'node2-resume-mark'
+        node3.mark_log.return_value = 'node3-resume-mark'
+
+        self.dtest_setup.resume_node(node1)
+
+        node1.resume.assert_called_once_with()
+        # node2 is still paused, it neither noticed node1 pausing nor will it notice it resuming
+        node2.watch_log_for_alive.assert_not_called()
+        node3.grep_log.assert_called_once_with('node1.* now (dead|DOWN|UP)', from_mark='node3-mark')
+        node3.watch_log_for_alive.assert_called_once_with(node1, from_mark='node3-resume-mark',
+                                                          timeout=NODE_PAUSE_NOTICE_TIMEOUT)
+        assert list(self.dtest_setup.paused_nodes) == [node2]
+
+    def test_nodes_resumed_together_wait_for_each_other(self):
+        node1, node2, node3 = self.nodes
+        self.dtest_setup.pause_node(node1, wait_other_notice=False)
+        # node2 convicted node1 before being paused itself, and node3 convicted both
+        node2.log = ['node1 is now DOWN']
+        self.dtest_setup.pause_node(node2, wait_other_notice=False)
+        node3.log = ['node1 is now DOWN', 'node2 is now DOWN', 'node1 is now UP']
+        for node in self.nodes:
+            node.mark_log.return_value = node.name + '-resume-mark'
+
+        self.dtest_setup.resume_nodes([node1, node2])
+
+        node1.resume.assert_called_once_with()
+        node2.resume.assert_called_once_with()
+        node1.watch_log_for_alive.assert_not_called()
+        node2.watch_log_for_alive.assert_called_once_with(node1, from_mark='node2-resume-mark',
+                                                          timeout=NODE_PAUSE_NOTICE_TIMEOUT)
+        # node3 already saw node1 UP again
+        node3.watch_log_for_alive.assert_called_once_with(node2, from_mark='node3-resume-mark',
+                                                          timeout=NODE_PAUSE_NOTICE_TIMEOUT)
+        assert not self.dtest_setup.paused_nodes
+
+    def test_cleanup_resumes_paused_nodes(self):
+        node1, node2, _ = self.nodes
+        self.dtest_setup.pause_node(node1, wait_other_notice=False)
+        self.dtest_setup.pause_node(node2, wait_other_notice=False)
+
+        self.dtest_setup.cleanup_cluster()
+
+        node1.resume.assert_called_once_with()
+        node2.resume.assert_called_once_with()
+        self.dtest_setup.cluster.stop.assert_called_once_with(gently=False)
+        assert not self.dtest_setup.paused_nodes
@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+from repair_tests.repair_test import _unrepaired_partitions
+from tools.merkle import RangeMismatch
+
+
+class TestUnrepairedPartitions(TestCase):
+
+    def setUp(self):
+        # the repaired range (100, -100] wraps around the ring
+        self.missing_on_node2 = RangeMismatch(150, 200, {('k1',): {'node1': 'd1', 'node2': None}})
+        self.differing = RangeMismatch(-200, -150, {('k2',): {'node1': 'd2', 'node2': 'other'}})
+        self.outside = RangeMismatch(-50, 0, {('k3',): {'node2': None, 'node3': 'd3'}})
+        self.mismatches = [self.differing, self.outside, self.missing_on_node2]
+
+    def test_repair_leaves_no_differences_in_range(self):
+        assert list(_unrepaired_partitions(self.mismatches, 100, -100)) == [('k2',), ('k1',)]
+        assert list(_unrepaired_partitions(self.mismatches, -100, 100)) == [('k3',)]
+        assert not _unrepaired_partitions([self.outside], 100, -100)
+
+    def test_pull_repair_only_fills_the_puller(self):
+        # node2 never pulled node1's data, only differing data held by node1 is unrepaired
+        assert list(_unrepaired_partitions(self.mismatches, 100, -100, pulled_by='node1')) == [('k2',)]
+        assert list(_unrepaired_partitions(self.mismatches, 100, -100, pulled_by='node2')) == [('k2',), ('k1',)]
@@ -0,0 +1,151 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from run_dtests import balance_shards, collect_tests, forward_output, merge_junit_reports, read_collected_tests
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _TimedStream(io.BytesIO):
+    """Records when each chunk was written"""
+
+    def __init__(self):
+        super(_TimedStream, self).__init__()
+        self.times = []
+
+    def write(self, data):
+        self.times.append(time.time())
+        return super(_TimedStream, self).write(data)
+
+
+class TestForwardOutput(TestCase):
+
+    def _run(self, script):
+        process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = _TimedStream(), _TimedStream()
+        forwarding = threading.Thread(target=forward_output, args=(process, stdout, stderr), daemon=True)
+        forwarding.start()
+        forwarding.join(timeout=30)
+        if forwarding.is_alive():
+            process.kill()
+            self.fail('forward_output blocked')
+        return process, stdout, stderr
+
+    def test_quiet_stderr_does_not_hold_back_stdout(self):
+        process, stdout, stderr = self._run('import sys, time\n'
+                                            'sys.stdout.write("first\\n"); sys.stdout.flush()\n'
+                                            'time.sleep(1)\n'
+                                            'sys.stderr.write("late\\n")\n')
+        assert process.returncode == 0
+        assert (stdout.getvalue(), stderr.getvalue()) == (b'first\n', b'late\n')
+        assert stderr.times[0] - stdout.times[0] > 0.5
+
+    def test_chatty_stderr_does_not_block_the_process(self):
+        process, stdout, stderr = self._run('import sys\n'
+                                            'sys.stderr.write("x" * 1000000)\n'
+                                            'sys.stdout.write("done")\n'
+                                            'sys.exit(3)\n')
+        assert process.returncode == 3
+        assert stdout.getvalue() == b'done'
+        assert len(stderr.getvalue()) == 1000000
+
+
+class TestCollectedTestsExporter(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmpdir, 'sample_test.py'), 'w') as f:
+            f.write('import pytest\n'
+                    'class TestSample(object):\n'
+                    '    def test_a(self): pass\n'
+                    '    @pytest.mark.parametrize("x", [1, 2])\n'
+                    '    def test_b(self, x): pass\n'
+                    'def test_module_level(): pass\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_collected_node_ids(self):
+        output = os.path.join(self.tmpdir, 'tests.json')
+        script = ('import pytest\n'
+                  'from plugins.collected_tests import CollectedTestsExporter\n'
+                  'pytest.main(["--collect-only", "-p", "no:cacheprovider", "sample_test.py"], '
+                  'plugins=[CollectedTestsExporter({!r})])\n'.format(output))
+        env = dict(os.environ, PYTHONPATH=_REPO_DIR)
+        subprocess.check_call([sys.executable, '-c', script], cwd=self.tmpdir, env=env, stdout=subprocess.DEVNULL)
+
+        assert read_collected_tests(output) == ['sample_test.py::TestSample::test_a',
+                                                'sample_test.py::TestSample::test_b[1]',
+                                                'sample_test.py::TestSample::test_b[2]',
+                                                'sample_test.py::test_module_level']
+        with open(output) as f:
+            assert isinstance(json.load(f), list)
+
+    def test_collect_tests_ignores_warnings_on_stderr(self):
+        with open(os.path.join(self.tmpdir, 'warning_test.py'), 'w') as f:
+            f.write('import sys\n'
+                    'sys.stderr.write("SyntaxWarning: invalid escape sequence\\n")\n'
+                    'def test_warned(): pass\n')
+        tests = collect_tests(['-p', 'no:cacheprovider', os.path.join(self.tmpdir, 'warning_test.py')])
+        assert [test.split('::')[-1] for test in tests] == ['test_warned']
+
+    def test_collect_tests_without_tests(self):
+        open(os.path.join(self.tmpdir, 'empty_test.py'), 'w').close()
+        assert collect_tests(['-p', 'no:cacheprovider', os.path.join(self.tmpdir, 'empty_test.py')]) == []
+        with self.assertRaises(Exception):
+            collect_tests(['-p', 'no:cacheprovider', os.path.join(self.tmpdir, 'missing_test.py')])
+
+
+class TestShards(TestCase):
+
+    def test_balanced_by_duration(self):
+        tests = ['a.py::TestA::test_1', 'a.py::TestA::test_2', 'b.py::TestB::test_1', 'c.py::test_1',
+                 'c.py::test_2', 'd.py::TestD::test_1[1]', 'd.py::TestD::test_1[2]']
+        durations = {'a.py::TestA::test_1': 100, 'a.py::TestA::test_2': 50, 'b.py::TestB::test_1': 90,
+                     'c.py::test_1': 20, 'c.py::test_2': 20, 'd.py::TestD::test_1[1]': 30}
+        shards = balance_shards(tests, durations, 3)
+
+        # classes and module level tests of a module stay together, the unknown test counts as the median (50s)
+        assert [shard.tests for shard in shards] == [['a.py::TestA::test_1', 'a.py::TestA::test_2'],
+                                                     ['b.py::TestB::test_1'],
+                                                     ['c.py::test_1', 'c.py::test_2',
+                                                      'd.py::TestD::test_1[1]', 'd.py::TestD::test_1[2]']]
+        assert [shard.estimated_seconds for shard in shards] == [150, 90, 120]
+
+    def test_no_empty_shards(self):
+        assert [shard.tests for shard in balance_shards(['a.py::TestA::test_1'], {}, 4)] == [['a.py::TestA::test_1']]
+        assert balance_shards(['a.py::TestA::test_1'], {}, 4)[0].estimated_seconds == 60
+
+    def test_merge_junit_reports(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for shard, (failures, cases) in enumerate([(1, ['test_a', 'test_b']), (0, ['test_c'])]):
+                path = os.path.join(tmpdir, 'junit{}.xml'.format(shard))
+                with open(path, 'w') as f:
+                    f.write('<?xml version="1.0" encoding="utf-8"?>'
+                            '<testsuite errors="0" failures="{}" name="Cassandra dtests" skips="0" tests="{}" time="1.5">'
+                            '<properties><property name="USE_VNODES" value="False"/></properties>{}</testsuite>'
+                            .format(failures, len(cases),
+                                    ''.join('<testcase classname="x.Test" name="{}" time="0.5"/>'.format(c)
+                                            for c in cases)))
+                paths.append(path)
+
+            merged_path = os.path.join(tmpdir, 'junit.xml')
+            merge_junit_reports(paths + [os.path.join(tmpdir, 'crashed_shard.xml')], merged_path)
+
+            merged = ElementTree.parse(merged_path).getroot()
+            assert (merged.get('tests'), merged.get('failures'), merged.get('time')) == ('3', '1', '3.000')
+            assert [case.get('name') for case in merged.findall('testcase')] == ['test_a', 'test_b', 'test_c']
+            assert len(merged.findall('properties')) == 1
+        finally:
+            shutil.rmtree(tmpdir)
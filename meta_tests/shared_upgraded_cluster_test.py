@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from upgrade_tests.upgrade_base import SharedUpgradedCluster
+
+
+class TestSharedUpgradedCluster(TestCase):
+
+    def setUp(self):
+        patches = [patch('upgrade_tests.upgrade_base.DTestSetup', side_effect=self._dtest_setup),
+                   patch('upgrade_tests.upgrade_base.start_cluster_on_starting_version'),
+                   patch('upgrade_tests.upgrade_base.upgrade_node')]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.setups = []
+        self.create_cluster = Mock()
+        self.shared = SharedUpgradedCluster(Mock(), Mock())
+
+    def _dtest_setup(self, **kwargs):
+        nodes = [Mock(pid=i, **{'get_install_dir.return_value': '/install', 'is_running.return_value': True})
+                 for i in (1, 2)]
+        keyspaces = {'system': None, 'ks': None}
+        session = Mock(**{'execute.side_effect': lambda query: keyspaces.pop('ks', None)})
+        session.cluster.metadata.keyspaces = keyspaces
+        dtest_setup = Mock(connections=[session], **{'patient_exclusive_cql_connection.return_value': session})
+        dtest_setup.cluster.nodelist.return_value = nodes
+        self.setups.append(dtest_setup)
+        return dtest_setup
+
+    def test_cluster_is_reused_after_cleanup(self):
+        first = self.shared.acquire('key', {}, self.create_cluster)
+        self.shared.finish_test()
+        assert self.shared.acquire('key', {}, self.create_cluster) is first
+        assert len(self.setups) == 1
+        # later tests only see their own log errors
+        for node in first.nodelist():
+            node.mark_log_for_errors.assert_called_once_with()
+
+    def test_cluster_is_replaced(self):
+        first = self.shared.acquire('key', {}, self.create_cluster)
+        # a test that doesn't hand the cluster back through finish_test
+        assert self.shared.acquire('key', {}, self.create_cluster) is not first
+        self.setups[0].cleanup_cluster.assert_called_once_with()
+
+        second = self.setups[1].cluster
+        second.nodelist()[0].pid = 99
+        self.shared.finish_test()
+        assert not self.shared.reusable
+        self.shared.acquire('key', {}, self.create_cluster)
+
+        self.shared.finish_test()
+        assert self.shared.reusable
+        self.shared.acquire('other config', {}, self.create_cluster)
+        assert len(self.setups) == 4
+
+        self.shared.release()
+        self.setups[3].cleanup_cluster.assert_called_once_with()
+
+    def test_cluster_is_created_with_the_tests_function(self):
+        self.shared.acquire('key', {}, self.create_cluster)
+        self.setups[0].initialize_cluster.assert_called_once_with(self.create_cluster)
+        self.shared.finish_test()
+
+        # a class overriding fixture_dtest_create_cluster_func gets a cluster of its own
+        other_create_cluster = Mock()
+        self.shared.acquire('key', {}, other_create_cluster)
+        assert len(self.setups) == 2
+        self.setups[1].initialize_cluster.assert_called_once_with(other_create_cluster)
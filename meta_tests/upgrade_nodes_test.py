@@ -0,0 +1,62 @@
+import time
+from unittest import TestCase
+
+import pytest
+from mock import Mock, call
+
+from upgrade_tests.upgrade_base import drain_and_stop_nodes, run_on_nodes, start_nodes_together
+
+
+class TestUpgradeNodes(TestCase):
+
+    def _node(self, name, live=False):
+        node = Mock(mark=name + '-mark', **{'is_live.return_value': live, 'mark_log.return_value': name + '-live-mark'})
+        node.name = name
+        return node
+
+    def test_nodes_are_drained_and_stopped_at_once(self):
+        nodes = [self._node('node{}'.format(i)) for i in range(3)]
+        for node in nodes:
+            node.drain.side_effect = lambda **kwargs: time.sleep(0.5)
+
+        start = time.time()
+        drain_and_stop_nodes(nodes)
+        assert time.time() - start < 1.4
+        for node in nodes:
+            assert node.method_calls[:2] == [call.drain(block_on_log=True), call.stop(wait_other_notice=False)]
+
+    def test_failures_are_raised_after_all_nodes_finished(self):
+        finished = []
+
+        def upgrade(node):
+            if node == 'node1':
+                raise RuntimeError("node1 failed to start")
+            time.sleep(0.2)
+            finished.append(node)
+
+        with pytest.raises(RuntimeError, match='node1'):
+            run_on_nodes(upgrade, ['node1', 'node2', 'node3'])
+        assert sorted(finished) == ['node2', 'node3']
+
+    def test_started_nodes_wait_for_each_other(self):
+        node1, node2 = self._node('node1'), self._node('node2')
+        live = self._node('node3', live=True)
+        cluster = Mock(**{'nodelist.return_value': [node1, node2, live]})
+
+        start_nodes_together(cluster, [node1, node2], wait_other_notice=240, use_jna=True)
+
+        for node, other in ((node1, node2), (node2, node1)):
+            node.start.assert_called_once_with(wait_other_notice=False, wait_for_binary_proto=False, use_jna=True)
+            node.wait_for_binary_interface.assert_called_once_with(from_mark=node.mark)
+            node.watch_log_for_alive.assert_called_once_with([other, live], from_mark=node.mark, timeout=240)
+        live.start.assert_not_called()
+        live.watch_log_for_alive.assert_called_once_with([node1, node2], from_mark='node3-live-mark', timeout=240)
+
+    def test_rolling_restart_of_one_node(self):
+        node1 = self._node('node1')
+        cluster = Mock(**{'nodelist.return_value': [node1]})
+
+        start_nodes_together(cluster, [node1], wait_other_notice=False)
+
+        node1.wait_for_binary_interface.assert_called_once_with(from_mark=node1.mark)
+        node1.watch_log_for_alive.assert_not_called()
@@ -0,0 +1,112 @@
+from collections import namedtuple
+from unittest import TestCase
+
+import pytest
+from mock import Mock
+from cassandra.cqltypes import UTF8Type
+from cassandra.query import BatchStatement, BatchType, PreparedStatement
+from tools.data import bulk_load, insert_columns
+
+
+class _ImmediateFuture(object):
+    """Response future whose callbacks fire as soon as they are added"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        if self.error is None:
+            callback([], *callback_args)
+        else:
+            errback(self.error, *errback_args)
+
+
+class TestBulkLoad(TestCase):
+
+    def _session(self, replicas, errors=()):
+        session = Mock()
+        session.keyspace = 'ks'
+        session.cluster.metadata.get_replicas.return_value = replicas
+        futures = iter([_ImmediateFuture(error=e) for e in errors])
+        session.execute_async.side_effect = lambda bound, host=None: next(futures, _ImmediateFuture())
+        return session
+
+    def test_rows_are_consumed_lazily_from_a_generator(self):
+        session = self._session(replicas=[])
+        prepared = Mock()
+        stats = bulk_load(session, prepared, ([k] for k in range(50)))
+        assert stats.rows == 50
+        assert prepared.bind.call_count == 50
+        assert session.execute_async.call_count == 50
+
+    def test_requests_go_to_a_live_replica(self):
+        down, up = Mock(is_up=False), Mock(is_up=True)
+        session = self._session(replicas=[down, up])
+        bulk_load(session, Mock(), [[1], [2]])
+        for _, kwargs in session.execute_async.call_args_list:
+            assert kwargs['host'] is up
+
+    def test_not_token_aware_lets_the_policy_choose(self):
+        session = self._session(replicas=[Mock(is_up=True)])
+        bulk_load(session, Mock(), [[1], [2]], token_aware=False)
+        for _, kwargs in session.execute_async.call_args_list:
+            assert kwargs['host'] is None
+        session.cluster.metadata.get_replicas.assert_not_called()
+
+    def test_first_error_is_raised(self):
+        session = self._session(replicas=[], errors=[None, ValueError('boom')])
+        with pytest.raises(ValueError):
+            bulk_load(session, Mock(), ([k] for k in range(10)))
+        # no new requests are issued once an error was seen
+        assert session.execute_async.call_count == 2
+
+    def test_callback_sees_each_completed_row(self):
+        session = self._session(replicas=[])
+        completed = []
+        bulk_load(session, Mock(), ([k] for k in range(5)),
+                  callback=lambda args, rows, latency: completed.append((args, rows, latency >= 0)))
+        assert completed == [([k], [], True) for k in range(5)]
+
+    def test_callback_errors_are_raised(self):
+        session = self._session(replicas=[])
+
+        def check(args, rows, latency):
+            assert args != [2], "Data did not match expected value!"
+
+        with pytest.raises(AssertionError, match="Data did not match"):
+            bulk_load(session, Mock(), ([k] for k in range(10)), callback=check)
+        assert session.execute_async.call_count == 3
+
+
+class TestInsertColumns(TestCase):
+
+    def _prepared_update(self):
+        column = namedtuple('column', ['keyspace_name', 'table_name', 'name', 'type'])
+        columns = [column('ks', 'cf', name, UTF8Type) for name in ('v', 'key', 'c')]
+        return PreparedStatement(columns, b'id', [1], 'UPDATE cf SET v=? WHERE key=? AND c=?', 'ks', 4, None, None)
+
+    def test_single_prepared_batch_per_call(self):
+        session = Mock(keyspace='ks')
+        session.prepare.return_value = self._prepared_update()
+        insert_columns(None, session, 1, 10)
+        insert_columns(None, session, 2, 10, unlogged=True)
+
+        # the prepared statement is shared across calls
+        session.prepare.assert_called_once_with('UPDATE cf SET v=? WHERE key=? AND c=?')
+        logged, unlogged = [args[0] for args, _ in session.execute.call_args_list]
+        assert isinstance(logged, BatchStatement) and logged.batch_type == BatchType.LOGGED
+        assert unlogged.batch_type == BatchType.UNLOGGED
+        assert len(logged) == 10
+
+    def test_recreated_table_is_prepared_again(self):
+        session = Mock(keyspace='ks')
+        session.prepare.return_value = self._prepared_update()
+        session.cluster.metadata.keyspaces = {'ks': Mock(tables={'cf': Mock()})}
+        insert_columns(None, session, 1, 10)
+        insert_columns(None, session, 1, 10)
+        assert session.prepare.call_count == 1
+
+        # dropping and creating cf again replaces its metadata
+        session.cluster.metadata.keyspaces['ks'].tables['cf'] = Mock()
+        insert_columns(None, session, 1, 10)
+        assert session.prepare.call_count == 2
@@ -0,0 +1,56 @@
+from itertools import count
+from unittest import TestCase
+
+from mock import Mock
+from tools.datahelp import RowSet, create_rows, parse_data_into_dicts
+
+
+class _DoneFuture(object):
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        callback([], *callback_args)
+
+
+class TestParseDataIntoDicts(TestCase):
+
+    data = """
+           | id | value   |
+           +----+---------+
+           | 1  | testing |
+      *3   | 2  | more    |
+           """
+
+    def test_multiplied_rows_call_format_funcs_per_row(self):
+        ids = count(10)
+        rows = parse_data_into_dicts(self.data, format_funcs={'id': lambda _: next(ids)})
+        assert rows == [{'id': 10, 'value': 'testing'}, {'id': 11, 'value': 'more'},
+                        {'id': 12, 'value': 'more'}, {'id': 13, 'value': 'more'}]
+
+    def test_rows_are_stored_as_tuples(self):
+        rows = parse_data_into_dicts(self.data, format_funcs={'id': int})
+        assert rows.columns == ('id', 'value')
+        assert rows.tuples() == [(1, 'testing'), (2, 'more'), (2, 'more'), (2, 'more')]
+        assert rows[1:2] == RowSet(('id', 'value'), [(2, 'more')])
+
+    def test_create_rows_streams_values(self):
+        session = Mock()
+        session.cluster.metadata.get_replicas.return_value = []
+        session.execute_async.return_value = _DoneFuture()
+        expected = create_rows(self.data, session, 'paging_test', format_funcs={'id': int})
+
+        session.prepare.assert_called_once_with(" INSERT INTO paging_test (id, value) values (?, ?) ")
+        bound_values = [args[0] for args, _ in session.prepare.return_value.bind.call_args_list]
+        assert bound_values == [(1, 'testing'), (2, 'more'), (2, 'more'), (2, 'more')]
+        assert expected.tuples() == bound_values
+        expected.append({'id': 3, 'value': 'last'})
+        assert expected[-1] == {'id': 3, 'value': 'last'}
+
+    def test_rows_read_back_are_read_only(self):
+        rows = parse_data_into_dicts(self.data, format_funcs={'id': int})
+        with self.assertRaises(TypeError):
+            rows[0]['value'] = 'changed'
+        with self.assertRaises(TypeError):
+            next(iter(rows))['value'] = 'changed'
+
+        rows[0] = dict(rows[0], value='changed')
+        assert rows[0] == {'id': 1, 'value': 'changed'}
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ccmlib.node import Node
+from mock import Mock, create_autospec
+from tools.dataset_cache import SSTableDatasetCache, dataset_key, load_or_create_dataset
+
+
+class TestDatasetKey(TestCase):
+
+    def test_key_ignores_schema_formatting(self):
+        """
+        Whitespace and case differences in the schema CQL don't create a new dataset.
+        """
+        assert dataset_key('4.0', 'CREATE TABLE ks.cf (key int PRIMARY KEY)', 0, 10) == \
+            dataset_key('4.0', 'create table  ks.cf (key int\n PRIMARY KEY)', 0, 10)
+
+    def test_key_changes_with_each_component(self):
+        base = dataset_key('4.0', 'CREATE TABLE ks.cf (key int PRIMARY KEY)', 0, 10)
+        assert base != dataset_key('3.11', 'CREATE TABLE ks.cf (key int PRIMARY KEY)', 0, 10)
+        assert base != dataset_key('4.0', 'CREATE TABLE ks.cf (key text PRIMARY KEY)', 0, 10)
+        assert base != dataset_key('4.0', 'CREATE TABLE ks.cf (key int PRIMARY KEY)', 1, 10)
+        assert base != dataset_key('4.0', 'CREATE TABLE ks.cf (key int PRIMARY KEY)', 0, 11)
+
+
+class TestSSTableDatasetCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = SSTableDatasetCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _mock_node(self, name, cluster='cluster1', version='3.11'):
+        data_dir = os.path.join(self.tmpdir, cluster, name, 'data0')
+        table_dir = os.path.join(data_dir, 'ks', 'cf-1234')
+        os.makedirs(os.path.join(table_dir, 'snapshots'))
+        # spec'd on ccm's Node, so calls have to match its signatures
+        node = create_autospec(Node, instance=True)
+        node.data_directories.return_value = [data_dir]
+        node.get_cassandra_version.return_value = version
+        node.name = name
+        return node, table_dir
+
+    def test_store_then_load_with_refresh(self):
+        node, table_dir = self._mock_node('node1')
+        for component in ('md-1-big-Data.db', 'md-1-big-Index.db'):
+            with open(os.path.join(table_dir, component), 'w') as f:
+                f.write(component)
+
+        assert not self.cache.has('key')
+        self.cache.store([node], 'ks', 'cf', 'key')
+        assert self.cache.has('key')
+        node.flush.assert_called_once_with(options=['ks', 'cf'])
+        assert sorted(os.listdir(os.path.join(self.cache.path_for('key'), 'node1'))) == \
+            ['md-1-big-Data.db', 'md-1-big-Index.db']
+
+        # a fresh cluster has an empty table
+        new_node, new_table_dir = self._mock_node('node1', cluster='cluster2')
+        self.cache.load([new_node], 'ks', 'cf', 'key')
+        assert sorted(os.listdir(new_table_dir)) == ['md-1-big-Data.db', 'md-1-big-Index.db', 'snapshots']
+        new_node.nodetool.assert_called_once_with('refresh ks cf')
+
+    def test_dataset_is_created_once_then_imported(self):
+        def populate(session, rows, seed):
+            populated.append((rows, seed))
+            with open(os.path.join(table_dir, 'na-1-big-Data.db'), 'w') as f:
+                f.write('data')
+
+        populated = []
+        node, table_dir = self._mock_node('node1', version='4.0')
+        tester = Mock(dtest_config=Mock(dataset_cache_dir=self.cache.cache_dir))
+        tester.cluster.nodelist.return_value = [node]
+        assert not load_or_create_dataset(tester, Mock(), 'ks', 'cf', 'CREATE TABLE ks.cf', 10, populate)
+        assert populated == [(10, 0)]
+
+        new_node, _ = self._mock_node('node1', cluster='cluster2', version='4.0')
+        tester.cluster.nodelist.return_value = [new_node]
+        for _ in range(2):
+            assert load_or_create_dataset(tester, Mock(), 'ks', 'cf', 'CREATE TABLE ks.cf', 10, populate)
+        assert populated == [(10, 0)]
+
+        # the sstables are copied, so the cache still has them for the next run
+        node_dir = os.path.join(self.cache.path_for(dataset_key('4.0', 'CREATE TABLE ks.cf', 0, 10)), 'node1')
+        new_node.nodetool.assert_called_with('import --copy-data ks cf {}'.format(node_dir))
+        assert os.listdir(node_dir) == ['na-1-big-Data.db']
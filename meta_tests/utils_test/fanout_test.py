@@ -0,0 +1,102 @@
+import threading
+import time
+from unittest import TestCase
+
+import pytest
+from cassandra import Unavailable
+
+from dtest import MultiError
+from tools.fanout import Request, run_scenarios_async
+
+
+class _Future(object):
+
+    def __init__(self, session, statement):
+        self.session = session
+        self.statement = statement
+
+    def add_callbacks(self, callback, errback):
+        def complete():
+            time.sleep(0.01)
+            with self.session.lock:
+                self.session.in_flight -= 1
+            try:
+                rows = self.session.execute(self.statement)
+            except Exception as e:
+                errback(e)
+            else:
+                callback(rows)
+        threading.Thread(target=complete).start()
+
+
+class _Session(object):
+    """Executes ('set', key, value) and ('get', key) statements against a dict"""
+
+    def __init__(self, data):
+        self.data = data
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cluster = type('Cluster', (object,), {'contact_points': ['127.0.0.1']})
+
+    def execute_async(self, statement):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return _Future(self, statement)
+
+    def execute(self, statement):
+        if statement[0] == 'unavailable':
+            raise Unavailable('not enough replicas')
+        if statement[0] == 'set':
+            self.data[statement[1]] = statement[2]
+            return []
+        return [(self.data.get(statement[1]),)]
+
+
+class TestRunScenariosAsync(TestCase):
+
+    def test_scenarios_run_concurrently_and_in_order(self):
+        data = {}
+        sessions = [_Session(data), _Session(data)]
+
+        def scenario(key):
+            yield [Request(sessions[0], ('set', key, 1))]
+            responses = yield [Request(s, ('get', key)) for s in sessions]
+            assert [r.rows for r in responses] == [[(1,)], [(1,)]]
+            yield []
+            yield [Request(sessions[1], ('unavailable',), (Unavailable,))]
+
+        start = time.time()
+        run_scenarios_async([('key {}'.format(k), scenario(k)) for k in range(100)], max_in_flight=50)
+
+        # 100 scenarios of 4 sequential 10ms steps each, 50 requests at a time
+        assert time.time() - start < 2
+        assert sorted(data) == list(range(100))
+        assert sessions[0].max_in_flight + sessions[1].max_in_flight > 2
+        assert sessions[0].max_in_flight <= 50
+
+    def test_failures_are_collected(self):
+        data = {}
+        session = _Session(data)
+        finished = []
+
+        def scenario(key):
+            responses = yield [Request(session, ('get', key))]
+            if key == 1:
+                assert responses[0].rows == [(key,)], "Got {} for key {}".format(responses[0].rows, key)
+            elif key == 2:
+                yield [Request(session, ('unavailable',))]
+            elif key == 3:
+                yield [Request(session, ('set', key, 1), (Unavailable,))]
+            finished.append(key)
+
+        with pytest.raises(MultiError) as e:
+            run_scenarios_async([('key {}'.format(k), scenario(k)) for k in range(5)])
+
+        messages = sorted(str(exception) for exception in e.value.exceptions)
+        assert len(messages) == 3
+        assert messages[0].startswith('key 1: Got [(None,)] for key 1')
+        assert messages[1].startswith("key 2: ('unavailable',) via ['127.0.0.1'] failed: Unavailable(")
+        assert messages[2] == "key 3: ('set', 3, 1) via ['127.0.0.1'] succeeded, expected one of ['Unavailable']"
+        assert sorted(finished) == [0, 4]
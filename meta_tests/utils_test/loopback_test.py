@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+import pytest
+from mock import Mock
+
+from tools.loopback import loopback_address, use_loopback_block
+
+
+class TestLoopbackBlock(TestCase):
+
+    def _node(self, i):
+        address = '127.0.0.{}'.format(i)
+        return Mock(network_interfaces={'thrift': None, 'storage': (address, 7000), 'binary': (address, 9042)},
+                    ip_addr=address, jmx_port=str(7000 + i * 100), remote_debug_port='0',
+                    byteman_port=str(4000 + i * 100))
+
+    def test_added_nodes_move_into_the_block(self):
+        cluster = Mock()
+        add = cluster.add
+        use_loopback_block(cluster, 3)
+
+        node = self._node(2)
+        cluster.add(node, True, data_center='dc1')
+        add.assert_called_once_with(node, True, data_center='dc1')
+        assert node.network_interfaces == {'thrift': None, 'storage': ('127.0.3.2', 7000),
+                                           'binary': ('127.0.3.2', 9042)}
+        assert (node.ip_addr, node.jmx_port, node.remote_debug_port, node.byteman_port) == \
+            ('127.0.3.2', '7230', '0', '4230')
+
+    def test_default_block_and_bounds(self):
+        cluster = Mock()
+        add = cluster.add
+        assert use_loopback_block(cluster, 0).add is add
+        with pytest.raises(ValueError):
+            use_loopback_block(cluster, 10)
+        assert loopback_address('10.0.0.1', 2) == '10.0.0.1'
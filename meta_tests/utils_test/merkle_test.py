@@ -0,0 +1,111 @@
+import threading
+from collections import namedtuple
+from unittest import TestCase
+
+import pytest
+from cassandra import InvalidRequest
+from cassandra.metadata import Murmur3Token, MD5Token
+from mock import Mock
+
+from tools.merkle import MAX_TOKEN, MIN_TOKEN, MerkleTree, compare_replicas, split_ring
+from tools.replicas import NODE_LOCAL, partition_digest
+
+Row = namedtuple('Row', ['pk', 'v'])
+
+
+def _column(name):
+    column = Mock(is_static=False)
+    column.name = name
+    return column
+
+
+class _Session(object):
+    """Answers token range reads from {pk: v} data, using pk as its own token"""
+
+    def __init__(self, data, cluster):
+        self.data = data
+        self.cluster = cluster
+        self.lock = threading.Lock()
+        self.reads = []
+
+    def execute(self, statement, parameters):
+        assert statement.consistency_level == NODE_LOCAL
+        assert statement.query_string == 'SELECT * FROM "ks"."t" WHERE token("pk") > %s AND token("pk") <= %s'
+        start, end = parameters
+        with self.lock:
+            self.reads.append(parameters)
+        return [Row(pk, self.data[pk]) for pk in sorted(self.data) if start < pk <= end]
+
+
+class TestMerkle(TestCase):
+
+    def test_differences_descend_into_differing_subtrees(self):
+        leaves = ['leaf{}'.format(i) for i in range(7)]
+        tree = MerkleTree(leaves)
+        assert tree.differences(MerkleTree(leaves)) == []
+        assert MerkleTree(['single']).differences(MerkleTree(['other'])) == [0]
+
+        changed = list(leaves)
+        changed[2] = changed[6] = 'changed'
+        other = MerkleTree(changed)
+        assert tree.root != other.root
+        assert tree.differences(other) == [2, 6]
+
+    def test_split_ring_covers_the_ring(self):
+        for ring in ([0], [MIN_TOKEN, 0, 100], [-50, 10, 2 ** 62]):
+            ranges = split_ring(ring, leaves=16)
+            assert [end for end, _ in ranges] == ring
+
+            subranges = sorted(subrange for _, subranges in ranges for subrange in subranges)
+            assert subranges[0][0] == MIN_TOKEN and subranges[-1][1] == MAX_TOKEN
+            assert all(previous[1] == subrange[0] for previous, subrange in zip(subranges, subranges[1:]))
+            assert all(start < end for start, end in subranges)
+            assert 16 <= len(subranges) <= 16 + 2 * len(ring)
+
+    def _replicas(self, datas, ring, replicas_of):
+        hosts = [Mock(address='127.0.0.{}'.format(i + 1)) for i in range(len(datas))]
+        table = Mock(partition_key=[_column('pk')], clustering_key=[], columns={'pk': _column('pk'), 'v': _column('v')})
+        cluster = Mock()
+        cluster.metadata.keyspaces = {'ks': Mock(tables={'t': table})}
+        cluster.metadata.token_map = Mock(token_class=Murmur3Token, ring=[Murmur3Token(t) for t in ring],
+                                          **{'get_replicas.side_effect':
+                                             lambda ks, token: [hosts[i] for i in replicas_of[token.value]]})
+        nodes_and_sessions = []
+        for i, data in enumerate(datas):
+            node = Mock(**{'address.return_value': '127.0.0.{}'.format(i + 1)})
+            node.name = 'node{}'.format(i + 1)
+            nodes_and_sessions.append((node, _Session(data, cluster)))
+        return nodes_and_sessions
+
+    def test_only_mismatching_ranges_and_partitions_are_returned(self):
+        data = {pk: 'value{}'.format(pk) for pk in range(-1000, 1000, 7)}
+        missing, changed = dict(data), dict(data)
+        del missing[-1000]
+        changed[300] = 'changed'
+        changed[998] = 'only on node3'
+        # node1 and node2 replicate (-500, 500], node2 and node3 (500, -500]
+        nodes_and_sessions = self._replicas([data, missing, changed], [-500, 500], {-500: [1, 2], 500: [0, 1]})
+
+        mismatches = compare_replicas(nodes_and_sessions, 'ks', 't', leaves=64, max_workers=4)
+
+        assert [m.partitions for m in mismatches] == [
+            {('-1000',): {'node2': None, 'node3': partition_digest([((), {'v': 'value-1000'})])}},
+            {('998',): {'node2': None, 'node3': partition_digest([((), {'v': 'only on node3'})])}}]
+        assert mismatches[0].start < -1000 <= mismatches[0].end
+        assert mismatches[1].start < 998 <= mismatches[1].end
+        # node3 isn't a replica of 300, and the second pass only reads the two mismatching subranges
+        _, node3 = nodes_and_sessions[2]
+        assert len(node3.reads) == len(set(node3.reads)) + 2
+
+    def test_other_partitioners_are_refused(self):
+        nodes_and_sessions = self._replicas([{}], [0], {0: [0]})
+        nodes_and_sessions[0][1].cluster.metadata.token_map.token_class = MD5Token
+        with pytest.raises(ValueError, match='MD5Token'):
+            compare_replicas(nodes_and_sessions, 'ks', 't')
+
+    def test_disabled_node_local_reads_are_reported(self):
+        nodes_and_sessions = self._replicas([{}, {}], [0], {0: [0, 1]})
+        error = InvalidRequest('NODE_LOCAL consistency level is highly dangerous and should be used only for debugging')
+        nodes_and_sessions[1][1].execute = Mock(side_effect=error)
+        with pytest.raises(ValueError, match='node2 refused a NODE_LOCAL read.*enable_node_local_reads'):
+            compare_replicas(nodes_and_sessions, 'ks', 't', leaves=4)
@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+import pytest
+from tools.datahelp import RowSet
+from tools.paging import PageAssertionMixin, PageFetcher
+
+
+class _FakePagedFuture(object):
+    """Response future delivering the given pages synchronously"""
+
+    def __init__(self, pages):
+        self.pages = list(pages)
+        self.callback = None
+
+    def add_callbacks(self, callback, errback):
+        self.callback = callback
+        self.callback(self.pages.pop(0))
+
+    @property
+    def has_more_pages(self):
+        return len(self.pages) > 0
+
+    def start_fetching_next_page(self):
+        self.callback(self.pages.pop(0))
+
+
+class TestPageFetcher(TestCase):
+
+    def _pages(self):
+        return [[[p, i] for i in range(3)] for p in range(4)]
+
+    def test_rows_not_kept(self):
+        seen = []
+        pf = PageFetcher(_FakePagedFuture(self._pages()),
+                         page_checker=lambda page_num, rows: seen.append((page_num, len(rows))),
+                         keep_rows=False).request_all()
+        assert seen == [(1, 3), (2, 3), (3, 3), (4, 3)]
+        assert pf.num_results_all() == [3, 3, 3, 3]
+        assert pf.num_results_total() == 12
+        assert pf.pages[0].data is None
+        with pytest.raises(RuntimeError):
+            pf.all_data()
+
+    def test_digest_matches_kept_rows_fetch(self):
+        streamed = PageFetcher(_FakePagedFuture(self._pages()), keep_rows=False).request_all()
+        kept = PageFetcher(_FakePagedFuture(self._pages())).request_all()
+        assert streamed.digest() == kept.digest()
+        assert len(kept.all_data()) == 12
+
+    def test_checker_failure_is_raised(self):
+        def checker(page_num, rows):
+            assert page_num < 3, "bad page"
+
+        with pytest.raises(AssertionError):
+            PageFetcher(_FakePagedFuture(self._pages()), page_checker=checker).request_all()
+
+
+class TestPageAssertionMixin(TestCase):
+
+    def setUp(self):
+        self.mixin = PageAssertionMixin()
+
+    def test_values_containing_separators_do_not_collide(self):
+        # both rows used to flatten to 'a__x__b__y'
+        with pytest.raises(AssertionError):
+            self.mixin.assertEqualIgnoreOrder([{'a': 'x__b__y'}], [{'a': 'x', 'b': 'y'}])
+
+    def test_duplicates_are_compared(self):
+        self.mixin.assertEqualIgnoreOrder([{'a': 1}, {'a': 1}, {'a': 2}], [{'a': 2}, {'a': 1}, {'a': 1}])
+        with pytest.raises(AssertionError):
+            self.mixin.assertEqualIgnoreOrder([{'a': 1}, {'a': 2}], [{'a': 2}, {'a': 1}, {'a': 1}])
+
+    def test_subset_of_row_set(self):
+        rows = RowSet(('id', 'value'), [(1, {'k': 'v'}), (2, {'k': 'w'})])
+        self.mixin.assertIsSubsetOf([{'value': {'k': 'v'}, 'id': 1}], rows)
+        with pytest.raises(AssertionError):
+            self.mixin.assertIsSubsetOf([{'id': 3, 'value': {}}], rows)
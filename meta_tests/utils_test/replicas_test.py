@@ -0,0 +1,133 @@
+import os
+import tempfile
+from collections import namedtuple
+from distutils.version import LooseVersion
+from unittest import TestCase
+
+import pytest
+from cassandra import InvalidRequest
+from mock import Mock, patch
+
+from tools.replicas import ENABLE_NODE_LOCAL_QUERIES, NODE_LOCAL, enable_node_local_reads, partition_digest, \
+    read_replica_digests, read_replicas_digests, supports_replica_digests
+
+Row = namedtuple('Row', ['pk', 'ck', 's', 'v'])
+
+
+def _column(name, is_static=False):
+    column = Mock(is_static=is_static)
+    column.name = name
+    return column
+
+
+def _session(rows):
+    table = Mock(partition_key=[_column('pk')], clustering_key=[_column('ck')],
+                 columns={name: _column(name, is_static=name == 's') for name in Row._fields})
+    session = Mock(**{'execute.return_value': rows})
+    session.cluster.metadata.keyspaces = {'ks': Mock(tables={'t': table})}
+    return session
+
+
+def _node(version, name='node1'):
+    node = Mock(**{'get_cassandra_version.return_value': LooseVersion(version)})
+    node.name = name
+    return node
+
+
+def _dumped(key, rows, deletion=None):
+    partition = {'key': [key], 'position': 0}
+    if deletion is not None:
+        partition['deletion_info'] = {'marked_deleted': deletion, 'local_delete_time': 0}
+    return {'partition': partition, 'rows': rows}
+
+
+def _row(ck, tstamp, cells, **extra):
+    row = {'type': 'row', 'position': 0, 'clustering': [ck], 'liveness_info': {'tstamp': tstamp}, 'cells': cells}
+    row.update(extra)
+    return row
+
+
+class TestReplicas(TestCase):
+
+    def test_partition_digest_ignores_row_order_and_value_types(self):
+        rows = [(None, {'s': 'static'}), ((1,), {'v': 10}), ((2,), {})]
+        assert partition_digest(rows) == partition_digest([(('2',), {}), (('1',), {'v': '10'}), (None, {'s': 'static'})])
+        assert partition_digest(rows) != partition_digest(rows[1:])
+        assert partition_digest([((1,), {'v': 10})]) != partition_digest([((1,), {'v': 11})])
+
+    def test_node_local_reads(self):
+        session = _session([Row(1, 1, 'static', 10), Row(1, 2, 'static', None), Row(2, None, 'only static', None),
+                            Row(3, 1, None, 30)])
+
+        digests = read_replica_digests(_node('4.0'), session, 'ks', 't')
+
+        statement, parameters = session.execute.call_args[0]
+        assert statement.consistency_level == NODE_LOCAL
+        assert parameters is None
+        assert list(digests) == [('1',), ('2',), ('3',)]
+        assert digests[('1',)] == partition_digest([(None, {'s': 'static'}), ((1,), {'v': 10}), ((2,), {})])
+        assert digests[('2',)] == partition_digest([(None, {'s': 'only static'})])
+        assert digests[('3',)] == partition_digest([((1,), {'v': 30})])
+
+    @patch('tools.replicas.glob.glob', return_value=['/data/ks/t-1/snapshots/tag/na-1-big-Data.db'])
+    @patch('tools.replicas.stream_sstabledump')
+    def test_sstables_are_reconciled(self, stream_sstabledump, _):
+        node = _node('3.11')
+        node.data_directories.return_value = ['/data0', '/data1']
+        older = [_dumped('1', [_row('1', 10, [{'name': 'v', 'value': 10}]),
+                               _row('2', 10, [{'name': 'v', 'value': 20}]),
+                               {'type': 'static_block', 'position': 0, 'cells': [{'name': 's', 'value': 'a',
+                                                                                  'tstamp': 10}]}]),
+                 _dumped('2', [_row('1', 10, [{'name': 'v', 'value': 1}])]),
+                 _dumped('3', [_row('1', 10, [{'name': 'v', 'value': 3}],
+                                    liveness_info={'tstamp': 10, 'expired': True})])]
+        newer = [_dumped('1', [_row('1', 10, [{'name': 'v', 'tstamp': 20, 'deletion_info': {'local_delete_time': 0}}]),
+                               _row('2', 5, [{'name': 'v', 'value': 25}]),
+                               {'type': 'range_tombstone_bound', 'start': {}}]),
+                 _dumped('2', [], deletion=15),
+                 _dumped('4', [_row('1', 20, [], deletion_info={'marked_deleted': 30, 'local_delete_time': 0})])]
+        # one sstable in each data directory
+        dumps = iter([older, newer])
+        stream_sstabledump.side_effect = lambda *args, **kwargs: iter(next(dumps))
+
+        digests = read_replica_digests(node, Mock(), 'ks', 't')
+
+        assert stream_sstabledump.call_args[1]['raw_timestamps']
+        # node1's deleted cell leaves its row marker, the older write of k2 is ignored
+        assert digests == {('1',): partition_digest([(None, {'s': 'a'}), (('1',), {}), (('2',), {'v': 20})]),
+                           ('3',): partition_digest([(('1',), {'v': 3})])}
+        snapshot, clearsnapshot = node.nodetool.call_args_list
+        tag = snapshot[0][0].split()[2]
+        assert snapshot[0][0] == 'snapshot -t {} -cf t ks'.format(tag)
+        assert clearsnapshot[0][0] == 'clearsnapshot -t {} ks'.format(tag)
+
+    @patch('tools.replicas._sstabledump_digests', return_value={('1',): 'digest'})
+    def test_refused_node_local_reads_fall_back_to_sstabledump(self, sstabledump_digests):
+        session = _session([])
+        session.execute.side_effect = InvalidRequest('NODE_LOCAL consistency level is highly dangerous')
+        nodes = [_node('4.0', 'node1'), _node('3.11', 'node2')]
+
+        digests = read_replicas_digests([(node, session) for node in nodes], 'ks', 't')
+
+        assert digests == {'node1': {('1',): 'digest'}, 'node2': {('1',): 'digest'}}
+        # node2 doesn't even try
+        assert session.execute.call_count == 1
+
+    def test_nodes_without_raw_sstabledump_timestamps_are_refused(self):
+        assert supports_replica_digests(_node('3.11.4'))
+        assert not supports_replica_digests(_node('3.0.17'))
+        with pytest.raises(ValueError, match='node1, which runs 2.2'):
+            read_replica_digests(_node('2.2.14'), Mock(), 'ks', 't')
+
+    def test_enable_node_local_reads(self):
+        conf_dir = tempfile.mkdtemp()
+        with open(os.path.join(conf_dir, 'jvm-server.options'), 'w') as f:
+            f.write('-Xss256k')
+        nodes = [_node('4.0'), _node('3.11')]
+        for node in nodes:
+            node.get_conf_dir.return_value = conf_dir
+
+        enable_node_local_reads(nodes)
+
+        with open(os.path.join(conf_dir, 'jvm-server.options')) as f:
+            assert f.read().split() == ['-Xss256k', ENABLE_NODE_LOCAL_QUERIES]
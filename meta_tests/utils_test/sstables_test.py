@@ -0,0 +1,197 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from uuid import UUID
+
+import pytest
+from ccmlib.node import ToolError
+from mock import Mock, patch
+from tools import sstables
+from tools.sstables import get_sstable_metadata, iter_json_array, iter_sstabledump_rows, parse_sstablemetadata, \
+    run_offline_tool_parallel
+
+_OUTPUT = """SSTable: {dir}/na-1-big
+Partitioner: org.apache.cassandra.dht.Murmur3Partitioner
+Minimum timestamp: 1553000000000000
+Maximum timestamp: 1553000000100000
+SSTable min local deletion time: 2147483647
+Estimated droppable tombstones: 0.25
+SSTable Level: 0
+Repaired at: 0
+Pending repair: --
+SSTable: {dir}/na-2-big
+Minimum timestamp: 1553000000200000
+Maximum timestamp: 1553000000300000
+Estimated droppable tombstones: 0.0
+SSTable Level: 1
+Repaired at: 1553000000400000 (03/19/2019 12:53:20)
+Pending repair: 8e3a4e36-4a7b-11e9-8646-d663bd873d93
+"""
+
+
+class TestSSTableMetadata(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for generation in (1, 2):
+            for component in ('Data.db', 'Statistics.db'):
+                with open(os.path.join(self.tmpdir, 'na-{}-big-{}'.format(generation, component)), 'w') as f:
+                    f.write('x' * generation)
+        sstables._cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        sstables._cache.clear()
+
+    def _output(self, generations=(1, 2)):
+        blocks = _OUTPUT.format(dir=self.tmpdir).split('SSTable: ')[1:]
+        return ''.join('SSTable: ' + blocks[g - 1] for g in generations).encode('utf-8')
+
+    def test_parse_output_of_several_sstables(self):
+        first, second = parse_sstablemetadata(self._output())
+        assert first.name == os.path.join(self.tmpdir, 'na-1-big')
+        assert (first.repaired_at, first.pending_repair, first.level) == (0, None, 0)
+        assert not first.repaired
+        assert first.droppable_tombstones == 0.25
+        assert (first.min_timestamp, first.max_timestamp) == (1553000000000000, 1553000000100000)
+        assert first.data_size == 1
+
+        assert second.repaired_at == 1553000000400000
+        assert second.repaired
+        assert second.pending_repair == UUID('8e3a4e36-4a7b-11e9-8646-d663bd873d93')
+        assert second.data_size == 2
+
+    def _node(self, name='node1'):
+        node = Mock(**{'get_sstables.return_value': [os.path.join(self.tmpdir, 'na-{}-big-Data.db'.format(g))
+                                                     for g in (1, 2)]})
+        node.name = name
+        return node
+
+    def test_unchanged_sstables_are_read_once(self):
+        node = self._node()
+        with patch('tools.sstables._run_sstablemetadata') as run:
+            run.return_value = Mock(stdout=self._output())
+            assert [m.level for m in get_sstable_metadata([node], 'ks')['node1']] == [0, 1]
+            assert [m.level for m in get_sstable_metadata([node], 'ks')['node1']] == [0, 1]
+        assert run.call_count == 1
+
+    def test_rewritten_statistics_are_read_again(self):
+        node = self._node()
+        with patch('tools.sstables._run_sstablemetadata') as run:
+            run.return_value = Mock(stdout=self._output())
+            get_sstable_metadata([node], 'ks')
+
+            # marking an sstable repaired rewrites its Statistics.db component
+            with open(os.path.join(self.tmpdir, 'na-2-big-Statistics.db'), 'w') as f:
+                f.write('repaired')
+            run.return_value = Mock(stdout=self._output(generations=(2,)))
+            get_sstable_metadata([node], 'ks')
+
+        assert run.call_count == 2
+        assert run.call_args[0][1] == [os.path.join(self.tmpdir, 'na-2-big-Data.db')]
+
+    def test_sstables_under_a_symlink_are_matched(self):
+        # ccm lists the sstables through the link, sstablemetadata prints their real paths
+        link = os.path.join(tempfile.mkdtemp(), 'link')
+        self.addCleanup(shutil.rmtree, os.path.dirname(link))
+        os.symlink(self.tmpdir, link)
+        node = Mock(**{'get_sstables.return_value': [os.path.join(link, 'na-{}-big-Data.db'.format(g)) for g in (1, 2)]})
+        node.name = 'node1'
+        with patch('tools.sstables._run_sstablemetadata') as run:
+            run.return_value = Mock(stdout=self._output())
+            assert [m.level for m in get_sstable_metadata([node], 'ks')['node1']] == [0, 1]
+            assert [m.level for m in get_sstable_metadata([node], 'ks')['node1']] == [0, 1]
+        assert run.call_count == 1
+
+    def test_sstables_without_metadata_are_reported(self):
+        node = self._node()
+        with patch('tools.sstables._run_sstablemetadata') as run:
+            run.return_value = Mock(stdout=self._output(generations=(1,)))
+            with pytest.raises(RuntimeError, match='na-2-big-Data.db on node1'):
+                get_sstable_metadata([node], 'ks')
+
+
+class TestIterJsonArray(TestCase):
+
+    def _decode(self, text, chunk_size=3):
+        return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+    def test_elements_split_across_chunks(self):
+        partitions = [{'partition': {'key': [str(k)]}, 'rows': [{'type': 'row', 'cells': [k] * k}]}
+                      for k in range(20)]
+        assert self._decode(json.dumps(partitions, indent=2)) == partitions
+
+    def test_scalars_and_empty_array(self):
+        assert self._decode('[ 12345 , "a,]" ,[1, 2],null ]') == [12345, 'a,]', [1, 2], None]
+        assert self._decode(' [ ] ') == []
+
+    def test_malformed_input(self):
+        for text in ('{"a": 1}', '[1, 2', '[1 2]', '[{"a": '):
+            with pytest.raises(ValueError):
+                self._decode(text)
+
+    def test_rows_of_partitions(self):
+        partitions = [{'partition': {'key': ['1']}, 'rows': [{'type': 'row'}, {'type': 'range_tombstone_bound'}]},
+                      {'partition': {'key': ['2'], 'deletion_info': {}}}]
+        assert [(p['partition']['key'], r['type']) for p, r in iter_sstabledump_rows(partitions)] == \
+            [(['1'], 'row'), (['1'], 'range_tombstone_bound')]
+
+
+class TestRunOfflineToolParallel(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for tool_dir, tool, script in (('bin', 'sstableverify', 'sleep 0.5; echo "verified $@"'),
+                                       (os.path.join('tools', 'bin'), 'sstablemetadata', 'echo "SSTable: $1"'),
+                                       ('bin', 'sstablescrub', 'echo "bad $@" >&2; exit 3')):
+            os.makedirs(os.path.join(self.tmpdir, tool_dir), exist_ok=True)
+            path = os.path.join(self.tmpdir, tool_dir, tool)
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\n' + script + '\n')
+            os.chmod(path, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _node(self, name, sstables=()):
+        node = Mock(**{'get_install_dir.return_value': self.tmpdir,
+                       'get_env.return_value': dict(os.environ),
+                       'get_sstables.return_value': list(sstables)})
+        node.name = name
+        return node
+
+    def test_nodes_run_concurrently(self):
+        nodes = [self._node('node{}'.format(i)) for i in range(1, 5)]
+        start = time.time()
+        results = run_offline_tool_parallel(nodes, 'sstableverify', ['ks', 'cf'], max_workers=len(nodes))
+        # each invocation sleeps for half a second
+        assert time.time() - start < 1.5
+        assert [r.node for r in results] == nodes
+        assert all(r.stdout == 'verified ks cf\n' and r.rc == 0 and r.elapsed >= 0.5 for r in results)
+
+    def test_default_runs_one_process_per_cpu(self):
+        nodes = [self._node('node{}'.format(i)) for i in range(1, 5)]
+        start = time.time()
+        with patch('tools.sstables.os.cpu_count', return_value=2):
+            run_offline_tool_parallel(nodes, 'sstableverify', ['ks', 'cf'])
+        # two rounds of two invocations
+        assert 1.0 <= time.time() - start < 1.5
+
+    def test_one_invocation_per_sstable(self):
+        node = self._node('node1', sstables=['a-Data.db', 'b-Data.db'])
+        results = run_offline_tool_parallel([node], 'sstablemetadata', sstables_of=('ks', 'cf'), max_workers=1)
+        node.get_sstables.assert_called_once_with('ks', 'cf')
+        assert [r.stdout for r in results] == ['SSTable: a-Data.db\n', 'SSTable: b-Data.db\n']
+
+    def test_failures(self):
+        node = self._node('node1')
+        with pytest.raises(ToolError) as e:
+            run_offline_tool_parallel([node], 'sstablescrub', ['ks', 'cf'])
+        assert e.value.exit_status == 3
+
+        [result] = run_offline_tool_parallel([node], 'sstablescrub', ['ks', 'cf'], check=False)
+        assert (result.rc, result.stderr) == (3, 'bad ks cf\n')
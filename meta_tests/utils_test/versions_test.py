@@ -0,0 +1,55 @@
+import threading
+import time
+from unittest import TestCase
+
+from mock import patch
+from tools import versions
+from tools.versions import prefetch_versions, resolve_version
+
+
+class TestVersionResolution(TestCase):
+
+    def setUp(self):
+        versions._resolved.clear()
+        self.active = set()
+        self.overlaps = []
+        self.setups = []
+        lock = threading.Lock()
+
+        def setup(slug):
+            with lock:
+                self.setups.append(slug)
+                self.overlaps.extend((slug, other) for other in self.active)
+                self.active.add(slug)
+            time.sleep(0.1)
+            with lock:
+                self.active.discard(slug)
+            return '/repo/' + slug, None
+
+        patchers = [patch('ccmlib.repository.setup', side_effect=setup),
+                    patch('tools.versions.get_version_from_build', side_effect=lambda d: d.split('/')[-1])]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        versions._resolved.clear()
+
+    def test_versions_are_set_up_once(self):
+        assert resolve_version('3.0.17') == ('/repo/3.0.17', '3.0.17')
+        assert resolve_version('3.0.17') == ('/repo/3.0.17', '3.0.17')
+        assert self.setups == ['3.0.17']
+
+    def test_prefetch_serializes_versions_sharing_a_git_mirror(self):
+        slugs = ['github:apache/cassandra-3.0', 'github:apache/cassandra-3.11', '2.2.13', '3.0.17',
+                 'github:apache/cassandra-3.0']
+        prefetch_versions(slugs)
+        assert sorted(self.setups) == sorted(set(slugs))
+
+        overlapping = [set(pair) for pair in self.overlaps]
+        assert {'github:apache/cassandra-3.0', 'github:apache/cassandra-3.11'} not in overlapping
+        # release downloads don't share anything and run alongside the git fetches
+        assert any('2.2.13' in pair for pair in overlapping)
+
+        resolve_version('github:apache/cassandra-3.11')
+        assert len(self.setups) == 4
@@ -1,4 +1,3 @@
-import json
 import os
 import random
 import re
@@ -10,6 +9,7 @@ from ccmlib import common
 from ccmlib.node import ToolError
 
 from dtest import Tester, create_ks
+from tools.sstables import iter_sstabledump_rows, stream_sstabledump
 
 since = pytest.mark.since
 logger = logging.getLogger(__name__)
@@ -415,17 +415,13 @@ class TestOfflineTools(Tester):
 
         node1.flush()
         cluster.stop()
-        [(out, error, rc)] = node1.run_sstabledump(keyspace='ks', column_families=['cf'])
-        logger.debug(out)
-        logger.debug(error)
-
-        # Load the json output and check that it contains the inserted key=1
-        s = json.loads(out)
-        logger.debug(s)
-        assert len(s) == 2
+        # stream the partitions rather than loading the whole dump
+        partitions = list(stream_sstabledump(node1, 'ks', column_families=['cf']))
+        logger.debug(partitions)
+        assert len(partitions) == 2
 
         # order the rows so that we have key=1 first, then key=2
-        row0, row1 = s
+        row0, row1 = partitions
         (row0, row1) = (row0, row1) if row0['partition']['key'] == ['1'] else (row1, row0)
 
         assert row0['partition']['key'] == ['1']
@@ -433,15 +429,13 @@ class TestOfflineTools(Tester):
         assert row1['partition']['key'] == ['2']
         assert row1['partition'].get('deletion_info') is not None
         assert row1.get('rows') is not None
+        assert [row['type'] for _, row in iter_sstabledump_rows([row1])] == ['row']
 
         # Check that we only get the key back using the enumerate option
-        [(out, error, rc)] = node1.run_sstabledump(keyspace='ks', column_families=['cf'], enumerate_keys=True)
-        logger.debug(out)
-        logger.debug(error)
-        s = json.loads(out)
-        logger.debug(s)
-        assert len(s) == 2
-        dumped_keys = set(row[0] for row in s)
+        keys = list(stream_sstabledump(node1, 'ks', column_families=['cf'], enumerate_keys=True))
+        logger.debug(keys)
+        assert len(keys) == 2
+        dumped_keys = set(row[0] for row in keys)
         assert {'1', '2'} == dumped_keys
 
     def _check_stderr_error(self, error):
@@ -16,7 +16,7 @@ from cassandra.query import (SimpleStatement, dict_factory,
 from dtest import Tester, run_scenarios, create_ks
 from tools.assertions import (assert_all, assert_invalid, assert_length_equal,
                               assert_one, assert_lists_equal_ignoring_order)
-from tools.data import rows_to_list
+from tools.data import bulk_load, rows_to_list
 from tools.datahelp import create_rows, flatten_into_set, parse_data_into_dicts
 from tools.paging import PageAssertionMixin, PageFetcher
 
@@ -178,6 +178,35 @@ class TestPagingSize(BasePagingTester, PageAssertionMixin):
         # make sure expected and actual have same data elements (ignoring order)
         assert_lists_equal_ignoring_order(expected_data, pf.all_data(), sort_key="id")
 
+    def test_pages_verified_as_they_arrive(self):
+        """
+        A large partition can be checked page by page, without the fetcher keeping any rows.
+        """
+        session = self.prepare()
+        create_ks(session, 'test_paging_size', 2)
+        session.execute("CREATE TABLE paging_test ( id int, ck int, value text, PRIMARY KEY (id, ck) )")
+
+        insert = session.prepare("INSERT INTO paging_test (id, ck, value) VALUES (0, ?, 'testing')")
+        insert.consistency_level = CL.ALL
+        bulk_load(session, insert, ([ck] for ck in range(20000)))
+
+        next_ck = [0]
+
+        def check_page(page_num, rows):
+            for row in rows:
+                assert row['ck'] == next_ck[0], "page {} out of order".format(page_num)
+                next_ck[0] += 1
+
+        future = session.execute_async(
+            SimpleStatement("select * from paging_test where id = 0", fetch_size=1000, consistency_level=CL.ALL)
+        )
+
+        pf = PageFetcher(future, page_checker=check_page, keep_rows=False).request_all(timeout=60)
+
+        assert pf.num_results_all() == [1000] * 20
+        assert pf.num_results_total() == 20000
+        assert next_ck[0] == 20000
+
 
 @since('2.0')
 class TestPagingWithModifiers(BasePagingTester, PageAssertionMixin):
@@ -0,0 +1,67 @@
+"""
+pytest plugins run_dtests.py hands to the pytest processes it starts. CollectedTestsExporter
+writes the node ids of the tests selected for execution to a json file once collection has
+finished, which is used to list tests with --dtest-print-tests-only instead of scraping
+pytest's --collect-only output. DurationsRecorder writes how long each test took, which
+--dtest-parallelism uses to balance its shards, and ShardSelector restricts a run to the
+tests of one shard.
+
+Example:
+
+    pytest.main(['--collect-only', 'cql_test.py'], plugins=[CollectedTestsExporter('/tmp/tests.json')])
+    pytest.main(['cql_test.py'], plugins=[DurationsRecorder('/tmp/durations.json')])
+"""
+import json
+from collections import defaultdict
+
+import pytest
+
+
+def normalize_nodeid(nodeid):
+    """
+    Drops the "()" instance segment pytest adds to the node ids of test methods, so
+    cql_test.py::TestCQL::()::test_x is reported as cql_test.py::TestCQL::test_x
+    """
+    return nodeid.replace('::()::', '::')
+
+
+class CollectedTestsExporter(object):
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+
+    def pytest_collection_finish(self, session):
+        # runs after pytest_collection_modifyitems, so deselected tests are already gone
+        with open(self.output_path, 'w') as f:
+            json.dump([normalize_nodeid(item.nodeid) for item in session.items], f)
+
+
+class DurationsRecorder(object):
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.durations = defaultdict(float)
+
+    def pytest_runtest_logreport(self, report):
+        # setup and teardown count too, that's where clusters are started and stopped
+        self.durations[normalize_nodeid(report.nodeid)] += report.duration
+
+    def pytest_sessionfinish(self, session):
+        with open(self.output_path, 'w') as f:
+            json.dump(self.durations, f, indent=2, sort_keys=True)
+
+
+class ShardSelector(object):
+
+    def __init__(self, tests_path):
+        with open(tests_path) as f:
+            self.tests = set(json.load(f))
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, items, config):
+        selected, deselected = [], []
+        for item in items:
+            (selected if normalize_nodeid(item.nodeid) in self.tests else deselected).append(item)
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
@@ -18,6 +18,7 @@ from tools.assertions import assert_one
 from tools.data import rows_to_list
 from tools.jmxutils import JolokiaAgent, make_mbean
 from tools.misc import retry_till_success
+from tools.replicas import enable_node_local_reads, partition_digest, read_replicas_digests, supports_replica_digests
 
 since = pytest.mark.since
 logger = logging.getLogger(__name__)
@@ -71,6 +72,7 @@ class TestReadRepair(Tester):
                 snitch_file.write("rack=rack1" + os.linesep)
                 snitch_file.write("prefer_local=true" + os.linesep)
 
+        enable_node_local_reads(cluster.nodelist())
         cluster.start(wait_for_binary_proto=True)
 
     @since('3.0')
@@ -229,12 +231,26 @@ class TestReadRepair(Tester):
 
     def check_data_on_each_replica(self, expect_fully_repaired, initial_replica):
         """
-        Perform a SELECT * query at CL.ONE on each replica in turn. If expect_fully_repaired is True, we verify that
-        each replica returns the full row being queried. If not, then we only verify that the 'a' column has been
-        repaired.
+        Read the local data of every replica at once. If expect_fully_repaired is True, we verify that
+        each replica holds the full row being queried. If not, then we only verify that the 'a' column has been
+        repaired. Versions whose local data can't be read directly are queried at CL.ONE on each replica in turn.
         """
-        stmt = SimpleStatement("SELECT * FROM alter_rf_test.t1 WHERE k=1", consistency_level=ConsistencyLevel.ONE)
         logger.debug("Checking all if read repair has completed on all replicas")
+        nodes = self.cluster.nodelist()
+        if not all(supports_replica_digests(n) for n in nodes):
+            self._query_each_replica(expect_fully_repaired, initial_replica)
+            return
+        digests = read_replicas_digests([(n, self.patient_exclusive_cql_connection(n)) for n in nodes],
+                                        'alter_rf_test', 't1')
+        for n in nodes:
+            logger.debug("Checking {n}, {x}expecting all columns"
+                         .format(n=n.name, x="" if expect_fully_repaired or n == initial_replica else "not "))
+            expected = {'a': 1, 'b': 1} if expect_fully_repaired or n == initial_replica else {'a': 1}
+            if digests[n.name].get(('1',)) != partition_digest([((), expected)]):
+                raise NotRepairedException()
+
+    def _query_each_replica(self, expect_fully_repaired, initial_replica):
+        stmt = SimpleStatement("SELECT * FROM alter_rf_test.t1 WHERE k=1", consistency_level=ConsistencyLevel.ONE)
         for n in self.cluster.nodelist():
             logger.debug("Checking {n}, {x}expecting all columns"
                          .format(n=n.name, x="" if expect_fully_repaired or n == initial_replica else "not "))
@@ -5,8 +5,7 @@ import logging
 
 from datetime import datetime
 from collections import Counter, namedtuple
-from re import findall, compile
-from uuid import UUID, uuid1
+from uuid import uuid1
 
 from cassandra import ConsistencyLevel
 from cassandra.query import SimpleStatement
@@ -18,6 +17,7 @@ from dtest import Tester, create_ks, create_cf
 from tools.assertions import assert_almost_equal, assert_one
 from tools.data import insert_c1c2
 from tools.misc import new_node, ImmutableMapping
+from tools.sstables import get_node_sstable_metadata, get_sstable_metadata
 from tools.jmxutils import make_mbean, JolokiaAgent, remove_perf_disable_shared_mem
 
 since = pytest.mark.since
@@ -43,26 +43,17 @@ class TestIncRepair(Tester):
 
     @classmethod
     def _get_repaired_data(cls, node, keyspace):
-        _sstable_name = compile('SSTable: (.+)')
-        _repaired_at = compile('Repaired at: (\d+)')
-        _pending_repair = compile('Pending repair: (\-\-|null|[a-f0-9\-]+)')
         _sstable_data = namedtuple('_sstabledata', ('name', 'repaired', 'pending_id'))
+        data = [_sstable_data(m.name, m.repaired_at, m.pending_repair)
+                for m in get_node_sstable_metadata(node, keyspace)]
+        assert data
+        assert all(t.repaired is not None for t in data), '{}'.format(data)
+        return data
 
-        out = node.run_sstablemetadata(keyspace=keyspace).stdout
-
-        def matches(pattern):
-            return filter(None, [pattern.match(l) for l in out.split('\n')])
-        names = [m.group(1) for m in matches(_sstable_name)]
-        repaired_times = [int(m.group(1)) for m in matches(_repaired_at)]
-
-        def uuid_or_none(s):
-            return None if s == 'null' or s == '--' else UUID(s)
-        pending_repairs = [uuid_or_none(m.group(1)) for m in matches(_pending_repair)]
-        assert names
-        assert repaired_times
-        assert pending_repairs
-        assert len(names) == len(repaired_times) == len(pending_repairs)
-        return [_sstable_data(*a) for a in zip(names, repaired_times, pending_repairs)]
+    @classmethod
+    def _repaired_at_times(cls, nodes):
+        """ Returns the repairedAt time of every sstable of keyspace1 on nodes, read concurrently """
+        return [m.repaired_at for sstables in get_sstable_metadata(nodes, 'keyspace1').values() for m in sstables]
 
     def assertNoRepairedSSTables(self, node, keyspace):
         """ Checks that no sstables are marked repaired, and none are marked pending repair """
@@ -364,8 +355,8 @@ class TestIncRepair(Tester):
             for node in self.cluster.nodelist():
                 node.nodetool('compact keyspace1 standard1')
 
-        for out in (node.run_sstablemetadata(keyspace='keyspace1').stdout for node in self.cluster.nodelist()):
-            assert 'Repaired at: 0' not in out
+        for sstables in get_sstable_metadata(self.cluster.nodelist(), 'keyspace1').values():
+            assert all(s.repaired for s in sstables), sstables
 
     def test_multiple_repair(self):
         """
@@ -477,10 +468,7 @@ class TestIncRepair(Tester):
         node2.run_sstablerepairedset(keyspace='keyspace1')
         node2.start(wait_for_binary_proto=True)
 
-        initialOut1 = node1.run_sstablemetadata(keyspace='keyspace1').stdout
-        initialOut2 = node2.run_sstablemetadata(keyspace='keyspace1').stdout
-
-        matches = findall('(?<=Repaired at:).*', '\n'.join([initialOut1, initialOut2]))
+        matches = self._repaired_at_times([node1, node2])
         logger.debug("Repair timestamps are: {}".format(matches))
 
         uniquematches = set(matches)
@@ -488,9 +476,9 @@ class TestIncRepair(Tester):
 
         assert len(uniquematches) >= 2, uniquematches
 
-        assert len(max(matchcount)) >= 1, matchcount
+        assert max(matchcount.values()) >= 1, matchcount
 
-        assert re.search('Repaired at: 0', '\n'.join([initialOut1, initialOut2]))
+        assert 0 in matches
 
         node1.stop()
         node2.stress(['write', 'n=15K', 'no-warmup', '-schema', 'replication(factor=2)'])
@@ -507,14 +495,7 @@ class TestIncRepair(Tester):
             for node in self.cluster.nodelist():
                 node.nodetool('compact keyspace1 standard1')
 
-        finalOut1 = node1.run_sstablemetadata(keyspace='keyspace1').stdout
-        if not isinstance(finalOut1, str):
-            finalOut1 = finalOut1
-        finalOut2 = node2.run_sstablemetadata(keyspace='keyspace1').stdout
-        if not isinstance(finalOut2, str):
-            finalOut2 = finalOut2
-
-        matches = findall('(?<=Repaired at:).*', '\n'.join([finalOut1, finalOut2]))
+        matches = self._repaired_at_times([node1, node2])
 
         logger.debug(matches)
 
@@ -523,9 +504,9 @@ class TestIncRepair(Tester):
 
         assert len(uniquematches) >= 2
 
-        assert len(max(matchcount)) >= 2
+        assert max(matchcount.values()) >= 2
 
-        assert not re.search('Repaired at: 0', '\n'.join([finalOut1, finalOut2]))
+        assert 0 not in matches
 
     def test_compaction(self):
         """
@@ -688,8 +669,9 @@ class TestIncRepair(Tester):
             for node in cluster.nodelist():
                 node.nodetool('compact keyspace1 standard1')
 
-        for out in (node.run_sstablemetadata(keyspace='keyspace1').stdout for node in cluster.nodelist() if len(node.get_sstables('keyspace1', 'standard1')) > 0):
-            assert 'Repaired at: 0' not in out
+        # nodes without sstables have nothing to check
+        for sstables in get_sstable_metadata(cluster.nodelist(), 'keyspace1', ['standard1']).values():
+            assert all(s.repaired for s in sstables), sstables
 
     @pytest.mark.no_vnodes
     @since('4.0')
@@ -1050,12 +1032,11 @@ class TestIncRepair(Tester):
         session.execute("insert into ks.tbl (k, c, v) values (5, 5, 55)")
         node2.start(wait_for_binary_proto=True)
 
-        out1 = node1.run_sstablemetadata(keyspace='ks').stdout
-        out2 = node2.run_sstablemetadata(keyspace='ks').stdout
+        metadata = get_sstable_metadata([node1, node2], 'ks')
 
         # verify the repaired at times for the sstables on node1/node2
-        assert all(t == 0 for t in [int(x) for x in [y.split(' ')[0] for y in findall('(?<=Repaired at: ).*', out1)]])
-        assert all(t > 0 for t in [int(x) for x in [y.split(' ')[0] for y in findall('(?<=Repaired at: ).*', out2)]])
+        assert all(not s.repaired for s in metadata[node1.name])
+        assert all(s.repaired for s in metadata[node2.name])
 
         # we expect inconsistencies due to sstables being marked repaired on one replica only
         # these are marked confirmed because no sessions are pending & all sstables are
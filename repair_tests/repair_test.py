@@ -2,11 +2,10 @@ import os
 import os.path
 import threading
 import time
-import re
 import pytest
 import logging
 
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 from threading import Thread
 
 from cassandra import ConsistencyLevel
@@ -14,7 +13,11 @@ from cassandra.query import SimpleStatement
 from ccmlib.node import ToolError
 
 from dtest import FlakyRetryPolicy, Tester, create_ks, create_cf
+from dtest_setup import NODE_PAUSE_NOTICE_TIMEOUT
 from tools.data import insert_c1c2, query_c1c2
+from tools.merkle import compare_replicas
+from tools.replicas import enable_node_local_reads, partition_digest, read_replica_digests, supports_replica_digests
+from tools.sstables import get_node_sstable_metadata
 
 since = pytest.mark.since
 logger = logging.getLogger(__name__)
@@ -48,44 +51,83 @@ def _repair_options(version, ks='', cf=None, sequential=True):
     return opts
 
 
+def _unrepaired_partitions(mismatches, start, end, pulled_by=None):
+    """
+    Function for finding the partitions a repair of the token range (start, end] left differing,
+    from the RangeMismatch list of compare_replicas. The range wraps around the ring if start >= end.
+    @param mismatches The mismatches returned by compare_replicas
+    @param start The token the repaired range starts after
+    @param end The last token of the repaired range
+    @param pulled_by The name of the node that ran a pull repair. It only received data, so only the
+                     partitions it doesn't hold like the other replicas are left unrepaired
+    """
+    partitions = OrderedDict()
+    for m in mismatches:
+        in_range = m.start >= start or m.end <= end if start >= end else start <= m.start and m.end <= end
+        if not in_range:
+            continue
+        for key, on_replicas in m.partitions.items():
+            if pulled_by is None or any(digest not in (None, on_replicas.get(pulled_by)) for digest in on_replicas.values()):
+                partitions[key] = on_replicas
+    return partitions
+
+
 class BaseRepairTest(Tester):
 
-    def check_rows_on_node(self, node_to_check, rows, found=None, missings=None, restart=True):
+    def check_rows_on_node(self, node_to_check, rows, found=None, missings=None):
         """
-        Function to verify the rows on a given node, without interference
-        from the other nodes in the cluster
+        Function to verify the rows on a given node, reading only its local data
+        so the other nodes of the cluster don't interfere but keep running
         @param node_to_check The given node to check. Should be the node, not the index
         @param rows The number of rows we expect
-        @param found A list of partition keys that we expect to be on the node
+        @param found A list of partition keys that we expect to be on the node, with their c1 and c2 values
         @param missings A list of partition keys we expect NOT to be on the node
-        @param restart Whether or not we should restart the nodes we shut down to perform the assertions. Should only be False if the call to check_rows_on_node is the last line in the test.
         """
-        if found is None:
-            found = []
-        if missings is None:
-            missings = []
-        stopped_nodes = []
+        if not supports_replica_digests(node_to_check):
+            self._check_rows_on_isolated_node(node_to_check, rows, found, missings)
+            return
 
-        for node in list(self.cluster.nodes.values()):
-            if node.is_running() and node is not node_to_check:
-                stopped_nodes.append(node)
-                node.stop(wait_other_notice=True)
+        session = self.patient_exclusive_cql_connection(node_to_check)
+        digests = read_replica_digests(node_to_check, session, 'ks', 'cf')
+        assert len(digests) == rows
 
-        session = self.patient_exclusive_cql_connection(node_to_check, 'ks')
-        result = list(session.execute("SELECT * FROM cf LIMIT {}".format(rows * 2), timeout=10))
-        assert len(result) == rows
+        expected = partition_digest([((), {'c1': 'value1', 'c2': 'value2'})])
+        for k in found or []:
+            assert digests.get(('k{}'.format(k),)) == expected, "k{} is missing or wrong on {}".format(k, node_to_check.name)
 
-        for k in found:
-            query_c1c2(session, k, ConsistencyLevel.ONE)
+        for k in missings or []:
+            assert ('k{}'.format(k),) not in digests, "k{} was found on {}".format(k, node_to_check.name)
 
-        for k in missings:
-            query = SimpleStatement("SELECT c1, c2 FROM cf WHERE key='k{}'".format(k), consistency_level=ConsistencyLevel.ONE)
-            res = list(session.execute(query))
-            assert len([x for x in res if len(x) != 0]) == 0, res
+    def _check_rows_on_isolated_node(self, node_to_check, rows, found=None, missings=None):
+        """
+        check_rows_on_node for versions whose local data can't be read directly: the other nodes
+        are paused while node_to_check is read at CL.ONE, and resumed afterwards
+        """
+        paused_nodes = []
 
-        if restart:
-            for node in stopped_nodes:
-                node.start(wait_other_notice=True)
+        # pausing rather than stopping the other nodes spares us restarting them afterwards, reads
+        # are local once node_to_check's failure detector convicted them all
+        mark = node_to_check.mark_log()
+        for node in list(self.cluster.nodes.values()):
+            if node.is_running() and node is not node_to_check and node not in self.paused_nodes:
+                paused_nodes.append(node)
+                self.pause_node(node, wait_other_notice=False)
+        node_to_check.watch_log_for_death(paused_nodes, from_mark=mark, timeout=NODE_PAUSE_NOTICE_TIMEOUT)
+
+        try:
+            session = self.patient_exclusive_cql_connection(node_to_check, 'ks')
+            result = list(session.execute("SELECT * FROM cf LIMIT {}".format(rows * 2), timeout=10))
+            assert len(result) == rows
+
+            for k in found or []:
+                query_c1c2(session, k, ConsistencyLevel.ONE)
+
+            for k in missings or []:
+                query = SimpleStatement("SELECT c1, c2 FROM cf WHERE key='k{}'".format(k), consistency_level=ConsistencyLevel.ONE)
+                res = list(session.execute(query))
+                assert len([x for x in res if len(x) != 0]) == 0, res
+        finally:
+            self.resume_nodes(paused_nodes)
 
     def _populate_cluster(self, start=True):
         cluster = self.cluster
@@ -95,7 +137,9 @@ class BaseRepairTest(Tester):
         cluster.set_configuration_options(values={'hinted_handoff_enabled': False})
         cluster.set_batch_commitlog(enabled=True)
         logger.debug("Starting cluster..")
-        cluster.populate(3).start()
+        cluster.populate(3)
+        enable_node_local_reads(cluster.nodelist())
+        cluster.start()
         node1, node2, node3 = cluster.nodelist()
 
         session = self.patient_cql_connection(node1, retry_policy=FlakyRetryPolicy(max_retries=15))
@@ -154,7 +198,7 @@ class BaseRepairTest(Tester):
             assert out_of_sync_nodes, valid_out_of_sync_pairs in str(out_of_sync_nodes)
 
         # Check node3 now has the key
-        self.check_rows_on_node(node3, 2001, found=[1000], restart=False)
+        self.check_rows_on_node(node3, 2001, found=[1000])
 
 
 class TestRepair(BaseRepairTest):
@@ -275,21 +319,10 @@ class TestRepair(BaseRepairTest):
         """
         Based on incremental_repair_test.py:TestIncRepair implementation.
         """
-        _sstable_name = re.compile('SSTable: (.+)')
-        _repaired_at = re.compile(r'Repaired at: (\d+)')
         _sstable_data = namedtuple('_sstabledata', ('name', 'repaired'))
-
-        out = node.run_sstablemetadata(keyspace=keyspace).stdout
-
-        def matches(pattern):
-            return [_f for _f in [pattern.match(l) for l in out.split('\n')] if _f]
-
-        names = [m.group(1) for m in matches(_sstable_name)]
-        repaired_times = [int(m.group(1)) for m in matches(_repaired_at)]
-
-        assert names
-        assert repaired_times
-        return [_sstable_data(*a) for a in zip(names, repaired_times)]
+        data = [_sstable_data(m.name, m.repaired_at) for m in get_node_sstable_metadata(node, keyspace)]
+        assert data
+        return data
 
     @since('2.2.10', max_version='4')
     def test_no_anticompaction_of_already_repaired(self):
@@ -628,7 +661,7 @@ class TestRepair(BaseRepairTest):
         valid_out_of_sync_pairs = {node1.address(), node2.address()}
         assert out_of_sync_nodes == valid_out_of_sync_pairs, "Unrelated node found in local repair: {}, expected {}".format(out_of_sync_nodes, valid_out_of_sync_pairs)
         # Check node2 now has the key
-        self.check_rows_on_node(node2, 2001, found=[1000], restart=False)
+        self.check_rows_on_node(node2, 2001, found=[1000])
 
     def test_dc_repair(self):
         """
@@ -658,7 +691,7 @@ class TestRepair(BaseRepairTest):
             assert out_of_sync_nodes, valid_out_of_sync_pairs in str(out_of_sync_nodes)
 
         # Check node2 now has the key
-        self.check_rows_on_node(node2, 2001, found=[1000], restart=False)
+        self.check_rows_on_node(node2, 2001, found=[1000])
 
     def test_dc_parallel_repair(self):
         """
@@ -688,7 +721,7 @@ class TestRepair(BaseRepairTest):
             assert out_of_sync_nodes, valid_out_of_sync_pairs in str(out_of_sync_nodes)
 
         # Check node2 now has the key
-        self.check_rows_on_node(node2, 2001, found=[1000], restart=False)
+        self.check_rows_on_node(node2, 2001, found=[1000])
 
         # Check the repair was a dc parallel repair
         if self.cluster.version() >= '2.2':
@@ -709,7 +742,9 @@ class TestRepair(BaseRepairTest):
         cluster.set_batch_commitlog(enabled=True)
         logger.debug("Starting cluster..")
         # populate 2 nodes in dc1, and one node each in dc2 and dc3
-        cluster.populate([2, 1, 1]).start(wait_for_binary_proto=True)
+        cluster.populate([2, 1, 1])
+        enable_node_local_reads(cluster.nodelist())
+        cluster.start(wait_for_binary_proto=True)
 
         node1, node2, node3, node4 = cluster.nodelist()
         session = self.patient_cql_connection(node1)
@@ -795,7 +830,9 @@ class TestRepair(BaseRepairTest):
         cluster.set_configuration_options(values={'hinted_handoff_enabled': False})
         cluster.set_batch_commitlog(enabled=True)
         logger.debug("Starting cluster..")
-        cluster.populate(3).start(wait_for_binary_proto=True)
+        cluster.populate(3)
+        enable_node_local_reads(cluster.nodelist())
+        cluster.start(wait_for_binary_proto=True)
 
         node1, node2, node3 = cluster.nodelist()
 
@@ -868,7 +905,9 @@ class TestRepair(BaseRepairTest):
         cluster.set_configuration_options(values={'hinted_handoff_enabled': False})
         cluster.set_batch_commitlog(enabled=True)
         logger.debug("Starting cluster..")
-        cluster.populate(3).start(wait_for_binary_proto=True)
+        cluster.populate(3)
+        enable_node_local_reads(cluster.nodelist())
+        cluster.start(wait_for_binary_proto=True)
 
         node1, node2, node3 = cluster.nodelist()
 
@@ -892,14 +931,17 @@ class TestRepair(BaseRepairTest):
         cluster.set_configuration_options(values={'hinted_handoff_enabled': False})
         cluster.set_batch_commitlog(enabled=True)
         logger.debug("Starting cluster..")
-        cluster.populate(3).start(wait_for_binary_proto=True)
+        cluster.populate(3)
+        enable_node_local_reads(cluster.nodelist())
+        cluster.start(wait_for_binary_proto=True)
 
         node1, node2, node3 = cluster.nodelist()
 
         node1_address = node1.network_interfaces['binary'][0]
         node2_address = node2.network_interfaces['binary'][0]
 
-        self._parameterized_range_repair(repair_opts=['--pull', '--in-hosts', node1_address + ',' + node2_address, '-st', str(node3.initial_token), '-et', str(node1.initial_token)])
+        self._parameterized_range_repair(repair_opts=['--pull', '--in-hosts', node1_address + ',' + node2_address, '-st', str(node3.initial_token), '-et', str(node1.initial_token)],
+                                         pulled_by=node1)
 
         # Node 1 should only receive files (as we ran a pull repair on node1)
         assert len(node1.grep_log("Receiving [1-9][0-9]* files")) > 0
@@ -911,14 +953,17 @@ class TestRepair(BaseRepairTest):
         assert len(node2.grep_log("Receiving 0 files")) > 0
         assert len(node2.grep_log("sending [1-9][0-9]* files")) > 0
 
-    def _parameterized_range_repair(self, repair_opts):
+    def _parameterized_range_repair(self, repair_opts, pulled_by=None):
         """
         @param repair_opts A list of strings which represent cli args to nodetool repair
+        @param pulled_by The node running a pull repair, which only streams data into it
         * Launch a three node cluster
         * Insert some data at RF 2
         * Shut down node2, insert more data, restore node2
         * Issue a repair on a range that only belongs to node1, using repair_opts
         * Verify that nodes 1 and 2, and only nodes 1+2, are repaired
+        * On 4.0+, verify that the data of nodes 1 and 2 now agrees on that range, or with a pull
+          repair that pulled_by now holds the data of the other node
         """
         cluster = self.cluster
         node1, node2, node3 = cluster.nodelist()
@@ -953,6 +998,17 @@ class TestRepair(BaseRepairTest):
 
         assert out_of_sync_nodes, valid_out_of_sync_pairs in str(out_of_sync_nodes)
 
+        if cluster.version() >= '4.0':
+            mismatches = compare_replicas([(node, self.patient_exclusive_cql_connection(node))
+                                           for node in cluster.nodelist()], 'keyspace1', 'standard1')
+            # the repaired range (node3, node1] wraps around the ring, node1 holding the lowest token
+            node1_token, node2_token, node3_token = [int(node.initial_token) for node in cluster.nodelist()]
+            unrepaired = _unrepaired_partitions(mismatches, node3_token, node1_token,
+                                                pulled_by=pulled_by.name if pulled_by else None)
+            assert not unrepaired, "Nodes 1 and 2 still disagree on {}".format(unrepaired)
+            # node2 also missed writes of the range (node1, node2] it replicates with node3
+            assert [m for m in mismatches if node1_token <= m.start < node2_token]
+
     @since('2.2')
     def test_trace_repair(self):
         """
@@ -3,7 +3,8 @@
 usage: run_dtests.py [-h] [--use-vnodes] [--use-off-heap-memtables] [--num-tokens NUM_TOKENS] [--data-dir-count-per-instance DATA_DIR_COUNT_PER_INSTANCE] [--force-resource-intensive-tests]
                      [--skip-resource-intensive-tests] [--cassandra-dir CASSANDRA_DIR] [--cassandra-version CASSANDRA_VERSION] [--delete-logs] [--execute-upgrade-tests] [--disable-active-log-watching]
                      [--keep-test-dir] [--enable-jacoco-code-coverage] [--dtest-enable-debug-logging] [--dtest-print-tests-only] [--dtest-print-tests-output DTEST_PRINT_TESTS_OUTPUT]
-                     [--pytest-options PYTEST_OPTIONS] [--dtest-tests DTEST_TESTS]
+                     [--pytest-options PYTEST_OPTIONS] [--dtest-tests DTEST_TESTS] [--dtest-parallelism DTEST_PARALLELISM]
+                     [--dtest-shards-dir DTEST_SHARDS_DIR] [--dtest-durations-file DTEST_DURATIONS_FILE]
 
 optional arguments:
   -h, --help                                                 show this help message and exit
@@ -26,25 +27,40 @@ optional arguments:
   --dtest-print-tests-output DTEST_PRINT_TESTS_OUTPUT        Path to file where the output of --dtest-print-tests-only should be written to (default: False)
   --pytest-options PYTEST_OPTIONS                            Additional command line arguments to proxy directly thru when invoking pytest. (default: None)
   --dtest-tests DTEST_TESTS                                  Comma separated list of test files, test classes, or test methods to execute. (default: None)
+  --dtest-parallelism DTEST_PARALLELISM                      Number of pytest processes to split the tests between. Each one runs its clusters on its own loopback
+                                                             address block, so at most 10 are supported. (default: 1)
+  --dtest-shards-dir DTEST_SHARDS_DIR                        Directory the output, logs and junit report of each process started with --dtest-parallelism, and their
+                                                             merged junit report, are written to (default: shards)
+  --dtest-durations-file DTEST_DURATIONS_FILE                File the test durations used to balance --dtest-parallelism runs are kept in (default: .dtest_durations.json)
 """
 import subprocess
 import sys
 import os
-import re
+import json
 import logging
+import selectors
+import time
+import heapq
 
+from collections import namedtuple, OrderedDict
 from os import getcwd
 from tempfile import NamedTemporaryFile
-from bs4 import BeautifulSoup
+from xml.etree import ElementTree
 
 from _pytest.config.argparsing import Parser
 import argparse
 
 from conftest import pytest_addoption
 from ccmlib.common import get_version_from_build
+from tools.loopback import MAX_LOOPBACK_BLOCKS
+from tools.versions import resolve_version
 
 logger = logging.getLogger(__name__)
 
+# assumed duration of tests that haven't been run with --dtest-parallelism before
+DEFAULT_TEST_DURATION = 60.0
+JUNIT_COUNTERS = ("tests", "errors", "failures", "skips", "skipped", "time")
+
 
 class RunDTests():
     def run(self, argv):
@@ -83,9 +99,21 @@ class RunDTests():
                             help="Additional command line arguments to proxy directly thru when invoking pytest.")
         parser.add_argument("--dtest-tests", action="store", default=None,
                             help="Comma separated list of test files, test classes, or test methods to execute.")
+        parser.add_argument("--dtest-parallelism", action="store", type=int, default=1,
+                            help="Number of pytest processes to split the tests between. Each one runs its clusters "
+                                 "on its own loopback address block, so at most {} are supported."
+                                 .format(MAX_LOOPBACK_BLOCKS))
+        parser.add_argument("--dtest-shards-dir", action="store", default="shards",
+                            help="Directory the output, logs and junit report of each process started with "
+                                 "--dtest-parallelism, and their merged junit report, are written to")
+        parser.add_argument("--dtest-durations-file", action="store", default=".dtest_durations.json",
+                            help="File the test durations used to balance --dtest-parallelism runs are kept in")
 
         args = parser.parse_args()
 
+        if not 1 <= args.dtest_parallelism <= MAX_LOOPBACK_BLOCKS:
+            raise Exception("--dtest-parallelism must be between 1 and {}".format(MAX_LOOPBACK_BLOCKS))
+
         if not args.dtest_print_tests_only:
             if args.cassandra_dir is None and args.cassandra_version is None:
                 raise Exception("Required dtest arguments were missing! You must provide either --cassandra-dir "
@@ -108,39 +136,39 @@ class RunDTests():
         # we want to run, then generate a config object for each of them.
         logger.debug('Generating configurations from the following matrix:\n\t{}'.format(args))
 
-        args_to_invoke_pytest = []
-
+        # options only meant for this script, and their values when not passed as --option=value
+        run_dtests_options_with_values = {action.option_strings[0] for action in parser._actions
+                                          if action.option_strings and action.nargs != 0}
+        pytest_args = []
+        skip_value = False
         for arg in argv:
+            if skip_value:
+                skip_value = False
+                continue
             if arg.startswith("--pytest-options") or arg.startswith("--dtest-"):
+                skip_value = "=" not in arg and arg in run_dtests_options_with_values
                 continue
-            args_to_invoke_pytest.append("'{the_arg}'".format(the_arg=arg))
+            pytest_args.append(arg)
 
         if args.dtest_print_tests_only:
-            args_to_invoke_pytest.append("'--collect-only'")
+            pytest_args.append("--collect-only")
 
         if args.dtest_tests:
             for test in args.dtest_tests.split(","):
-                args_to_invoke_pytest.append("'{test_name}'".format(test_name=test))
-
-        original_raw_cmd_args = ", ".join(args_to_invoke_pytest)
+                pytest_args.append(test)
 
-        logger.debug("args to call with: [%s]" % original_raw_cmd_args)
+        logger.debug("args to call with: {}".format(pytest_args))
 
-        # the original run_dtests.py script did it like this to hack around nosetest
-        # limitations -- i'm not sure if they still apply or not in a pytest world
-        # but for now just leaving it as is, because it does the job (although
-        # certainly is still pretty complicated code and has a hacky feeling)
-        to_execute = (
-                "import pytest\n" +
-                (
-                "pytest.main([{options}])\n").format(options=original_raw_cmd_args)
-        )
-        temp = NamedTemporaryFile(dir=getcwd())
-        logger.debug('Writing the following to {}:'.format(temp.name))
+        if args.dtest_parallelism > 1 and not args.dtest_print_tests_only:
+            exit(run_sharded(pytest_args, args.dtest_parallelism, args.dtest_shards_dir,
+                             args.dtest_durations_file, cassandra_version=args.cassandra_version))
 
-        logger.debug('```\n{to_execute}```\n'.format(to_execute=to_execute))
-        temp.write(to_execute.encode("utf-8"))
-        temp.flush()
+        if args.dtest_print_tests_only:
+            collected_tests_file = NamedTemporaryFile(suffix=".json", dir=getcwd())
+            plugins = "[CollectedTestsExporter({path!r})]".format(path=collected_tests_file.name)
+        else:
+            plugins = "[]"
+        temp = write_pytest_script(pytest_args, plugins)
 
         # We pass nose_argv as options to the python call to maintain
         # compatibility with the nosetests command. Arguments passed in via the
@@ -150,137 +178,307 @@ class RunDTests():
         cmd_list = [sys.executable, temp.name]
         logger.debug('subprocess.call-ing {cmd_list}'.format(cmd_list=cmd_list))
 
-        sp = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=os.environ.copy())
-
         if args.dtest_print_tests_only:
-            stdout, stderr = sp.communicate()
+            # the tests are written to collected_tests_file, pytest's own listing isn't needed
+            sp = subprocess.Popen(cmd_list, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=os.environ.copy())
+            _, stderr = sp.communicate()
 
-            if stderr:
+            # as in collect_tests, warnings also go to stderr and 5 only means that no test was collected
+            if sp.returncode not in (0, 5):
                 print(stderr.decode("utf-8"))
-                result = sp.returncode
-                exit(result)
+                exit(sp.returncode)
 
-            all_collected_test_modules = collect_test_modules(stdout)
+            all_collected_test_modules = read_collected_tests(collected_tests_file.name)
             joined_test_modules = "\n".join(all_collected_test_modules)
             #print("Collected %d Test Modules" % len(all_collected_test_modules))
-            if args.dtest_print_tests_output is not None:
+            if args.dtest_print_tests_output:
                 collected_tests_output_file = open(args.dtest_print_tests_output, "w")
                 collected_tests_output_file.write(joined_test_modules)
                 collected_tests_output_file.close()
 
             print(joined_test_modules)
         else:
-            while True:
-                stdout_output = sp.stdout.readline()
-                stdout_output_str = stdout_output.decode("utf-8")
-                if stdout_output_str == '' and sp.poll() is not None:
-                    break
-                if stdout_output_str:
-                    print(stdout_output_str.strip())
-
-                stderr_output = sp.stderr.readline()
-                stderr_output_str = stderr_output.decode("utf-8")
-                if stderr_output_str == '' and sp.poll() is not None:
-                    break
-                if stderr_output_str:
-                    print(stderr_output_str.strip())
+            sp = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=os.environ.copy())
+            forward_output(sp)
 
         exit(sp.returncode)
 
 
-def collect_test_modules(stdout):
+def write_pytest_script(pytest_args, plugins="[]"):
+    """
+    Writes a python script calling pytest.main with the given arguments to a temporary file,
+    which exits with pytest's exit code
+    :param pytest_args: the arguments to invoke pytest with
+    :param plugins: python source of the list of plugin instances to hand to pytest.main
+    :return: the NamedTemporaryFile holding the script, which is deleted once closed
+    """
+    # the original run_dtests.py script did it like this to hack around nosetest
+    # limitations -- i'm not sure if they still apply or not in a pytest world
+    # but for now just leaving it as is, because it does the job (although
+    # certainly is still pretty complicated code and has a hacky feeling)
+    to_execute = (
+        "import sys\n"
+        "import pytest\n"
+        "from plugins.collected_tests import CollectedTestsExporter, DurationsRecorder, ShardSelector\n"
+        "sys.exit(pytest.main({options!r}, plugins={plugins}))\n".format(options=list(pytest_args), plugins=plugins)
+    )
+    temp = NamedTemporaryFile(dir=getcwd(), suffix=".py")
+    logger.debug('Writing the following to {}:'.format(temp.name))
+
+    logger.debug('```\n{to_execute}```\n'.format(to_execute=to_execute))
+    temp.write(to_execute.encode("utf-8"))
+    temp.flush()
+    return temp
+
+
+def forward_output(process, stdout=None, stderr=None):
+    """
+    Copies whatever the process writes to its stdout and stderr pipes to the given binary
+    streams (our own stdout and stderr by default) as soon as it is written, until both pipes
+    are closed. Neither stream waits on the other, so a quiet stderr doesn't hold back stdout
+    and a chatty one can't fill its pipe and block the process.
+    :param process: a subprocess.Popen started with stdout=PIPE and stderr=PIPE
+    :return: the exit code of the process
+    """
+    destinations = {process.stdout: stdout or sys.stdout.buffer,
+                    process.stderr: stderr or sys.stderr.buffer}
+    with selectors.DefaultSelector() as selector:
+        for pipe in destinations:
+            selector.register(pipe, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                destination = destinations[key.fileobj]
+                destination.write(data)
+                destination.flush()
+    return process.wait()
+
+
+def read_collected_tests(path):
+    """
+    Reads the tests written by the plugins.collected_tests plugin during a --collect-only run
+    :param path: the json file the CollectedTestsExporter plugin was configured with
+    :return: a list of collected tests in format test_file.py::TestClass::test_function
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+ShardPlan = namedtuple('ShardPlan', ('tests', 'estimated_seconds'))
+
+
+def _test_group(test):
+    """
+    Tests of one class, or the module level tests of one module, share class and module scoped
+    fixtures, so they are kept in the same shard
+    """
+    return "::".join(test.split("::")[:2 if test.count("::") > 1 else 1])
+
+
+def balance_shards(tests, durations, shards):
+    """
+    Splits tests into at most the given number of shards expected to take about as long as each
+    other, by handing the longest remaining group of tests to the currently shortest shard
+    :param tests: test node ids in collection order
+    :param durations: seconds previous runs took per test; tests missing from it are assumed to take
+                      the median of the known ones
+    :return: a list of non empty ShardPlans, each keeping its tests in collection order
+    """
+    known = sorted(durations[test] for test in tests if test in durations)
+    default_duration = known[len(known) // 2] if known else DEFAULT_TEST_DURATION
+
+    groups = OrderedDict()
+    for index, test in enumerate(tests):
+        groups.setdefault(_test_group(test), []).append(index)
+    costs = [(sum(durations.get(tests[i], default_duration) for i in indexes), indexes)
+             for indexes in groups.values()]
+
+    heap = [(0.0, shard) for shard in range(shards)]
+    assigned = [[] for _ in range(shards)]
+    for cost, indexes in sorted(costs, key=lambda c: (-c[0], c[1][0])):
+        total, shard = heapq.heappop(heap)
+        assigned[shard].extend(indexes)
+        heapq.heappush(heap, (total + cost, shard))
+
+    estimated = dict((shard, total) for total, shard in heap)
+    return [ShardPlan([tests[i] for i in sorted(indexes)], estimated[shard])
+            for shard, indexes in enumerate(assigned) if indexes]
+
+
+def load_durations(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def update_durations(path, paths_of_new_durations):
+    """
+    Merges the durations recorded by the DurationsRecorder plugin of each shard into the durations file
+    """
+    durations = load_durations(path)
+    for new_durations in paths_of_new_durations:
+        if os.path.exists(new_durations):
+            durations.update(load_durations(new_durations))
+    with open(path, "w") as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+
+
+def merge_junit_reports(paths, output_path):
+    """
+    Merges the junit xml reports of several pytest runs into one testsuite, summing up their counters
+    :param paths: the junit reports to merge, missing ones are skipped
+    :param output_path: where to write the merged report
+    :return: the merged testsuite element
+    """
+    merged = None
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        root = ElementTree.parse(path).getroot()
+        for suite in ([root] if root.tag == "testsuite" else root.findall("testsuite")):
+            if merged is None:
+                merged = ElementTree.Element("testsuite", suite.attrib)
+                for counter in JUNIT_COUNTERS:
+                    if counter in merged.attrib:
+                        merged.set(counter, "0")
+                properties = suite.find("properties")
+                if properties is not None:
+                    merged.append(properties)
+            for counter in JUNIT_COUNTERS:
+                if counter in suite.attrib and counter in merged.attrib:
+                    total = float(merged.get(counter)) + float(suite.get(counter))
+                    merged.set(counter, "{:.3f}".format(total) if counter == "time" else str(int(total)))
+            for case in suite.findall("testcase"):
+                merged.append(case)
+
+    if merged is None:
+        merged = ElementTree.Element("testsuite", {"tests": "0"})
+    ElementTree.ElementTree(merged).write(output_path, encoding="utf-8", xml_declaration=True)
+    return merged
+
+
+def _option_value(pytest_args, *names):
+    value = None
+    for i, arg in enumerate(pytest_args):
+        for name in names:
+            if arg.startswith(name + "="):
+                value = arg[len(name) + 1:]
+            elif arg == name and i + 1 < len(pytest_args):
+                value = pytest_args[i + 1]
+    return value
+
+
+def _without_option(pytest_args, name):
+    without = []
+    skip_value = False
+    for arg in pytest_args:
+        if skip_value:
+            skip_value = False
+        elif arg == name:
+            skip_value = True
+        elif not arg.startswith(name + "="):
+            without.append(arg)
+    return without
+
+
+def collect_tests(pytest_args):
+    """
+    Runs pytest --collect-only with the given arguments
+    :return: the selected tests in format test_file.py::TestClass::test_function
+    """
+    with NamedTemporaryFile(suffix=".json", dir=getcwd()) as collected_tests_file:
+        plugins = "[CollectedTestsExporter({path!r})]".format(path=collected_tests_file.name)
+        with write_pytest_script(pytest_args + ["--collect-only"], plugins) as script:
+            sp = subprocess.Popen([sys.executable, script.name], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                  env=os.environ.copy())
+            _, stderr = sp.communicate()
+        # pytest exits with 5 when no test was collected
+        if sp.returncode == 5:
+            return []
+        # warnings (e.g. ccm's SyntaxWarnings) also go to stderr, only the exit code tells a failure
+        if sp.returncode:
+            raise Exception("Failed to collect tests (exit code {}):\n{}".format(sp.returncode, stderr.decode("utf-8")))
+        return read_collected_tests(collected_tests_file.name)
+
+
+def run_sharded(pytest_args, parallelism, shards_dir, durations_file, cassandra_version=None):
     """
-    Takes the xml-ish (no, it's not actually xml so we need to format it a bit) --collect-only output as printed
-    by pytest to stdout and normalizes it to get a list of all collected tests in a human friendly format
-    :param stdout: the stdout from pytest (should have been invoked with the --collect-only cmdline argument)
-    :return: a formatted list of collected test modules in format test_file.py::TestClass::test_function
+    Collects the tests once, splits them into duration balanced shards and runs one pytest process
+    per shard. Each process runs its clusters on its own loopback block and writes its output, logs,
+    junit report and test durations into its own directory below shards_dir. Once all of them are
+    done their junit reports are merged into shards_dir/junit.xml (or the --junit-xml given to pytest)
+    and their durations into durations_file, for the next run to balance its shards with.
+    :return: the highest exit code of the pytest processes
     """
-    # unfortunately, pytest emits xml like output -- but it's not actually xml, so we'll fail to parse
-    # if we try. first step is to fix up the pytest output to create well formatted xml
-    xml_line_regex_pattern = re.compile(r"^([\s])*<(Module|Class|Function|Instance) '(.*)'>")
-    is_first_module = True
-    is_first_class = True
-    has_closed_class = False
-    section_has_instance = False
-    section_has_class = False
-    test_collect_xml_lines = []
-
-    test_collect_xml_lines.append("<?xml version=\"1.0\" encoding=\"UTF-8\"?>")
-    test_collect_xml_lines.append("<Modules>")
-    for line in stdout.decode("utf-8").split('\n'):
-        re_ret = re.search(xml_line_regex_pattern, line)
-        if re_ret:
-            if not is_first_module and re_ret.group(2) == "Module":
-                if section_has_instance:
-                    test_collect_xml_lines.append("      </Instance>")
-                if section_has_class:
-                    test_collect_xml_lines.append("    </Class>")
-
-                test_collect_xml_lines.append("  </Module>")
-                is_first_class = True
-                has_closed_class = False
-                section_has_instance = False
-                section_has_class = False
-                is_first_module = False
-            elif is_first_module and re_ret.group(2) == "Module":
-                if not has_closed_class and section_has_instance:
-                    test_collect_xml_lines.append("      </Instance>")
-                if not has_closed_class and section_has_class:
-                    test_collect_xml_lines.append("    </Class>")
-
-                is_first_class = True
-                is_first_module = False
-                has_closed_class = False
-                section_has_instance = False
-                section_has_class = False
-            elif re_ret.group(2) == "Instance":
-                section_has_instance = True
-            elif not is_first_class and re_ret.group(2) == "Class":
-                if section_has_instance:
-                    test_collect_xml_lines.append("      </Instance>")
-                if section_has_class:
-                    test_collect_xml_lines.append("    </Class>")
-                has_closed_class = True
-                section_has_class = True
-            elif re_ret.group(2) == "Class":
-                is_first_class = False
-                section_has_class = True
-                has_closed_class = False
-
-            if re_ret.group(2) == "Function":
-                test_collect_xml_lines.append("          <Function name=\"{name}\"></Function>"
-                                              .format(name=re_ret.group(3)))
-            elif re_ret.group(2) == "Class":
-                test_collect_xml_lines.append("    <Class name=\"{name}\">".format(name=re_ret.group(3)))
-            elif re_ret.group(2) == "Module":
-                test_collect_xml_lines.append("  <Module name=\"{name}\">".format(name=re_ret.group(3)))
-            elif re_ret.group(2) == "Instance":
-                test_collect_xml_lines.append("      <Instance name=\"\">".format(name=re_ret.group(3)))
-            else:
-                test_collect_xml_lines.append(line)
-
-    test_collect_xml_lines.append("      </Instance>")
-    test_collect_xml_lines.append("    </Class>")
-    test_collect_xml_lines.append("  </Module>")
-    test_collect_xml_lines.append("</Modules>")
-
-    all_collected_test_modules = []
-
-    # parse the now valid xml
-    print("\n".join(test_collect_xml_lines))
-    test_collect_xml = BeautifulSoup("\n".join(test_collect_xml_lines), "lxml-xml")
-
-    # find all Modules (followed by classes in those modules, and then finally functions)
-    for pytest_module in test_collect_xml.findAll("Module"):
-        for test_class_name in pytest_module.findAll("Class"):
-            for function_name in test_class_name.findAll("Function"):
-                # adds to test list in format like test_file.py::TestClass::test_function for every test function found
-                all_collected_test_modules.append("{module_name}::{class_name}::{function_name}"
-                                                  .format(module_name=pytest_module.attrs['name'],
-                                                          class_name=test_class_name.attrs['name'],
-                                                          function_name=function_name.attrs['name']))
-
-    return all_collected_test_modules
+    if cassandra_version is not None:
+        # set the version up once here rather than concurrently in every shard, which would race on
+        # ccm's repository, and have the shards all use the resulting install dir
+        install_dir = resolve_version(cassandra_version).install_dir
+        pytest_args = _without_option(pytest_args, "--cassandra-version") + ["--cassandra-dir=" + install_dir]
+
+    tests = collect_tests(pytest_args)
+    if not tests:
+        print("No tests to run")
+        return 0
+    shards = balance_shards(tests, load_durations(durations_file), parallelism)
+    print("Running {} tests in {} shards".format(len(tests), len(shards)))
+
+    if not os.path.exists(shards_dir):
+        os.makedirs(shards_dir)
+    junit_xml = _option_value(pytest_args, "--junit-xml", "--junitxml") or os.path.join(shards_dir, "junit.xml")
+
+    running = []
+    for block, shard in enumerate(shards):
+        shard_dir = os.path.abspath(os.path.join(shards_dir, "shard{}".format(block)))
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+        tests_path = os.path.join(shard_dir, "tests.json")
+        with open(tests_path, "w") as f:
+            json.dump(shard.tests, f, indent=2)
+
+        plugins = "[DurationsRecorder({durations!r}), ShardSelector({tests!r})]".format(
+            durations=os.path.join(shard_dir, "durations.json"), tests=tests_path)
+        shard_args = pytest_args + ["--loopback-block={}".format(block),
+                                    "--log-dir={}".format(os.path.join(shard_dir, "logs")),
+                                    "--last-test-dir={}".format(os.path.join(shard_dir, "last_test_dir")),
+                                    "--junit-xml={}".format(os.path.join(shard_dir, "junit.xml"))]
+        script = write_pytest_script(shard_args, plugins)
+        output = open(os.path.join(shard_dir, "output.log"), "wb")
+        sp = subprocess.Popen([sys.executable, script.name], stdout=output, stderr=subprocess.STDOUT,
+                              env=os.environ.copy())
+        print("Started shard {} with {} tests, estimated to take {:.0f}s, output in {}"
+              .format(block, len(shard.tests), shard.estimated_seconds, output.name))
+        running.append((block, shard, shard_dir, script, output, sp, time.time()))
+
+    results = []
+    while running:
+        time.sleep(1)
+        for shard_run in [r for r in running if r[5].poll() is not None]:
+            block, shard, shard_dir, script, output, sp, started = shard_run
+            running.remove(shard_run)
+            script.close()
+            output.close()
+            elapsed = time.time() - started
+            print("Shard {} finished with exit code {} in {:.0f}s".format(block, sp.returncode, elapsed))
+            results.append({"shard": block, "tests": len(shard.tests), "returncode": sp.returncode,
+                            "estimated_seconds": shard.estimated_seconds, "elapsed_seconds": elapsed,
+                            "dir": shard_dir})
+
+    results.sort(key=lambda r: r["shard"])
+    shard_dirs = [result["dir"] for result in results]
+    merged = merge_junit_reports([os.path.join(d, "junit.xml") for d in shard_dirs], junit_xml)
+    update_durations(durations_file, [os.path.join(d, "durations.json") for d in shard_dirs])
+    with open(os.path.join(shards_dir, "report.json"), "w") as f:
+        json.dump({"junit_xml": junit_xml, "shards": results}, f, indent=2, sort_keys=True)
+
+    print("Ran {} tests: {} failures, {} errors, {} skipped. Merged junit report written to {}"
+          .format(merged.get("tests"), merged.get("failures", 0), merged.get("errors", 0),
+                  merged.get("skips", merged.get("skipped", 0)), junit_xml))
+    return max(result["returncode"] for result in results)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,6 @@
 import glob
 import os
 import re
-import subprocess
 import time
 import uuid
 import pytest
@@ -12,6 +11,7 @@ from ccmlib import common
 
 from dtest import Tester, create_ks, create_cf
 from tools.assertions import assert_length_equal, assert_stderr_clean
+from tools.sstables import run_offline_tool_parallel
 
 since = pytest.mark.since
 logger = logging.getLogger(__name__)
@@ -115,23 +115,19 @@ class TestHelper(Tester):
         Launch the standalone scrub
         """
         node1 = self.cluster.nodelist()[0]
-        env = common.make_cassandra_env(node1.get_install_cassandra_root(), node1.get_node_cassandra_root())
-        scrub_bin = node1.get_tool('sstablescrub')
-        logger.debug(scrub_bin)
 
-        args = [scrub_bin]
+        args = []
         if reinsert_overflowed_ttl:
             args += ['--reinsert-overflowed-ttl']
         if no_validate:
             args += ['--no-validate']
-        args += [ks, cf] if reinsert_overflowed_ttl else [ks, cf]
-        p = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        logger.debug(out.decode("utf-8"))
+        args += [ks, cf]
+        [result] = run_offline_tool_parallel([node1], 'sstablescrub', args, check=False)
+        logger.debug(result.stdout)
         # if we have less than 64G free space, we get this warning - ignore it
-        if err and "Consider adding more capacity" not in err.decode("utf-8"):
-            logger.debug(err.decode("utf-8"))
-            assert_stderr_clean(err.decode("utf-8"))
+        if result.stderr and "Consider adding more capacity" not in result.stderr:
+            logger.debug(result.stderr)
+            assert_stderr_clean(result.stderr)
 
     def perform_node_tool_cmd(self, cmd, table, indexes):
         """
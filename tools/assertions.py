@@ -1,6 +1,7 @@
 import re
+from collections import Counter
 from time import sleep
-from tools.misc import list_to_hashed_dict
+from tools.misc import canonical_row, normalize_row
 
 from cassandra import (InvalidRequest, ReadFailure, ReadTimeout, Unauthorized,
                        Unavailable, WriteFailure, WriteTimeout)
@@ -39,6 +40,9 @@ or, maybe after shutting down all the nodes, we want to assert an Unavailable ex
 
 """
 
+# the errors of a request that couldn't reach enough replicas for its consistency level
+UNAVAILABLE_ERRORS = (Unavailable, WriteTimeout, WriteFailure, ReadTimeout, ReadFailure)
+
 
 def _rows_to_list(rows):
     new_list = [list(row) for row in rows]
@@ -81,7 +85,7 @@ def assert_unavailable(fun, *args):
     assert_unavailable(session2.execute, "SELECT * FROM ttl_table;")
     assert_unavailable(lambda c: logger.debug(c.execute(statement)), session)
     """
-    _assert_exception(fun, *args, expected=(Unavailable, WriteTimeout, WriteFailure, ReadTimeout, ReadFailure))
+    _assert_exception(fun, *args, expected=UNAVAILABLE_ERRORS)
 
 
 def assert_invalid(session, query, matching=None, expected=InvalidRequest):
@@ -180,13 +184,99 @@ def assert_all(session, query, expected, cl=None, ignore_order=False, timeout=No
     """
     simple_query = SimpleStatement(query, consistency_level=cl)
     res = session.execute(simple_query) if timeout is None else session.execute(simple_query, timeout=timeout)
-    list_res = _rows_to_list(res)
     if ignore_order:
-        expected = list_to_hashed_dict(expected)
-        list_res = list_to_hashed_dict(list_res)
+        assert_rows_equal_ignoring_order(res, expected, query=query)
+        return
+    list_res = _rows_to_list(res)
     assert list_res == expected, "Expected {} from {}, but got {}".format(expected, query, list_res)
 
 
+def assert_rows_equal_ignoring_order(rows, expected, query=None, max_diff=20):
+    """
+    Assert rows contain exactly the expected rows, in any order, duplicates included.
+    Rows are consumed one at a time, so a paged result set is never fully materialized,
+    and collection and UDT values are compared regardless of their container type.
+    @param rows Iterable of rows, e.g. the ResultSet of a query
+    @param expected List of expected rows, each a list of column values
+    @param query Optional query the rows came from, used in the failure message
+    @param max_diff Maximum number of missing and unexpected rows shown on failure
+
+    Examples:
+    assert_rows_equal_ignoring_order(session.execute("SELECT * FROM test"), [[1, {1: 'a'}], [2, {2: 'b'}]])
+    """
+    remaining = Counter(normalize_row(row) for row in expected)
+    unexpected = []
+    unexpected_count = 0
+    actual_count = 0
+    for row in rows:
+        actual_count += 1
+        key = normalize_row(row)
+        if remaining[key] > 0:
+            remaining[key] -= 1
+        else:
+            unexpected_count += 1
+            if len(unexpected) < max_diff:
+                unexpected.append(list(row))
+
+    missing_count = sum(remaining.values())
+    if missing_count == 0 and unexpected_count == 0:
+        return
+
+    missing = []
+    for key, count in remaining.items():
+        missing.extend([list(key)] * min(count, max_diff - len(missing)))
+        if len(missing) >= max_diff:
+            break
+    source = " from {}".format(query) if query is not None else ""
+    raise AssertionError("Expected {} rows{} in any order, but got {}: {} expected rows were missing "
+                         "(showing at most {}): {}; {} unexpected rows were returned (showing at most {}): {}"
+                         .format(len(expected), source, actual_count, missing_count, max_diff, missing,
+                                 unexpected_count, max_diff, unexpected))
+
+
+def _project_row(row, columns):
+    if columns is None:
+        return normalize_row(row)
+    if hasattr(row, "keys"):
+        # rows built by dict_factory
+        return normalize_row(row[c] for c in columns)
+    return normalize_row(getattr(row, c) for c in columns)
+
+
+def assert_rows_contain(rows, expected, key_columns=None, allow_extra=True, max_diff=None):
+    """
+    Assert every expected row is present in rows, optionally failing on rows that weren't expected.
+    The rows are indexed once by the value of key_columns, so the check is linear in the number
+    of rows and expected rows, and a paged result set is fetched in full.
+    @param rows Iterable of rows, e.g. the ResultSet of a query
+    @param expected List of tuples, holding the values of key_columns (or of all the columns) of each expected row
+    @param key_columns Optional names of the columns the expected tuples hold. Default all columns
+    @param allow_extra Optional boolean flag, if False rows that weren't expected fail the assertion
+    @param max_diff Optional maximum number of missing and extra rows shown on failure. Default all of them
+
+    Examples:
+    assert_rows_contain(session.execute("SELECT * FROM test"), [(1, 2), (2, 3)], key_columns=('a', 'b'))
+    assert_rows_contain(session.execute("SELECT a, b FROM test"), data, allow_extra=False)
+    """
+    index = Counter(_project_row(row, key_columns) for row in rows)
+
+    missing = []
+    for expected_row in expected:
+        key = normalize_row(expected_row)
+        if index[key] > 0:
+            index[key] -= 1
+        else:
+            missing.append(expected_row)
+    extra = list(index.elements()) if not allow_extra else []
+
+    if missing or extra:
+        columns = " on columns {}".format(list(key_columns)) if key_columns is not None else ""
+        raise AssertionError("Expected {} rows to be present{}: {} rows were missing: {}{}"
+                             .format(len(expected), columns, len(missing), missing[:max_diff],
+                                     "; {} rows were not expected: {}".format(len(extra), extra[:max_diff])
+                                     if not allow_extra else ""))
+
+
 def assert_almost_equal(*args, **kwargs):
     """
     Assert variable number of arguments all fall within a margin of error.
@@ -329,41 +419,37 @@ def assert_bootstrap_state(tester, node, expected_bootstrap_state, user=None, pa
     session.shutdown()
 
 
+def _first_items(counter, sort_key, count=20):
+    items = list(counter.elements())
+    if sort_key is not None:
+        # the canonical form of a dict is a tuple of (key, value) pairs
+        def value(item):
+            return dict(item).get(sort_key)
+        try:
+            items.sort(key=value)
+        except TypeError:
+            items.sort(key=lambda item: str(value(item)))
+    return items[:count]
+
+
 def assert_lists_equal_ignoring_order(list1, list2, sort_key=None):
     """
     asserts that the contents of the two provided lists are equal
-    but ignoring the order that the items of the lists are actually in
+    but ignoring the order that the items of the lists are actually in.
+    items are compared in their canonical form (see tools.misc.canonical_row),
+    so lists of dicts, driver rows and lists of values can all be compared
     :param list1: list to check if it's contents are equal to list2
     :param list2: list to check if it's contents are equal to list1
     :param sort_key: if the contents of the list are of type dict, the
-    key to use of each object to sort the overall object with
+    key to sort the items reported on failure by
     """
-    normalized_list1 = []
-    for obj in list1:
-        normalized_list1.append(obj)
-
-    normalized_list2 = []
-    for obj in list2:
-        normalized_list2.append(obj)
-
-    if not sort_key:
-        sorted_list1 = sorted(normalized_list1, key=lambda elm: elm[0])
-        sorted_list2 = sorted(normalized_list2, key=lambda elm: elm[0])
-    else:
-        # first always sort by "id"
-        # that way we get a two factor sort which will increase the chance of ordering lists exactly the same
-        if not sort_key == 'id' and 'id' in list1[0].keys():
-            sorted_list1 = sorted(sorted(normalized_list1, key=lambda elm: elm["id"]), key=lambda elm: elm[sort_key])
-            sorted_list2 = sorted(sorted(normalized_list2, key=lambda elm: elm["id"]), key=lambda elm: elm[sort_key])
-        else:
-            if isinstance(list1[0]['id'], (int, float)):
-                sorted_list1 = sorted(normalized_list1, key=lambda elm: elm[sort_key])
-                sorted_list2 = sorted(normalized_list2, key=lambda elm: elm[sort_key])
-            else:
-                sorted_list1 = sorted(normalized_list1, key=lambda elm: str(elm[sort_key]))
-                sorted_list2 = sorted(normalized_list2, key=lambda elm: str(elm[sort_key]))
-
-    assert sorted_list1 == sorted_list2
+    canonical_list1 = Counter(canonical_row(obj) for obj in list1)
+    canonical_list2 = Counter(canonical_row(obj) for obj in list2)
+    missing = canonical_list1 - canonical_list2
+    unexpected = canonical_list2 - canonical_list1
+    assert not missing and not unexpected, \
+        "items of the first list missing from the second: {}; items of the second list missing from the first: {}"\
+        .format(_first_items(missing, sort_key), _first_items(unexpected, sort_key))
 
 
 def assert_lists_of_dicts_equal(list1, list2):
@@ -1,9 +1,12 @@
 import time
 import logging
+import threading
+import weakref
+from collections import defaultdict
 
 from cassandra import ConsistencyLevel
-from cassandra.concurrent import execute_concurrent_with_args
-from cassandra.query import SimpleStatement
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType, SimpleStatement
 
 from . import assertions
 from dtest import create_cf, DtestTimeoutError
@@ -26,7 +29,127 @@ def insert_c1c2(session, keys=None, n=None, consistency=ConsistencyLevel.QUORUM)
     statement = session.prepare("INSERT INTO cf (key, c1, c2) VALUES (?, 'value1', 'value2')")
     statement.consistency_level = consistency
 
-    execute_concurrent_with_args(session, statement, [['k{}'.format(k)] for k in keys])
+    bulk_load(session, statement, (['k{}'.format(k)] for k in keys))
+
+
+class BulkLoadStats(object):
+    """
+    Outcome of a bulk_load call.
+    """
+    def __init__(self, rows, elapsed):
+        self.rows = rows
+        self.elapsed = elapsed
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed > 0 else float(self.rows)
+
+    def __repr__(self):
+        return '{cls}(rows={rows}, elapsed={elapsed:.2f}s, rows_per_second={rate:.0f})'.format(
+            cls=self.__class__.__name__, rows=self.rows, elapsed=self.elapsed, rate=self.rows_per_second)
+
+
+class _BulkLoader(object):
+    """
+    Keeps at most `concurrency` requests in flight per coordinator while
+    rows are pulled from an iterator, so the full argument list is never built.
+    """
+
+    def __init__(self, session, prepared, concurrency, token_aware, callback=None):
+        self.session = session
+        self.prepared = prepared
+        self.concurrency = concurrency
+        self.token_aware = token_aware
+        self.callback = callback
+        self.in_flight = defaultdict(int)
+        self.condition = threading.Condition()
+        self.error = None
+
+    def _coordinator(self, bound):
+        # pick the first live replica for the partition, or let the load
+        # balancing policy decide if it can't be computed
+        if not self.token_aware or bound.routing_key is None:
+            return None
+        keyspace = bound.keyspace or self.session.keyspace
+        if keyspace is None:
+            return None
+        for host in self.session.cluster.metadata.get_replicas(keyspace, bound.routing_key):
+            if host.is_up:
+                return host
+        return None
+
+    def _on_done(self, rows, host, args, start):
+        try:
+            if self.callback is not None:
+                self.callback(args, rows, time.time() - start)
+        except Exception as e:
+            with self.condition:
+                if self.error is None:
+                    self.error = e
+        finally:
+            with self.condition:
+                self.in_flight[host] -= 1
+                self.condition.notify_all()
+
+    def _on_error(self, exc, host):
+        with self.condition:
+            if self.error is None:
+                self.error = exc
+            self.in_flight[host] -= 1
+            self.condition.notify_all()
+
+    def load(self, rows_iter):
+        rows = 0
+        for args in rows_iter:
+            bound = self.prepared.bind(args)
+            host = self._coordinator(bound)
+            with self.condition:
+                while self.error is None and self.in_flight[host] >= self.concurrency:
+                    self.condition.wait()
+                if self.error is not None:
+                    break
+                self.in_flight[host] += 1
+            future = self.session.execute_async(bound, host=host)
+            future.add_callbacks(callback=self._on_done, callback_args=(host, args, time.time()),
+                                 errback=self._on_error, errback_args=(host,))
+            rows += 1
+
+        with self.condition:
+            while any(self.in_flight.values()):
+                self.condition.wait()
+        if self.error is not None:
+            raise self.error
+        return rows
+
+
+def bulk_load(session, prepared, rows_iter, concurrency=32, token_aware=True, callback=None):
+    """
+    Executes a prepared statement once for each set of bind values in rows_iter.
+
+    Unlike execute_concurrent_with_args, rows are consumed lazily from any
+    iterable (e.g. a generator), and when token_aware is set each request is
+    sent to a live replica of its partition, with at most `concurrency`
+    requests in flight per replica. When token_aware is false, `concurrency`
+    caps the total number of requests in flight.
+
+    If given, callback is called with the bind values, the result rows and the
+    latency in seconds of every request that succeeds, on the driver's event
+    loop thread. An exception it raises (e.g. an AssertionError checking the
+    rows) is an error of the load like a failed request.
+
+    Raises the first error encountered once all in flight requests complete.
+
+    @return A BulkLoadStats with the number of rows written and the time taken
+
+    Examples:
+    bulk_load(session, session.prepare("INSERT INTO cf (k, v) VALUES (?, ?)"), ((k, str(k)) for k in range(100000)))
+    """
+    start = time.time()
+    rows = _BulkLoader(session, prepared, concurrency, token_aware, callback=callback).load(rows_iter)
+    stats = BulkLoadStats(rows, time.time() - start)
+    logger.debug("Bulk loaded {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s)".format(
+        rows=stats.rows, elapsed=stats.elapsed, rate=stats.rows_per_second))
+    return stats
 
 
 def query_c1c2(session, key, consistency=ConsistencyLevel.QUORUM, tolerate_missing=False, must_be_missing=False):
@@ -40,11 +163,40 @@ def query_c1c2(session, key, consistency=ConsistencyLevel.QUORUM, tolerate_missi
         assertions.assert_length_equal(rows, 0)
 
 
-def insert_columns(tester, session, key, columns_count, consistency=ConsistencyLevel.QUORUM, offset=0):
-    upds = ["UPDATE cf SET v=\'value%d\' WHERE key=\'k%s\' AND c=\'c%06d\'" % (i, key, i) for i in range(offset * columns_count, columns_count * (offset + 1))]
-    query = 'BEGIN BATCH %s; APPLY BATCH' % '; '.join(upds)
-    simple_query = SimpleStatement(query, consistency_level=consistency)
-    session.execute(simple_query)
+# prepared statements shared by all the helpers of this module, per session and keyspace
+_prepared_statements = weakref.WeakKeyDictionary()
+
+
+def _prepare_cached(session, query, table):
+    """
+    Prepares query once per session, keyspace and version of the table it uses: the driver
+    replaces the table's metadata when the table is altered, dropped or recreated, which
+    invalidates the cached statement.
+    """
+    keyspace = session.cluster.metadata.keyspaces.get(session.keyspace)
+    table_metadata = keyspace.tables.get(table) if keyspace is not None else None
+    statements = _prepared_statements.setdefault(session, {})
+    cache_key = (session.keyspace, query)
+    if cache_key not in statements or statements[cache_key][0] is not table_metadata:
+        statements[cache_key] = (table_metadata, session.prepare(query))
+    return statements[cache_key][1]
+
+
+def _cf_update_batch(session, key, columns, consistency, unlogged=False):
+    """
+    Builds a single partition batch of prepared 'UPDATE cf' statements from (clustering, value) pairs.
+    """
+    update = _prepare_cached(session, 'UPDATE cf SET v=? WHERE key=? AND c=?', 'cf')
+    batch = BatchStatement(batch_type=BatchType.UNLOGGED if unlogged else BatchType.LOGGED,
+                           consistency_level=consistency)
+    for c, v in columns:
+        batch.add(update, (v, key, c))
+    return batch
+
+
+def insert_columns(tester, session, key, columns_count, consistency=ConsistencyLevel.QUORUM, offset=0, unlogged=False):
+    columns = [('c%06d' % i, 'value%d' % i) for i in range(offset * columns_count, columns_count * (offset + 1))]
+    session.execute(_cf_update_batch(session, 'k%s' % key, columns, consistency, unlogged=unlogged))
 
 
 def query_columns(tester, session, key, columns_count, consistency=ConsistencyLevel.QUORUM, offset=0):
@@ -75,25 +227,19 @@ def putget(cluster, session, cl=ConsistencyLevel.QUORUM):
     _validate_row(cluster, rows)
 
 
-def _put_with_overwrite(cluster, session, nb_keys, cl=ConsistencyLevel.QUORUM):
-    for k in range(0, nb_keys):
-        kvs = ["UPDATE cf SET v=\'value%d\' WHERE key=\'k%s\' AND c=\'c%02d\'" % (i, k, i) for i in range(0, 100)]
-        query = SimpleStatement('BEGIN BATCH %s APPLY BATCH' % '; '.join(kvs), consistency_level=cl)
-        session.execute(query)
-        time.sleep(.01)
-    cluster.flush()
-    for k in range(0, nb_keys):
-        kvs = ["UPDATE cf SET v=\'value%d\' WHERE key=\'k%s\' AND c=\'c%02d\'" % (i * 4, k, i * 2) for i in range(0, 50)]
-        query = SimpleStatement('BEGIN BATCH %s APPLY BATCH' % '; '.join(kvs), consistency_level=cl)
-        session.execute(query)
-        time.sleep(.01)
-    cluster.flush()
-    for k in range(0, nb_keys):
-        kvs = ["UPDATE cf SET v=\'value%d\' WHERE key=\'k%s\' AND c=\'c%02d\'" % (i * 20, k, i * 5) for i in range(0, 20)]
-        query = SimpleStatement('BEGIN BATCH %s APPLY BATCH' % '; '.join(kvs), consistency_level=cl)
-        session.execute(query)
-        time.sleep(.01)
-    cluster.flush()
+def _put_with_overwrite(cluster, session, nb_keys, cl=ConsistencyLevel.QUORUM, unlogged=False):
+    # each pass overwrites part of the previous one and is flushed to its own sstable;
+    # the single partition batches of a pass are sent concurrently, at most 32 at a time
+    passes = [
+        [('c%02d' % i, 'value%d' % i) for i in range(0, 100)],
+        [('c%02d' % (i * 2), 'value%d' % (i * 4)) for i in range(0, 50)],
+        [('c%02d' % (i * 5), 'value%d' % (i * 20)) for i in range(0, 20)],
+    ]
+    for columns in passes:
+        batches = ((_cf_update_batch(session, 'k%s' % k, columns, cl, unlogged=unlogged), ())
+                   for k in range(0, nb_keys))
+        execute_concurrent(session, batches, concurrency=32, raise_on_first_error=True)
+        cluster.flush()
 
 
 def _validate_row(cluster, res):
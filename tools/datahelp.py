@@ -22,8 +22,12 @@ It's meant to be used in tests when comparing expected to actual data, for valid
 For more examples reference paging_test.py
 """
 import re
+from collections.abc import MutableSequence
+from itertools import chain, repeat
+from types import MappingProxyType
 
-from cassandra.concurrent import execute_concurrent_with_args
+from tools.data import bulk_load
+from tools.misc import canonical_row, normalize_value
 
 
 def strip(val):
@@ -63,30 +67,42 @@ def row_has_multiplier(row):
     return False
 
 
-def parse_row_into_dict(row, headers, format_funcs=None):
-    row_cells = [l.strip() for l in row.split('|')]
+def generate_row_values(row, headers, format_funcs=None):
+    """
+    Parses a single data row once, and returns a lazy iterator over the tuples of
+    values (in header order) it describes: one tuple, or N of them for rows
+    prefixed by a *N multiplier.
 
-    if row_has_multiplier(row):
-        row_multiplier = get_row_multiplier(row)
-        row = '|'.join(row_cells[1:])  # cram remainder of row back into foo|bar format
-        multirows = []
+    Values are generated column by column: columns without a format function
+    repeat the parsed cell, while the others call their format function once
+    per generated row (so e.g. a uuid generator gives every row its own id).
+    """
+    row_cells = [cell.strip() for cell in row.split('|')]
+    row_multiplier = get_row_multiplier(row)
+
+    if row_multiplier is None:
+        row_multiplier = 1
+    else:
+        row_cells = row_cells[1:]
+
+    columns = []
+    for colname, value in zip(headers, row_cells):
+        func = format_funcs.get(colname) if format_funcs else None
+        if func is None:
+            columns.append(repeat(value, row_multiplier))
+        else:
+            columns.append(map(func, repeat(value, row_multiplier)))
 
-        for i in range(row_multiplier):
-            multirows.append(
-                parse_row_into_dict(row, headers, format_funcs=format_funcs)
-            )
-        return multirows
+    return zip(*columns)
 
-    row_map = dict(list(zip(headers, row_cells)))
 
-    if format_funcs:
-        for colname, value in list(row_map.items()):
-            func = format_funcs.get(colname)
+def parse_row_into_dict(row, headers, format_funcs=None):
+    row_maps = [dict(zip(headers, values)) for values in generate_row_values(row, headers, format_funcs=format_funcs)]
 
-            if func is not None:
-                row_map[colname] = func(value)
+    if row_has_multiplier(row):
+        return row_maps
 
-    return row_map
+    return row_maps[0]
 
 
 def row_describes_data(row):
@@ -106,7 +122,7 @@ def row_describes_data(row):
     return False
 
 
-def parse_data_into_dicts(data, format_funcs=None):
+def _split_data(data):
     # throw out leading/trailing space and pipes
     # so we can split on the data without getting
     # extra empty fields
@@ -115,18 +131,91 @@ def parse_data_into_dicts(data, format_funcs=None):
     # remove any remaining empty/decoration lines (i.e. '') from data
     rows = list(filter(row_describes_data, rows))
 
-    # remove headers
+    # separate headers from the data rows
     headers = parse_headers_into_list(rows.pop(0))
+    return headers, rows
 
-    values = []
 
-    for row in rows:
-        if row_has_multiplier(row):
-            values.extend(parse_row_into_dict(row, headers, format_funcs=format_funcs))
+def iter_data_values(data, format_funcs=None):
+    """
+    Returns the headers of the data, and a lazy iterator over the tuples of values
+    (in header order) of every row it describes, multiplied rows included.
+    """
+    headers, rows = _split_data(data)
+    return headers, chain.from_iterable(generate_row_values(row, headers, format_funcs=format_funcs) for row in rows)
+
+
+def parse_data_into_dicts(data, format_funcs=None):
+    headers, values = iter_data_values(data, format_funcs=format_funcs)
+    return RowSet(headers, values)
+
+
+class RowSet(MutableSequence):
+    """
+    A list of rows sharing the same columns, as returned by create_rows and parse_data_into_dicts.
+
+    Rows are stored as tuples of values in column order, which takes far less memory than
+    one dict per row for large datasets, and are read back (or compared to lists) as read-only
+    dicts so the RowSet can be used wherever a list of dicts is expected. Changing a row read
+    back raises a TypeError, as it wouldn't change the stored row: assign the changed row
+    to its index instead. Use tuples() to get at the stored rows without building dicts.
+    """
+
+    def __init__(self, columns, rows=()):
+        self.columns = tuple(columns)
+        self._rows = [tuple(row) for row in rows]
+
+    def _to_dict(self, values):
+        return MappingProxyType(dict(zip(self.columns, values)))
+
+    def _to_tuple(self, row_dict):
+        if set(row_dict) != set(self.columns):
+            raise ValueError("Row {} doesn't have columns {}".format(row_dict, self.columns))
+        return tuple(row_dict[c] for c in self.columns)
+
+    def append_values(self, values):
+        self._rows.append(tuple(values))
+
+    def tuples(self):
+        return self._rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RowSet(self.columns, self._rows[index])
+        return self._to_dict(self._rows[index])
+
+    def __setitem__(self, index, row_dict):
+        if isinstance(index, slice):
+            self._rows[index] = [self._to_tuple(d) for d in row_dict]
         else:
-            values.append(parse_row_into_dict(row, headers, format_funcs=format_funcs))
+            self._rows[index] = self._to_tuple(row_dict)
+
+    def __delitem__(self, index):
+        del self._rows[index]
 
-    return values
+    def __iter__(self):
+        for values in self._rows:
+            yield self._to_dict(values)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def insert(self, index, row_dict):
+        self._rows.insert(index, self._to_tuple(row_dict))
+
+    def __eq__(self, other):
+        if isinstance(other, RowSet) and other.columns == self.columns:
+            return self._rows == other._rows
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{cls}({columns}, {count} rows)'.format(
+            cls=self.__class__.__name__, columns=list(self.columns), count=len(self._rows))
 
 
 def create_rows(data, session, table_name, cl=None, format_funcs=None, prefix='', postfix=''):
@@ -141,27 +230,30 @@ def create_rows(data, session, table_name, cl=None, format_funcs=None, prefix=''
     format_funcs should be a dictionary of {columnname: function} if data needs to be formatted
     before being included in CQL.
 
-    Returns a list of maps describing the data created.
+    Rows are generated and inserted as a stream, so multiplied rows (e.g. *100000) are never
+    all materialized as dicts.
+
+    Returns a RowSet describing the data created.
     """
-    values = []
-    dicts = parse_data_into_dicts(data, format_funcs=format_funcs)
+    headers, values = iter_data_values(data, format_funcs=format_funcs)
+    expected = RowSet(headers)
 
-    # use the first dictionary to build a prepared statement for all
     prepared = session.prepare(
         "{prefix} INSERT INTO {table} ({cols}) values ({vals}) {postfix}".format(
-            prefix=prefix, table=table_name, cols=', '.join(list(dicts[0].keys())),
-            vals=', '.join('?' for k in list(dicts[0].keys())), postfix=postfix)
+            prefix=prefix, table=table_name, cols=', '.join(headers),
+            vals=', '.join('?' for _ in headers), postfix=postfix)
     )
     if cl is not None:
         prepared.consistency_level = cl
 
-    query_results = execute_concurrent_with_args(session, prepared, [list(d.values()) for d in dicts])
+    def record(values):
+        for row_values in values:
+            expected.append_values(row_values)
+            yield row_values
 
-    for i, (status, result_or_exc) in enumerate(query_results):
-        # should maybe check status here before appening to expected values
-        values.append(dicts[i])
+    bulk_load(session, prepared, record(values))
 
-    return values
+    return expected
 
 
 def flatten_into_set(iterable):
@@ -170,13 +262,14 @@ def flatten_into_set(iterable):
 
 
 def flatten(list_of_dicts):
-    # flatten list of dicts into list of strings for easier comparison
-    # and easier set membership testing (e.g. foo is subset of bar)
-    flattened = []
-
-    for _dict in list_of_dicts:
-        sorted_keys = sorted(_dict)
-        items = ['{}__{}'.format(k, _dict[k]) for k in sorted_keys]
-        flattened.append('__'.join(items))
-
-    return flattened
+    # flatten list of rows into a list of canonical rows (tuples of
+    # (column, normalized value) pairs) for easier comparison and
+    # easier set membership testing (e.g. foo is subset of bar)
+    if isinstance(list_of_dicts, RowSet):
+        # build the canonical rows straight from the stored tuples
+        columns = list_of_dicts.columns
+        order = sorted(range(len(columns)), key=lambda i: columns[i])
+        return [tuple((columns[i], normalize_value(values[i])) for i in order)
+                for values in list_of_dicts.tuples()]
+
+    return [canonical_row(row) for row in list_of_dicts]
@@ -0,0 +1,202 @@
+"""
+On-disk cache of pre-generated SSTable datasets.
+
+Many tests spend a large part of their runtime writing the same rows through
+CQL and flushing them before the interesting part of the test starts. This
+module lets a test generate such a dataset once, keep the flushed SSTables in
+a cache directory, and on later runs load them straight into the cluster
+instead of writing the rows again.
+
+Datasets are keyed by Cassandra version, table schema, generator seed and row
+count, so a change to any of those produces a fresh dataset. The cache is
+disabled unless a cache directory is given with --dataset-cache-dir.
+
+Example:
+
+    def populate(session, rows, seed):
+        insert_c1c2(session, n=rows, consistency=ConsistencyLevel.ALL)
+
+    load_or_create_dataset(self, session, 'ks', 'cf', schema=CF_SCHEMA, rows=1000, populate=populate)
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# files belonging to a table that are not sstable components
+_IGNORED_TABLE_ENTRIES = ('backups', 'snapshots')
+_COMPLETE_MARKER = 'dataset.json'
+
+
+def dataset_key(version, schema, seed, rows):
+    """
+    Returns a stable hex digest identifying a dataset.
+    @param version Cassandra version the sstables were written with
+    @param schema CQL of the table the dataset belongs to
+    @param seed Seed given to the data generator
+    @param rows Number of rows in the dataset
+    """
+    normalized_schema = ' '.join(schema.split()).lower()
+    key = '|'.join([str(version), normalized_schema, str(seed), str(rows)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def table_directories(node, ks, table):
+    """
+    Returns the directories holding the sstables of ks.table in every data directory of the node.
+    Table directories are named 'table-<id>' since 2.1, and just 'table' before that.
+    """
+    result = []
+    for data_dir in node.data_directories():
+        ks_dir = os.path.join(data_dir, ks)
+        result.extend(glob.glob(os.path.join(ks_dir, '{}-*'.format(table))))
+        if os.path.isdir(os.path.join(ks_dir, table)):
+            result.append(os.path.join(ks_dir, table))
+    return [d for d in result if os.path.isdir(d)]
+
+
+def _sstable_files(table_dir):
+    return [os.path.join(table_dir, name) for name in sorted(os.listdir(table_dir))
+            if name not in _IGNORED_TABLE_ENTRIES and os.path.isfile(os.path.join(table_dir, name))]
+
+
+class SSTableDatasetCache(object):
+    """
+    Stores and restores the flushed sstables of a single table.
+
+    A dataset is stored as one sub directory per node (named after the node)
+    under <cache_dir>/<dataset key>/, plus a small json descriptor written
+    last so that an interrupted store is never mistaken for a complete one.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.expanduser(cache_dir)
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def has(self, key):
+        return os.path.isfile(os.path.join(self.path_for(key), _COMPLETE_MARKER))
+
+    def store(self, nodes, ks, table, key, description=None):
+        """
+        Flushes ks.table on every node and copies the resulting sstables into the cache.
+        """
+        target = self.path_for(key)
+        tmp_target = target + '.tmp'
+        if os.path.exists(tmp_target):
+            shutil.rmtree(tmp_target)
+
+        file_count = 0
+        for node in nodes:
+            node.flush(options=[ks, table])
+            node_dir = os.path.join(tmp_target, node.name)
+            os.makedirs(node_dir)
+            for table_dir in table_directories(node, ks, table):
+                for sstable_file in _sstable_files(table_dir):
+                    shutil.copy2(sstable_file, node_dir)
+                    file_count += 1
+
+        with open(os.path.join(tmp_target, _COMPLETE_MARKER), 'w') as f:
+            json.dump({'keyspace': ks, 'table': table, 'nodes': [node.name for node in nodes],
+                       'description': description}, f)
+
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.rename(tmp_target, target)
+        logger.debug("Stored {} sstable files of {}.{} in dataset cache {}".format(file_count, ks, table, target))
+
+    def load(self, nodes, ks, table, key, method=None):
+        """
+        Loads a cached dataset into an already created, empty ks.table.
+
+        @param nodes The nodes of the (running) cluster
+        @param method One of 'import' (nodetool import --copy-data, 4.0+), 'refresh' (copy into the
+                      table directory then nodetool refresh) or 'sstableloader'. Defaults to
+                      'import' or 'refresh' for single node clusters whose node stored the
+                      dataset, and 'sstableloader' otherwise, as token ownership of a multi
+                      node cluster may differ from the one the dataset was written with.
+        """
+        source = self.path_for(key)
+        node_dirs = [os.path.join(source, name) for name in sorted(os.listdir(source))
+                     if os.path.isdir(os.path.join(source, name))]
+
+        if method is None:
+            if len(nodes) == 1 and os.path.isdir(os.path.join(source, nodes[0].name)):
+                method = 'import' if nodes[0].get_cassandra_version() >= '4.0' else 'refresh'
+            else:
+                method = 'sstableloader'
+
+        logger.debug("Loading dataset {} into {}.{} using {}".format(source, ks, table, method))
+        if method == 'import':
+            for node in nodes:
+                # without --copy-data the sstables would be moved out of the cache
+                node.nodetool('import --copy-data {} {} {}'.format(ks, table, os.path.join(source, node.name)))
+        elif method == 'refresh':
+            for node in nodes:
+                table_dir = table_directories(node, ks, table)[0]
+                for sstable_file in _sstable_files(os.path.join(source, node.name)):
+                    shutil.copy2(sstable_file, table_dir)
+                node.nodetool('refresh {} {}'.format(ks, table))
+        elif method == 'sstableloader':
+            for node_dir in node_dirs:
+                self._sstableload(nodes[0], ks, table, node_dir)
+        else:
+            raise ValueError("Unknown dataset load method '{}'".format(method))
+
+    def _sstableload(self, node, ks, table, node_dir):
+        # sstableloader derives keyspace and table from the last two path components
+        load_dir = os.path.join(node_dir + '.load', ks, table)
+        if os.path.exists(load_dir):
+            shutil.rmtree(load_dir)
+        os.makedirs(load_dir)
+        try:
+            for sstable_file in _sstable_files(node_dir):
+                os.link(sstable_file, os.path.join(load_dir, os.path.basename(sstable_file)))
+
+            args = [node.get_tool('sstableloader'), '-d', node.address(), load_dir]
+            p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = p.communicate()
+            if p.returncode != 0:
+                raise Exception("sstableloader command '%s' failed; exit status: %d'; stdout: %s; stderr: %s" %
+                                (" ".join(args), p.returncode, stdout.decode("utf-8"), stderr.decode("utf-8")))
+        finally:
+            shutil.rmtree(node_dir + '.load')
+
+
+def load_or_create_dataset(tester, session, ks, table, schema, rows, populate, seed=0, method=None):
+    """
+    Fills ks.table either from the dataset cache or by running populate, storing the result
+    in the cache for the next run. The table must already exist and be empty.
+
+    @param tester The running Tester, used to reach the cluster and the dtest config
+    @param session Session passed to populate
+    @param schema CQL of the table, only used to identify the dataset
+    @param rows Number of rows populate writes, only used to identify the dataset
+    @param populate Callable of (session, rows, seed) writing the dataset through CQL
+    @param seed Seed for populate's data generator
+    @param method Load method, see SSTableDatasetCache.load
+    @return True if the data was loaded from the cache, False if populate was run
+    """
+    cache_dir = tester.dtest_config.dataset_cache_dir
+    if cache_dir is None:
+        populate(session, rows, seed)
+        return False
+
+    nodes = tester.cluster.nodelist()
+    cache = SSTableDatasetCache(cache_dir)
+    # the nodes may run another version than the cluster's, e.g. to test bootstrapping from it
+    version = ','.join(sorted({str(node.get_cassandra_version()) for node in nodes}))
+    key = dataset_key(version, schema, seed, rows)
+    if cache.has(key):
+        cache.load(nodes, ks, table, key, method=method)
+        return True
+
+    populate(session, rows, seed)
+    cache.store(nodes, ks, table, key, description='{} rows, seed {}'.format(rows, seed))
+    return False
@@ -0,0 +1,146 @@
+"""
+Runs many independent scenarios of dependent queries concurrently through execute_async.
+
+A scenario is a generator yielding lists of Requests. The requests of a list are executed
+concurrently, and once all of them completed the scenario is sent their Responses, in the same
+order, to check them and decide what to yield next. The requests of all scenarios are in flight
+together, up to max_in_flight of them. Only the first page of the rows of a response is fetched.
+
+Each request states the outcome it expects: rows, or one of its expected_errors. A request that
+fails unexpectedly, or succeeds while it was expected to fail, ends its scenario, and so does an
+AssertionError (or any other exception) raised by the scenario itself. The failures of all
+scenarios are raised together once every scenario has finished, as a MultiError.
+
+Example:
+
+    def insert_and_read(key):
+        yield [Request(session, insert_statement(key))]
+        responses = yield [Request(s, select_statement(key)) for s in sessions]
+        assert all(rows_to_list(r.rows) == [[key]] for r in responses)
+
+    run_scenarios_async([('key {}'.format(k), insert_and_read(k)) for k in range(100)])
+"""
+import queue
+import traceback
+from collections import deque, namedtuple
+
+from dtest import MultiError
+
+DEFAULT_MAX_IN_FLIGHT = 256
+
+Request = namedtuple('Request', ['session', 'statement', 'expected_errors'])
+# most requests are expected to succeed
+Request.__new__.__defaults__ = (None,)
+
+Response = namedtuple('Response', ['rows', 'error'])
+
+
+class _Step(object):
+    """The requests a scenario yielded and the responses received so far"""
+
+    def __init__(self, label, scenario, requests):
+        self.label = label
+        self.scenario = scenario
+        self.requests = requests
+        self.responses = [None] * len(requests)
+        self.remaining = len(requests)
+        self.failed = False
+
+
+def _describe(request):
+    return "{} via {}".format(getattr(request.statement, 'query_string', request.statement),
+                              request.session.cluster.contact_points)
+
+
+def run_scenarios_async(scenarios, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    """
+    :param scenarios: iterable of (label, generator) pairs, the label identifies the scenario in failures
+    :param max_in_flight: the most requests executed at once, over all scenarios
+    :raise MultiError: with the failures of all scenarios that failed
+    """
+    scenarios = iter(scenarios)
+    completions = queue.Queue()
+    ready = deque()
+    exceptions, tracebacks = [], []
+    in_flight = 0
+
+    def fail(label, message):
+        exceptions.append(AssertionError("{}: {}".format(label, message)))
+        tracebacks.append('')
+
+    def advance(label, scenario, responses=None):
+        # a scenario may yield an empty list, which is answered right away
+        while True:
+            try:
+                requests = next(scenario) if responses is None else scenario.send(responses)
+            except StopIteration:
+                return
+            except Exception as e:
+                exceptions.append(AssertionError("{}: {}".format(label, e)))
+                tracebacks.append(traceback.format_exc())
+                return
+            if requests:
+                step = _Step(label, scenario, list(requests))
+                ready.extend((step, index) for index in range(len(step.requests)))
+                return
+            responses = []
+
+    def completed(step, index, rows, error):
+        completions.put((step, index, Response(rows, error)))
+
+    while True:
+        # start new scenarios only once the requests of the running ones are all in flight
+        while not ready and in_flight < max_in_flight:
+            try:
+                label, scenario = next(scenarios)
+            except StopIteration:
+                break
+            advance(label, scenario)
+
+        while ready and in_flight < max_in_flight:
+            step, index = ready.popleft()
+            request = step.requests[index]
+            try:
+                future = request.session.execute_async(request.statement)
+            except Exception as e:
+                completed(step, index, None, e)
+            else:
+                future.add_callbacks(callback=lambda rows, step=step, index=index: completed(step, index, rows, None),
+                                     errback=lambda error, step=step, index=index: completed(step, index, None, error))
+            in_flight += 1
+
+        if not in_flight:
+            break
+
+        step, index, response = completions.get()
+        in_flight -= 1
+        if step.failed:
+            continue
+
+        request = step.requests[index]
+        expected_errors = request.expected_errors
+        if response.error is not None and not (expected_errors and isinstance(response.error, expected_errors)):
+            message = "{} failed: {!r}".format(_describe(request), response.error)
+        elif response.error is None and expected_errors:
+            message = "{} succeeded, expected one of {}".format(
+                _describe(request), [e.__name__ for e in expected_errors])
+        else:
+            message = None
+
+        if message is not None:
+            step.failed = True
+            step.scenario.close()
+            fail(step.label, message)
+            # the step's requests that are still waiting for a slot won't be needed anymore
+            unneeded = [entry for entry in ready if entry[0] is step]
+            for entry in unneeded:
+                ready.remove(entry)
+            continue
+
+        step.responses[index] = response
+        step.remaining -= 1
+        if not step.remaining:
+            advance(step.label, step.scenario, step.responses)
+
+    if exceptions:
+        raise MultiError(exceptions=exceptions, tracebacks=tracebacks)
@@ -0,0 +1,70 @@
+"""
+Moves the nodes of a ccm cluster from the default 127.0.0.x loopback addresses into
+another loopback block, so several dtest processes can run clusters on one machine.
+
+Nodes listen on 127.0.<block>.x instead of 127.0.0.x. The ports ccm binds on localhost
+(JMX, byteman and remote debugging) are shifted by 10 * block, which keeps the
+7000 + 100 * i ports of different blocks apart for up to MAX_LOOPBACK_BLOCKS blocks.
+Block 0 leaves the cluster untouched.
+
+Example:
+
+    cluster = Cluster(test_path, 'test', cassandra_dir=cassandra_dir)
+    use_loopback_block(cluster, 2)
+    cluster.populate(3)  # node1 listens on 127.0.2.1, its JMX on port 7120
+"""
+DEFAULT_IP_PREFIX = '127.0.0.'
+MAX_LOOPBACK_BLOCKS = 10
+
+
+def loopback_ip_prefix(block):
+    return '127.0.{}.'.format(block)
+
+
+def loopback_address(address, block):
+    """
+    Maps a 127.0.0.x address into the 127.0.<block>.x block, leaving other addresses alone
+    """
+    if address is not None and address.startswith(DEFAULT_IP_PREFIX):
+        return loopback_ip_prefix(block) + address[len(DEFAULT_IP_PREFIX):]
+    return address
+
+
+def loopback_port(port, block):
+    """
+    Shifts a localhost port of a node into the block, '0' (disabled) stays disabled
+    """
+    if port is None or str(port) == '0':
+        return port
+    return str(int(port) + 10 * block)
+
+
+def move_node_to_loopback_block(node, block):
+    for name, interface in list(node.network_interfaces.items()):
+        if interface is not None:
+            node.network_interfaces[name] = (loopback_address(interface[0], block), interface[1])
+    node.ip_addr = loopback_address(node.ip_addr, block)
+    node.jmx_port = loopback_port(node.jmx_port, block)
+    node.remote_debug_port = loopback_port(node.remote_debug_port, block)
+    node.byteman_port = loopback_port(node.byteman_port, block)
+
+
+def use_loopback_block(cluster, block):
+    """
+    Makes every node added to the cluster from now on use the given loopback block. All
+    of ccm's ways of creating nodes (populate, new_node, Node(...) followed by cluster.add)
+    go through cluster.add, which also writes the node's configuration.
+    """
+    if not block:
+        return cluster
+    if not 0 < block < MAX_LOOPBACK_BLOCKS:
+        raise ValueError("Loopback block must be between 0 and {}, got {}".format(MAX_LOOPBACK_BLOCKS - 1, block))
+
+    add = cluster.add
+
+    def add_in_block(node, is_seed, data_center=None):
+        move_node_to_loopback_block(node, block)
+        return add(node, is_seed, data_center=data_center)
+
+    cluster.add = add_in_block
+    return cluster
@@ -0,0 +1,173 @@
+"""
+Compares the data of replicas through Merkle trees of token subranges, the way repair does,
+so that agreement can be checked on datasets too large to pull and compare in full.
+
+The ring from the driver's token map is cut into subranges, in proportion to the width of
+each range between two tokens of the ring. Every replica of a range reads each subrange of
+it locally at NODE_LOCAL (see tools.replicas), hashing the digests of its partitions into a
+leaf instead of holding them. The leaves of each range build one Merkle tree per replica,
+and descending the trees of the replicas where their hashes differ finds the mismatching
+subranges. Only those are read again, this time keeping the partition digests, to find the
+mismatching partitions. Reads run concurrently over all replicas and subranges.
+
+The nodes have to be 4.0+ with NODE_LOCAL reads enabled (see enable_node_local_reads), and
+the cluster has to use the Murmur3Partitioner.
+
+Example:
+
+    mismatches = compare_replicas([(node, self.patient_exclusive_cql_connection(node)) for node in nodes],
+                                  'keyspace1', 'standard1')
+    assert not mismatches, mismatches
+"""
+import hashlib
+import logging
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from cassandra import InvalidRequest
+from cassandra.metadata import Murmur3Token
+
+from tools.replicas import iter_node_local_digests
+
+logger = logging.getLogger(__name__)
+
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+DEFAULT_LEAVES = 256
+DEFAULT_MAX_WORKERS = 16
+
+# a subrange where replicas disagree: partitions maps the key of every partition that is missing
+# from a replica or differs between them to its digest on each replica (None where missing)
+RangeMismatch = namedtuple('RangeMismatch', ['start', 'end', 'partitions'])
+
+
+def _hash(parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class MerkleTree(object):
+    """
+    Binary hash tree over the hashes of consecutive subranges
+    """
+
+    def __init__(self, leaves):
+        self.levels = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            self.levels.append([_hash(level[i:i + 2]) for i in range(0, len(level), 2)])
+
+    @property
+    def root(self):
+        return self.levels[-1][0]
+
+    def differences(self, other):
+        """
+        Returns the indexes of the leaves differing from those of other, a tree over as many
+        leaves, only descending into the subtrees whose hashes differ
+        """
+        differing = [0]
+        for depth in range(len(self.levels) - 1, -1, -1):
+            differing = [i for i in differing if self.levels[depth][i] != other.levels[depth][i]]
+            if depth:
+                below = len(self.levels[depth - 1])
+                differing = [child for i in differing for child in (2 * i, 2 * i + 1) if child < below]
+        return differing
+
+
+def split_ring(ring, leaves=DEFAULT_LEAVES):
+    """
+    Returns, for each range (previous token, token] of the ring, the token ending it and the
+    (start, end] subranges it is cut into, about leaves subranges over the whole ring. The range
+    wrapping around the ring is cut at its end.
+    @param ring Sorted list of the token values of the ring
+    """
+    ranges = []
+    for i, end in enumerate(ring):
+        start = ring[i - 1]
+        # the range wrapping around is the range (last token, MAX_TOKEN] and (MIN_TOKEN, first token]
+        pieces = [(start, end)] if start < end else [(start, MAX_TOKEN), (MIN_TOKEN, end)]
+        pieces = [(s, e) for s, e in pieces if s < e]
+        width = sum(e - s for s, e in pieces)
+        count = max(1, -(-leaves * width // (MAX_TOKEN - MIN_TOKEN)))
+        subranges = []
+        for s, e in pieces:
+            piece_count = max(1, -(-count * (e - s) // width))
+            bounds = sorted({s + (e - s) * j // piece_count for j in range(piece_count)} | {e})
+            subranges.extend(zip(bounds, bounds[1:]))
+        ranges.append((end, subranges))
+    return ranges
+
+
+def _node_local_digests(node, session, keyspace, table, subrange):
+    try:
+        for item in iter_node_local_digests(session, keyspace, table, subrange):
+            yield item
+    except InvalidRequest as e:
+        if 'NODE_LOCAL' not in str(e):
+            raise
+        raise ValueError("{} refused a NODE_LOCAL read, the node must be started with "
+                         "enable_node_local_reads: {}".format(node.name, e))
+
+
+def _leaf_hash(node, session, keyspace, table, subrange):
+    return _hash(repr(item) for item in _node_local_digests(node, session, keyspace, table, subrange))
+
+
+def _partition_digests(node, session, keyspace, table, subrange):
+    return OrderedDict(_node_local_digests(node, session, keyspace, table, subrange))
+
+
+def compare_replicas(nodes_and_sessions, keyspace, table, leaves=DEFAULT_LEAVES, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Returns the RangeMismatch of every subrange whose replicas among the given nodes disagree,
+    in token order. Ranges with a single replica among the nodes aren't compared.
+    @raise ValueError if a node refuses NODE_LOCAL reads, see enable_node_local_reads
+    @param nodes_and_sessions (node, session) pairs, each session connected to its node only
+    @param keyspace Keyspace of the table, its replication decides the replicas of each range
+    @param table Table to compare
+    @param leaves Rough number of subranges to cut the ring into
+    @param max_workers Number of reads running at once
+    """
+    nodes_and_sessions = list(nodes_and_sessions)
+    by_address = {node.address(): (node, session) for node, session in nodes_and_sessions}
+    token_map = nodes_and_sessions[0][1].cluster.metadata.token_map
+    if token_map.token_class is not Murmur3Token:
+        raise ValueError("Only the Murmur3Partitioner is supported, not {}".format(token_map.token_class.__name__))
+
+    ranges = []
+    for end, subranges in split_ring([t.value for t in token_map.ring], leaves):
+        hosts = token_map.get_replicas(keyspace, Murmur3Token(end))
+        replicas = [by_address[host.address] for host in hosts if host.address in by_address]
+        if len(replicas) > 1:
+            ranges.append((replicas, subranges))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        leaf_futures = [[[executor.submit(_leaf_hash, node, session, keyspace, table, subrange) for subrange in subranges]
+                         for node, session in replicas]
+                        for replicas, subranges in ranges]
+        differing = []
+        for (replicas, subranges), futures in zip(ranges, leaf_futures):
+            trees = [MerkleTree(f.result() for f in replica_futures) for replica_futures in futures]
+            indexes = sorted({i for tree in trees[1:] for i in trees[0].differences(tree)})
+            differing.extend((replicas, subranges[i]) for i in indexes)
+        logger.debug("{} of {} subranges of {}.{} differ between replicas".format(
+            len(differing), sum(len(subranges) for _, subranges in ranges), keyspace, table))
+
+        digest_futures = [[executor.submit(_partition_digests, node, session, keyspace, table, subrange)
+                           for node, session in replicas]
+                          for replicas, subrange in differing]
+        mismatches = []
+        for (replicas, subrange), futures in zip(differing, digest_futures):
+            digests = [(node.name, f.result()) for (node, _), f in zip(replicas, futures)]
+            partitions = OrderedDict()
+            for _, replica_digests in digests:
+                for key in replica_digests:
+                    on_replicas = {other: other_digests.get(key) for other, other_digests in digests}
+                    if len(set(on_replicas.values())) > 1:
+                        partitions[key] = on_replicas
+            mismatches.append(RangeMismatch(subrange[0], subrange[1], partitions))
+    return sorted(mismatches, key=lambda m: m.start)
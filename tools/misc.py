@@ -1,7 +1,6 @@
 import os
 import subprocess
 import time
-import hashlib
 import logging
 import pytest
 
@@ -76,34 +75,55 @@ def generate_ssl_stores(base_dir, passphrase='cassandra'):
                            '-storepass', passphrase, '-noprompt'])
 
 
-def list_to_hashed_dict(list):
+def normalize_value(value):
     """
-    takes a list and hashes the contents and puts them into a dict so the contents can be compared
-    without order. unfortunately, we need to do a little massaging of our input; the result from
-    the driver can return a OrderedMapSerializedKey (e.g. [0, 9, OrderedMapSerializedKey([(10, 11)])])
-    but our "expected" list is simply a list of elements (or list of list). this means if we
-    hash the values as is we'll get different results. to avoid this, when we see a dict,
-    convert the raw values (key, value) into a list and insert that list into a new list
-    :param list the list to convert into a dict
-    :return: a dict containing the contents fo the list with the hashed contents
+    Converts a value returned by the driver, or written by hand in a test's expected
+    results, into a hashable form that compares equal regardless of the container
+    types used. Maps (dict, OrderedMap, OrderedMapSerializedKey) and sets (set,
+    SortedSet) become frozensets, while lists, tuples and UDT values (namedtuples)
+    become tuples, so that e.g. {1: 'a'} and OrderedMapSerializedKey([(1, 'a')]) or
+    [1, 2] and (1, 2) normalize to the same value.
     """
-    hashed_dict = dict()
-    for item_lst in list:
-        normalized_list = []
-        for item in item_lst:
-            if hasattr(item, "items"):
-                tmp_list = []
-                for a, b in item.items():
-                    tmp_list.append(a)
-                    tmp_list.append(b)
-                normalized_list.append(tmp_list)
-            else:
-                normalized_list.append(item)
-        list_str = str(normalized_list)
-        utf8 = list_str.encode('utf-8', 'ignore')
-        list_digest = hashlib.sha256(utf8).hexdigest()
-        hashed_dict[list_digest] = normalized_list
-    return hashed_dict
+    if isinstance(value, (str, bytes, bytearray)):
+        return value
+    if hasattr(value, "items"):
+        return frozenset((normalize_value(k), normalize_value(v)) for k, v in value.items())
+    if isinstance(value, (set, frozenset)) or type(value).__name__ == 'SortedSet':
+        return frozenset(normalize_value(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_value(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        if hasattr(value, "__dict__"):
+            # UDT mapped to an (unhashable) class registered with the driver
+            return tuple(sorted((k, normalize_value(v)) for k, v in vars(value).items()))
+        return repr(value)
+    return value
+
+
+def normalize_row(row):
+    """
+    Returns a row (a driver row or a list of expected values) as a hashable tuple of normalized values.
+    """
+    return tuple(normalize_value(v) for v in row)
+
+
+def canonical_row(row):
+    """
+    Returns the canonical, hashable form of a row used by the order-insensitive and subset
+    assertions: a tuple of (column, normalized value) pairs sorted by column name for rows
+    with column names (dicts, dict_factory and named_tuple_factory rows), or a tuple of
+    normalized values for plain lists and tuples. Unlike string based flattening this never
+    produces collisions, whatever the values look like.
+    """
+    if hasattr(row, "items"):
+        pairs = row.items()
+    elif hasattr(row, "_fields"):
+        pairs = zip(row._fields, row)
+    else:
+        return normalize_row(row)
+    return tuple(sorted((column, normalize_value(value)) for column, value in pairs))
 
 
 def get_current_test_name():
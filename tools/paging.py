@@ -1,16 +1,23 @@
+import hashlib
 import time
+from collections import Counter
 
-from tools.datahelp import flatten_into_set
-from tools.misc import list_to_hashed_dict
+from tools.datahelp import flatten, flatten_into_set
+from tools.misc import normalize_row
 
 class Page(object):
     data = None
+    size = None
 
-    def __init__(self):
-        self.data = []
+    def __init__(self, keep_rows=True):
+        # pages fetched with keep_rows=False only remember how many rows they held
+        self.data = [] if keep_rows else None
+        self.size = 0
 
     def add_row(self, row):
-        self.data.append(row)
+        if self.data is not None:
+            self.data.append(row)
+        self.size += 1
 
 
 class PageFetcher(object):
@@ -20,16 +27,26 @@ class PageFetcher(object):
 
     The first page is automatically retrieved, so an initial
     call to request_one is actually getting the *second* page!
+
+    To page through very large results with constant memory, pass
+    keep_rows=False and a page_checker: each page is handed to
+    page_checker(page_num, rows) as soon as it arrives, and only the
+    page sizes and a rolling digest of the rows are kept. A failure
+    raised by the checker is re-raised by the next wait/request call.
     """
     pages = None
     error = None
+    check_error = None
     future = None
     requested_pages = None
     retrieved_pages = None
     retrieved_empty_pages = None
 
-    def __init__(self, future):
+    def __init__(self, future, page_checker=None, keep_rows=True):
         self.pages = []
+        self.page_checker = page_checker
+        self.keep_rows = keep_rows
+        self._digest = hashlib.sha256()
 
         # the first page is automagically returned (eventually)
         # so we'll count this as a request, but the retrieved count
@@ -55,12 +72,19 @@ class PageFetcher(object):
             self.retrieved_empty_pages += 1
             return
 
-        page = Page()
-        self.pages.append(page)
+        page = Page(keep_rows=self.keep_rows)
 
         for row in rows:
             page.add_row(row)
+            self._digest.update(repr(normalize_row(row)).encode('utf-8'))
 
+        if self.page_checker is not None and self.check_error is None:
+            try:
+                self.page_checker(len(self.pages) + 1, rows)
+            except Exception as e:
+                self.check_error = e
+
+        self.pages.append(page)
         self.retrieved_pages += 1
 
     def handle_error(self, exc):
@@ -107,6 +131,8 @@ class PageFetcher(object):
         expiry = time.time() + seconds
 
         while time.time() < expiry:
+            if self.check_error is not None:
+                raise self.check_error
             if self.requested_pages == (self.retrieved_pages + self.retrieved_empty_pages):
                 return self
             # small wait so we don't need excess cpu to keep checking
@@ -128,10 +154,26 @@ class PageFetcher(object):
         """
         Returns the number of results found at page_num
         """
-        return len(self.pages[page_num - 1].data)
+        return self.pages[page_num - 1].size
 
     def num_results_all(self):
-        return [len(page.data) for page in self.pages]
+        return [page.size for page in self.pages]
+
+    def num_results_total(self):
+        """
+        Returns the number of results found across all retrieved pages.
+        """
+        return sum(page.size for page in self.pages)
+
+    def digest(self):
+        """
+        Returns a digest of all retrieved rows, in the order they were retrieved.
+        """
+        return self._digest.hexdigest()
+
+    def _check_rows_kept(self):
+        if not self.keep_rows:
+            raise RuntimeError("Rows were not kept by this PageFetcher, create it with keep_rows=True to access them")
 
     def page_data(self, page_num):
         """
@@ -139,6 +181,7 @@ class PageFetcher(object):
 
         The page should have already been requested with request_one and/or request_all.
         """
+        self._check_rows_kept()
         return self.pages[page_num - 1].data
 
     def all_data(self):
@@ -147,6 +190,7 @@ class PageFetcher(object):
 
         The page(s) should have already been requested with request_one and/or request_all.
         """
+        self._check_rows_kept()
         all_pages_combined = []
         for page in self.pages:
             all_pages_combined.extend(page.data[:])
@@ -165,20 +209,17 @@ class PageAssertionMixin(object):
     """Can be added to subclasses of unittest.Tester"""
 
     def assertEqualIgnoreOrder(self, actual, expected):
-        hashed_expected = list_to_hashed_dict(expected)
-        hashed_actual = list_to_hashed_dict(actual)
-        for key, expected in hashed_expected.items():
-            assert key in hashed_actual, "expected %s not in actual" % str(expected)
-            actual = hashed_actual[key]
-            assert actual == expected, "actual %s not same as expected %s" % (str(actual), str(expected))
-
-        for key, actual in hashed_actual.items():
-            assert key in hashed_expected, "actual %s not in expected" % str(actual)
-            expected = hashed_expected[key]
-            assert expected == actual, "expected %s not same as actual %s" % (str(expected), str(actual))
-
-        assert hashed_expected == hashed_actual
-
+        """
+        Asserts actual and expected hold the same rows, duplicates included, in any order.
+        Rows are compared in their canonical form (see tools.misc.canonical_row).
+        """
+        canonical_actual = Counter(flatten(actual))
+        canonical_expected = Counter(flatten(expected))
+        missing = canonical_expected - canonical_actual
+        unexpected = canonical_actual - canonical_expected
+        assert not missing and not unexpected, \
+            "expected rows not in actual: {}; actual rows not in expected: {}".format(
+                list(missing.elements())[:20], list(unexpected.elements())[:20])
 
     def assertIsSubsetOf(self, subset, superset):
         assert flatten_into_set(subset) <= flatten_into_set(superset)
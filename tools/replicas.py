@@ -0,0 +1,241 @@
+"""
+Reads the contents of a single replica while the rest of the cluster keeps running, as a
+digest per partition, so replicas can be compared without stopping the others.
+
+On 4.0+ the table is read through the replica's own coordinator at the NODE_LOCAL
+consistency level, which only reads the local data. That level has to be enabled with
+-Dcassandra.enable_nodelocal_queries=true, which enable_node_local_reads adds to the
+nodes' jvm options (call it before starting the nodes). 3.11 nodes, and nodes refusing
+NODE_LOCAL reads, have the table snapshotted (which flushes it first) and the snapshot's
+sstables streamed through sstabledump. Older versions can't be read this way (see
+supports_replica_digests): sstabledump doesn't exist before 3.0, nor is it relied on to
+print raw timestamps before 3.11. The sstables are reconciled by
+timestamp: partition, row and cell deletions shadow the older data and expired data is
+dropped. Range tombstones aren't applied, so ranges deleted with them look live.
+
+Digests hash the string form of the partition key, clustering and non-null regular and
+static column values, which both ways of reading render alike for text and numeric
+types. partition_digest computes the digest of expected data. Collections and UDTs are
+read as a whole by NODE_LOCAL reads and per cell by sstabledump, so for tables having
+them only compare digests read the same way.
+
+Example:
+
+    digests = read_replica_digests(node1, self.patient_exclusive_cql_connection(node1), 'ks', 'cf')
+    assert digests[('k1',)] == partition_digest([((), {'c1': 'value1', 'c2': 'value2'})])
+
+    by_node = read_replicas_digests([(node, self.patient_exclusive_cql_connection(node)) for node in nodes],
+                                    'ks', 'cf')
+"""
+import glob
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+from cassandra import InvalidRequest
+from cassandra.query import SimpleStatement
+
+from tools.sstables import SSTABLEDUMP_RAW_TIMESTAMPS_VERSION, stream_sstabledump
+
+logger = logging.getLogger(__name__)
+
+# ConsistencyLevel.NODE_LOCAL, which the driver doesn't know about
+NODE_LOCAL = 11
+ENABLE_NODE_LOCAL_QUERIES = '-Dcassandra.enable_nodelocal_queries=true'
+
+# an sstabledump timestamp lower than any real one, for missing deletions
+_NO_DELETION = -2 ** 63
+
+
+def enable_node_local_reads(nodes):
+    """
+    Allows NODE_LOCAL reads on the 4.0+ nodes, through their jvm options so restarts keep it.
+    Has to be called before the nodes start.
+    """
+    for node in nodes:
+        if node.get_cassandra_version() < '4.0':
+            continue
+        for name in ('jvm-server.options', 'jvm.options'):
+            options_file = os.path.join(node.get_conf_dir(), name)
+            if os.path.isfile(options_file):
+                with open(options_file, 'a') as f:
+                    f.write(os.linesep + ENABLE_NODE_LOCAL_QUERIES + os.linesep)
+                break
+
+
+def partition_digest(rows):
+    """
+    Returns the digest of a partition's rows, given as (clustering, cells) pairs where clustering
+    is the tuple of clustering values (None for the static row) and cells maps the names of the
+    row's non-null columns to their values. Rows may be given in any order.
+    """
+    digest = hashlib.sha1()
+    normalized = []
+    for clustering, cells in rows:
+        normalized.append((None if clustering is None else tuple(str(v) for v in clustering),
+                           sorted((str(name), str(value)) for name, value in cells.items())))
+    # the static row goes first
+    for clustering, cells in sorted(normalized, key=lambda row: (row[0] is not None, row[0] or ())):
+        digest.update(repr((clustering, cells)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def supports_replica_digests(node):
+    """
+    Returns whether read_replica_digests can read node, which needs its sstabledump to print raw
+    timestamps in case NODE_LOCAL reads are refused
+    """
+    return node.get_cassandra_version() >= SSTABLEDUMP_RAW_TIMESTAMPS_VERSION
+
+
+def read_replica_digests(node, session, keyspace, table):
+    """
+    Returns an OrderedDict mapping the partition keys found on node, as tuples of the string form
+    of the key components, to the digests of their live data. NODE_LOCAL reads return them in
+    token order, sstabledump in the order of the first sstable holding each partition.
+    @param node Replica to read
+    @param session Session connected to node only, e.g. a patient_exclusive_cql_connection
+    @param keyspace Keyspace of the table
+    @param table Table to read
+    @raise ValueError if the node is too old to be read, see supports_replica_digests
+    """
+    if not supports_replica_digests(node):
+        raise ValueError("Can't read the local data of {}, which runs {}".format(node.name, node.get_cassandra_version()))
+    if node.get_cassandra_version() >= '4.0':
+        try:
+            return OrderedDict(iter_node_local_digests(session, keyspace, table))
+        except InvalidRequest as e:
+            logger.debug("NODE_LOCAL reads refused by {}, falling back to sstabledump: {}".format(node.name, e))
+    return _sstabledump_digests(node, keyspace, table)
+
+
+def read_replicas_digests(nodes_and_sessions, keyspace, table, max_workers=None):
+    """
+    Concurrent version of read_replica_digests for (node, session) pairs, returning a dict of
+    node name to the node's digests.
+    """
+    nodes_and_sessions = list(nodes_and_sessions)
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(nodes_and_sessions))) as executor:
+        futures = [(node.name, executor.submit(read_replica_digests, node, session, keyspace, table))
+                   for node, session in nodes_and_sessions]
+        return {name: future.result() for name, future in futures}
+
+
+def iter_node_local_digests(session, keyspace, table, token_range=None):
+    """
+    Reads the table at NODE_LOCAL, yielding (partition key, digest) pairs as in read_replica_digests
+    in token order. Only works on 4.0+ nodes with NODE_LOCAL reads enabled.
+    @param session Session connected to the node only
+    @param token_range Optional (start, end) pair of token values restricting the read to the
+                       partitions of tokens in (start, end]
+    """
+    metadata = session.cluster.metadata.keyspaces[keyspace].tables[table]
+    partition_key = [c.name for c in metadata.partition_key]
+    clustering_key = [c.name for c in metadata.clustering_key]
+    static = [c.name for c in metadata.columns.values() if c.is_static]
+    regular = [name for name in metadata.columns if name not in partition_key + clustering_key + static]
+
+    query = 'SELECT * FROM "{}"."{}"'.format(keyspace, table)
+    if token_range is not None:
+        token = 'token({})'.format(', '.join('"{}"'.format(c) for c in partition_key))
+        query += ' WHERE {token} > %s AND {token} <= %s'.format(token=token)
+    statement = SimpleStatement(query, consistency_level=NODE_LOCAL)
+    # the rows of a partition are contiguous, so partitions can be digested as they are paged in
+    for key, rows in groupby(session.execute(statement, token_range),
+                             key=lambda r: tuple(getattr(r, c) for c in partition_key)):
+        rows = list(rows)
+        partition = []
+        static_cells = {c: getattr(rows[0], c) for c in static if getattr(rows[0], c) is not None}
+        if static_cells:
+            partition.append((None, static_cells))
+        # a partition holding only static data reads as a single row with null clustering values
+        if not clustering_key or getattr(rows[0], clustering_key[0]) is not None:
+            partition.extend((tuple(getattr(r, c) for c in clustering_key),
+                              {c: getattr(r, c) for c in regular if getattr(r, c) is not None}) for r in rows)
+        yield tuple(str(k) for k in key), partition_digest(partition)
+
+
+def _snapshot_data_files(node, keyspace, table, tag):
+    data_files = []
+    for data_dir in node.data_directories():
+        data_files.extend(glob.glob(os.path.join(data_dir, keyspace, table + '-*', 'snapshots', tag, '*-Data.db')))
+    return data_files
+
+
+def _sstabledump_digests(node, keyspace, table):
+    # the snapshot flushes the table, and compactions can't remove its hard links while they are dumped
+    tag = 'replica-digests-{}'.format(uuid.uuid4())
+    node.nodetool('snapshot -t {} -cf {} {}'.format(tag, table, keyspace))
+    try:
+        partitions = OrderedDict()
+        for data_file in _snapshot_data_files(node, keyspace, table, tag):
+            for dumped in stream_sstabledump(node, keyspace, datafiles=[data_file], raw_timestamps=True):
+                key = tuple(str(k) for k in dumped['partition']['key'])
+                partitions.setdefault(key, _Partition()).merge(dumped)
+    finally:
+        node.nodetool('clearsnapshot -t {} {}'.format(tag, keyspace))
+
+    digests = OrderedDict()
+    for key, partition in partitions.items():
+        rows = partition.live_rows()
+        if rows:
+            digests[key] = partition_digest(rows)
+    logger.debug("Read {} partitions of {}.{} from the sstables of {}".format(
+        len(digests), keyspace, table, node.name))
+    return digests
+
+
+def _marked_deleted(entry):
+    return entry.get('deletion_info', {}).get('marked_deleted', _NO_DELETION)
+
+
+class _Partition(object):
+    """
+    A partition's data merged from the sstabledump output of several sstables, keeping the newest
+    version of each row marker and cell
+    """
+
+    def __init__(self):
+        self.deletion = _NO_DELETION
+        # clustering (None for the static row) -> [row deletion, row marker timestamp, {cell: (timestamp, deleted, value)}]
+        self.rows = {}
+
+    def merge(self, dumped):
+        self.deletion = max(self.deletion, _marked_deleted(dumped['partition']))
+        for row in dumped.get('rows', []):
+            if row['type'] == 'static_block':
+                clustering = None
+            elif row['type'] == 'row':
+                clustering = tuple(row.get('clustering', ()))
+            else:
+                # range tombstone markers
+                continue
+            merged = self.rows.setdefault(clustering, [_NO_DELETION, _NO_DELETION, {}])
+            merged[0] = max(merged[0], _marked_deleted(row))
+
+            liveness = row.get('liveness_info', {})
+            if 'tstamp' in liveness and not liveness.get('expired', False):
+                merged[1] = max(merged[1], liveness['tstamp'])
+
+            for cell in row.get('cells', []):
+                name = cell['name'] if 'path' not in cell else '{}{}'.format(cell['name'], cell['path'])
+                timestamp = cell.get('tstamp', liveness.get('tstamp', _NO_DELETION))
+                # a tombstone wins over a value of the same timestamp, and the greater value over another one
+                live = 'deletion_info' not in cell and not cell.get('expired', False)
+                version = (timestamp, not live, str(cell.get('value')) if live else '')
+                if name not in merged[2] or version > merged[2][name]:
+                    merged[2][name] = version
+
+    def live_rows(self):
+        rows = []
+        for clustering, (row_deletion, marker, cells) in self.rows.items():
+            deletion = max(self.deletion, row_deletion)
+            live_cells = {name: value for name, (timestamp, deleted, value) in cells.items()
+                          if not deleted and timestamp > deletion}
+            if live_cells or (clustering is not None and marker > deletion):
+                rows.append((clustering, live_cells))
+        return rows
@@ -0,0 +1,436 @@
+"""
+Structured access to the output of the sstablemetadata and sstabledump offline tools.
+
+sstablemetadata starts a JVM for every invocation, and tests often check the
+repaired state of the same sstables several times in a row. get_sstable_metadata
+runs the tool for all requested nodes concurrently, parses its output into
+SSTableMetadata records, and caches the records by the path, modification time
+and size of each sstable's Statistics.db component (where the metadata lives),
+so repeated checks of unchanged sstables don't run the tool again.
+
+stream_sstabledump reads sstabledump's JSON output incrementally from the
+tool's stdout and yields one partition at a time, so content assertions can
+run over sstables much larger than the available memory.
+
+run_offline_tool_parallel runs any offline tool (sstableverify, sstablescrub,
+sstablelevelreset, ...) on several nodes at once.
+
+Example:
+
+    for node_name, sstables in get_sstable_metadata(cluster.nodelist(), 'keyspace1').items():
+        assert all(s.repaired for s in sstables), sstables
+
+    for partition, row in iter_sstabledump_rows(stream_sstabledump(node1, 'keyspace1', ['standard1'])):
+        assert row['type'] == 'row'
+
+    for result in run_offline_tool_parallel(cluster.nodelist(), 'sstableverify', ['keyspace1', 'standard1']):
+        assert 'Verify of' in result.stdout, result
+"""
+import io
+import json
+import os
+import re
+import subprocess
+import logging
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from uuid import UUID
+
+import ccmlib.common as common
+from ccmlib.node import ToolError, handle_external_tool_process
+
+logger = logging.getLogger(__name__)
+
+_sstable_name = re.compile(r'SSTable: (.+)')
+_repaired_at = re.compile(r'Repaired at: (\d+)')
+_pending_repair = re.compile(r'Pending repair: (\-\-|null|[a-f0-9\-]+)')
+_level = re.compile(r'SSTable Level: (\d+)')
+_min_timestamp = re.compile(r'Minimum timestamp: (-?\d+)')
+_max_timestamp = re.compile(r'Maximum timestamp: (-?\d+)')
+_droppable_tombstones = re.compile(r'Estimated droppable tombstones: ([-+.0-9Ee]+)')
+
+
+class SSTableMetadata(namedtuple('SSTableMetadata', ('name', 'repaired_at', 'pending_repair', 'level',
+                                                     'min_timestamp', 'max_timestamp', 'droppable_tombstones',
+                                                     'data_size'))):
+    """
+    Metadata of a single sstable. name is the sstable path without its component suffix
+    (e.g. .../na-1-big), and fields absent from the tool's output for the running
+    version (e.g. pending_repair before 4.0) are None.
+    """
+    __slots__ = ()
+
+    @property
+    def repaired(self):
+        return self.repaired_at is not None and self.repaired_at > 0
+
+    @property
+    def data_file(self):
+        return self.name + '-Data.db'
+
+
+def _int_or_none(m):
+    return int(m.group(1)) if m else None
+
+
+def _pending_repair_or_none(m):
+    if m is None or m.group(1) in ('null', '--'):
+        return None
+    return UUID(m.group(1))
+
+
+def _data_size(name):
+    try:
+        return os.path.getsize(name + '-Data.db')
+    except OSError:
+        return None
+
+
+def parse_sstablemetadata(output):
+    """
+    Parses the output of sstablemetadata, for any number of sstables, into a list of SSTableMetadata.
+    """
+    if isinstance(output, bytes):
+        output = output.decode('utf-8')
+
+    blocks = []
+    for line in output.split('\n'):
+        if _sstable_name.match(line):
+            blocks.append([line])
+        elif blocks:
+            blocks[-1].append(line)
+
+    result = []
+    for block in blocks:
+        def first(pattern):
+            for line in block:
+                m = pattern.match(line)
+                if m:
+                    return m
+            return None
+
+        name = first(_sstable_name).group(1).strip()
+        droppable = first(_droppable_tombstones)
+        result.append(SSTableMetadata(name=name,
+                                      repaired_at=_int_or_none(first(_repaired_at)),
+                                      pending_repair=_pending_repair_or_none(first(_pending_repair)),
+                                      level=_int_or_none(first(_level)),
+                                      min_timestamp=_int_or_none(first(_min_timestamp)),
+                                      max_timestamp=_int_or_none(first(_max_timestamp)),
+                                      droppable_tombstones=float(droppable.group(1)) if droppable else None,
+                                      data_size=_data_size(name)))
+    return result
+
+
+class SSTableMetadataCache(object):
+    """
+    Maps (Statistics.db real path, inode, mtime, size) to the SSTableMetadata parsed for that sstable.
+    Rewriting an sstable's metadata (e.g. when it is marked repaired) changes the key, so
+    stale entries are simply never looked up again.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data_file):
+        # sstablemetadata prints canonical paths, which differ from ccm's under a symlinked dir
+        stats_file = os.path.realpath(data_file[:-len('Data.db')] + 'Statistics.db')
+        try:
+            stat = os.stat(stats_file)
+        except OSError:
+            return None
+        return stats_file, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def get(self, data_file):
+        key = self.key(data_file)
+        with self._lock:
+            return self._entries.get(key) if key is not None else None
+
+    def put(self, metadata):
+        key = self.key(metadata.data_file)
+        if key is not None:
+            with self._lock:
+                self._entries[key] = metadata
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = SSTableMetadataCache()
+
+
+def _run_sstablemetadata(node, data_files):
+    sstablemetadata = common.join_bin(node.get_install_dir(), os.path.join('tools', 'bin'), 'sstablemetadata')
+    p = subprocess.Popen([sstablemetadata] + data_files, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         env=node.get_env())
+    return handle_external_tool_process(p, "sstablemetadata on {} sstables of {}".format(len(data_files), node.name))
+
+
+def _node_sstable_metadata(node, keyspace, column_families, use_cache):
+    data_files = []
+    for cf in column_families or ['']:
+        data_files.extend(node.get_sstables(keyspace, cf))
+
+    # keyed by real path, as sstablemetadata prints canonical paths
+    found = {}
+    missing = []
+    for data_file in data_files:
+        cached = _cache.get(data_file) if use_cache else None
+        if cached is not None:
+            found[os.path.realpath(data_file)] = cached
+        else:
+            missing.append(data_file)
+
+    if missing:
+        for metadata in parse_sstablemetadata(_run_sstablemetadata(node, missing).stdout):
+            _cache.put(metadata)
+            found[os.path.realpath(metadata.data_file)] = metadata
+        logger.debug("Read metadata of {} sstables on {} ({} cached)".format(
+            len(missing), node.name, len(data_files) - len(missing)))
+
+    # e.g. an sstable compacted away before sstablemetadata read it
+    unparsed = [f for f in data_files if os.path.realpath(f) not in found]
+    if unparsed:
+        raise RuntimeError("sstablemetadata printed no metadata for {} on {}".format(', '.join(unparsed), node.name))
+    return [found[os.path.realpath(f)] for f in data_files]
+
+
+def get_sstable_metadata(nodes, keyspace, column_families=None, max_workers=None, use_cache=True):
+    """
+    Returns the metadata of the sstables of keyspace (optionally restricted to column_families)
+    on each node, as a dict of node name to list of SSTableMetadata. Nodes are processed
+    concurrently, and sstablemetadata only runs for sstables missing from the cache.
+    @param nodes Nodes to read sstables from
+    @param keyspace Keyspace of the sstables
+    @param column_families Optional list of table names. Default all tables of the keyspace
+    @param max_workers Optional cap on concurrent sstablemetadata processes. Default one per node
+    @param use_cache Optional boolean flag, set False to always run sstablemetadata
+    """
+    nodes = list(nodes)
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(nodes))) as executor:
+        futures = [(node.name, executor.submit(_node_sstable_metadata, node, keyspace, column_families, use_cache))
+                   for node in nodes]
+        return {name: future.result() for name, future in futures}
+
+
+def get_node_sstable_metadata(node, keyspace, column_families=None, use_cache=True):
+    """
+    Single node version of get_sstable_metadata, returning the node's list of SSTableMetadata.
+    """
+    return _node_sstable_metadata(node, keyspace, column_families, use_cache)
+
+
+_json_whitespace = ' \t\n\r'
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """
+    Incrementally decodes a top level JSON array read from a text stream, yielding its
+    elements one by one. Only the element being decoded is held in memory.
+    @param stream Text stream, e.g. a subprocess pipe wrapped in io.TextIOWrapper
+    @param chunk_size Number of characters to read from the stream at a time
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill(min_read):
+        nonlocal buf, pos, eof
+        chunk = stream.read(max(chunk_size, min_read))
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def next_token():
+        # skips whitespace, returning the next character without consuming it ('' at end of stream)
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _json_whitespace:
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            fill(0)
+
+    if next_token() != '[':
+        raise ValueError("Expected a JSON array, got {!r}".format(buf[pos:pos + 20]))
+    pos += 1
+
+    expect_element = True
+    while True:
+        token = next_token()
+        if token == ']':
+            return
+        if token == '':
+            raise ValueError("Unterminated JSON array")
+        if not expect_element:
+            if token != ',':
+                raise ValueError("Expected ',' or ']' in JSON array, got {!r}".format(buf[pos:pos + 20]))
+            pos += 1
+            expect_element = True
+            continue
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # the element isn't complete yet. Read at least as much again as is
+                # buffered, so that large elements don't get decoded over and over
+                fill(len(buf) - pos)
+                continue
+            # a number at the very end of the buffer may continue in the next chunk
+            if end == len(buf) and not eof:
+                fill(0)
+                continue
+            break
+        pos = end
+        expect_element = False
+        yield element
+
+
+# the first version whose sstabledump is relied on to print raw timestamps with -t
+SSTABLEDUMP_RAW_TIMESTAMPS_VERSION = '3.11'
+
+
+def stream_sstabledump(node, keyspace, column_families=None, datafiles=None, keys=None, enumerate_keys=False,
+                       raw_timestamps=False):
+    """
+    Runs sstabledump on the sstables of keyspace (or on the given datafiles) one after the
+    other, yielding the dumped partitions as they are read from the tool's output. With
+    enumerate_keys the yielded items are the partition keys instead.
+    @param node Node owning the sstables. The tool reads them directly, so while the node runs only
+                dump sstables compactions can't remove, e.g. those of a snapshot
+    @param keyspace Keyspace of the sstables, ignored if datafiles is given
+    @param column_families Optional list of table names. Default all tables of the keyspace
+    @param datafiles Optional list of -Data.db files to dump
+    @param keys Optional list of partition keys to restrict the output to
+    @param enumerate_keys Optional boolean flag, set True to only dump the partition keys
+    @param raw_timestamps Optional boolean flag, set True for timestamps in microseconds rather than ISO 8601 dates.
+                          Requires SSTABLEDUMP_RAW_TIMESTAMPS_VERSION or later
+    @raise ToolError if sstabledump fails
+    @raise ValueError if the node's version has no sstabledump, or no raw timestamps if they are asked for
+    """
+    version = node.get_cassandra_version()
+    if version < '3.0':
+        raise ValueError("sstabledump is only available from 3.0 on, {} runs {}".format(node.name, version))
+    if raw_timestamps and version < SSTABLEDUMP_RAW_TIMESTAMPS_VERSION:
+        raise ValueError("sstabledump raw timestamps are only used from {} on, {} runs {}".format(
+            SSTABLEDUMP_RAW_TIMESTAMPS_VERSION, node.name, version))
+    if datafiles is None:
+        datafiles = []
+        for cf in column_families or ['']:
+            datafiles.extend(node.get_sstables(keyspace, cf))
+
+    sstabledump = common.join_bin(node.get_install_dir(), os.path.join('tools', 'bin'), 'sstabledump')
+    for datafile in datafiles:
+        cmd = [sstabledump, datafile]
+        if enumerate_keys:
+            cmd.append('-e')
+        if raw_timestamps:
+            cmd.append('-t')
+        for key in keys or []:
+            cmd.extend(['-k', key])
+
+        # stderr goes to a file rather than a pipe, a full stderr pipe would stall the dump
+        with tempfile.TemporaryFile() as stderr:
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, env=node.get_env())
+            try:
+                yield from iter_json_array(io.TextIOWrapper(p.stdout, encoding='utf-8'))
+            except GeneratorExit:
+                # the caller stopped reading early, no need to dump the rest
+                p.kill()
+                raise
+            except ValueError:
+                # the output was cut short by a failure; report the tool error if there is one
+                if p.wait() == 0:
+                    raise
+            finally:
+                p.stdout.close()
+                rc = p.wait()
+            if rc != 0:
+                stderr.seek(0)
+                raise ToolError(cmd, rc, stderr=stderr.read())
+
+
+def iter_sstabledump_rows(partitions):
+    """
+    Flattens dumped partitions into (partition, row) pairs, where row is each entry of the
+    partition's 'rows', i.e. rows as well as range tombstone markers.
+    """
+    for partition in partitions:
+        for row in partition.get('rows', []):
+            yield partition, row
+
+
+OfflineToolResult = namedtuple('OfflineToolResult', ('node', 'args', 'stdout', 'stderr', 'rc', 'elapsed'))
+
+
+def find_offline_tool(node, tool):
+    """
+    Returns the path of an offline tool, which lives either in bin/ (sstablescrub,
+    sstableverify, sstableupgrade, ...) or in tools/bin/ (sstablelevelreset, sstablesplit, ...).
+    """
+    for tool_dir in ('bin', os.path.join('tools', 'bin')):
+        path = common.join_bin(node.get_install_dir(), tool_dir, tool)
+        if os.path.exists(path):
+            return path
+    return node.get_tool(tool)
+
+
+def _run_offline_tool(node, cmd):
+    start = time.time()
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=node.get_env())
+    stdout, stderr = p.communicate()
+    return OfflineToolResult(node=node, args=cmd[1:], stdout=stdout.decode('utf-8'), stderr=stderr.decode('utf-8'),
+                             rc=p.returncode, elapsed=time.time() - start)
+
+
+def run_offline_tool_parallel(nodes, tool, args=(), sstables_of=None, max_workers=None, check=True):
+    """
+    Runs an offline tool on several nodes concurrently and returns an OfflineToolResult
+    (with decoded stdout/stderr, exit status and wall time) per invocation, in node order.
+    The nodes must be stopped, unless the tool only reads sstables.
+
+    By default the tool runs once per node with args. With sstables_of the tool instead
+    runs once per sstable data file of the given table, with the file path appended to
+    args. Only use this for tools that don't write sstables (sstablemetadata,
+    sstabledump, ...): concurrent writers in the same table directory would pick the
+    same new sstable generations.
+    @param nodes Nodes to run the tool on
+    @param tool Name of the tool, e.g. 'sstableverify'
+    @param args Arguments passed to every invocation
+    @param sstables_of Optional (keyspace, table) tuple to run the tool per data file. Use '' as table for all tables
+    @param max_workers Optional cap on concurrently running tool processes. Default one per cpu
+    @param check Optional boolean flag, raise a ToolError for the first failed invocation once all finished
+    """
+    invocations = []
+    for node in nodes:
+        cmd = [find_offline_tool(node, tool)] + list(args)
+        if sstables_of is None:
+            invocations.append((node, cmd))
+        else:
+            invocations.extend((node, cmd + [data_file]) for data_file in node.get_sstables(*sstables_of))
+    if not invocations:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as executor:
+        futures = [executor.submit(_run_offline_tool, node, cmd) for node, cmd in invocations]
+        results = [future.result() for future in futures]
+
+    for result in results:
+        logger.debug("{} {} on {} exited with {} in {:.1f}s".format(
+            tool, ' '.join(result.args), result.node.name, result.rc, result.elapsed))
+    if check:
+        for (node, cmd), result in zip(invocations, results):
+            if result.rc != 0:
+                raise ToolError(cmd, result.rc, result.stdout, result.stderr)
+    return results
@@ -0,0 +1,96 @@
+"""
+Memoized resolution of ccm version slugs to installed Cassandra versions.
+
+ccmlib.repository.setup fetches (and for git slugs, builds) a version every time
+it is called, even when the version is already in the ccm repository cache.
+resolve_version remembers the result for the lifetime of the test session, and
+prefetch_versions resolves many versions up front concurrently, so upgrade tests
+don't stall on git fetches and ant builds between tests.
+
+Example:
+
+    prefetch_versions(['github:apache/cassandra-3.0', 'github:apache/cassandra-3.11', '2.2.13'])
+    install_dir, version = resolve_version('github:apache/cassandra-3.0')
+"""
+import logging
+import threading
+from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import ccmlib.repository
+from ccmlib.common import get_version_from_build
+
+logger = logging.getLogger(__name__)
+
+ResolvedVersion = namedtuple('ResolvedVersion', ('install_dir', 'version'))
+
+_resolved = {}
+_locks = defaultdict(threading.Lock)
+_locks_lock = threading.Lock()
+
+
+def _lock_for(key):
+    with _locks_lock:
+        return _locks[key]
+
+
+def _git_cache_key(slug):
+    """
+    Returns the ccm git mirror a slug is fetched through. ccm keeps one mirror per
+    repository and fetching into it concurrently fails, so versions sharing a mirror
+    must be set up one at a time. Release versions are downloaded and share nothing.
+    """
+    if slug.startswith('github:'):
+        return 'github:' + slug[len('github:'):].split('/')[0]
+    if slug.startswith('local:'):
+        return 'local:' + slug.split(':')[1]
+    if slug.startswith('alias:'):
+        return 'alias:' + slug.split(':')[1].split('/')[0]
+    if slug.startswith('git:'):
+        return 'git:apache'
+    return 'release:' + slug
+
+
+def resolve_version(slug):
+    """
+    Fetches (and builds if needed) the version named by a ccm version slug, e.g. 'github:apache/cassandra-3.11'
+    or '3.0.17', returning its ResolvedVersion(install_dir, version) where version is read from build.xml.
+    Each slug is only set up once per session.
+    """
+    resolved = _resolved.get(slug)
+    if resolved is not None:
+        return resolved
+
+    with _lock_for(_git_cache_key(slug)):
+        resolved = _resolved.get(slug)
+        if resolved is None:
+            install_dir, _ = ccmlib.repository.setup(slug)
+            resolved = ResolvedVersion(install_dir, get_version_from_build(install_dir))
+            _resolved[slug] = resolved
+            logger.debug("Resolved {} to {} in {}".format(slug, resolved.version, install_dir))
+    return resolved
+
+
+def prefetch_versions(slugs, max_workers=4):
+    """
+    Resolves all slugs ahead of time using at most max_workers concurrent fetches/builds.
+    Slugs sharing a ccm git mirror are set up one after the other. Failures are logged and
+    left for resolve_version to raise again when the version is actually needed.
+    """
+    groups = defaultdict(list)
+    for slug in sorted(set(slugs)):
+        if slug not in _resolved:
+            groups[_git_cache_key(slug)].append(slug)
+    if not groups:
+        return
+
+    def resolve_group(group):
+        for slug in group:
+            try:
+                resolve_version(slug)
+            except Exception as e:
+                logger.warning("Failed to prefetch version {}: {}".format(slug, e))
+
+    logger.info("Prefetching versions {}".format(', '.join(s for group in groups.values() for s in group)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(resolve_group, groups.values()))
@@ -1,8 +1,6 @@
-import re
 import logging
 import types
 from struct import pack
-from uuid import UUID
 
 from cassandra import ConsistencyLevel, InvalidRequest
 from cassandra.query import SimpleStatement
@@ -12,6 +10,7 @@ from ccmlib.node import Node
 from dtest import Tester
 from tools.jmxutils import JolokiaAgent, make_mbean
 from tools.data import rows_to_list
+from tools.sstables import get_node_sstable_metadata
 from tools.assertions import (assert_all)
 
 from cassandra.metadata import Murmur3Token, OrderedDict
@@ -140,25 +139,9 @@ def patch_start(startable):
     return startable
 
 def get_sstable_data(cls, node, keyspace):
-    _sstable_name = re.compile(r'SSTable: (.+)')
-    _repaired_at = re.compile(r'Repaired at: (\d+)')
-    _pending_repair = re.compile(r'Pending repair: (\-\-|null|[a-f0-9\-]+)')
-
-    out = node.run_sstablemetadata(keyspace=keyspace).stdout
-
-    def matches(pattern):
-        return filter(None, [pattern.match(l) for l in out.decode("utf-8").split('\n')])
-    names = [m.group(1) for m in matches(_sstable_name)]
-    repaired_times = [int(m.group(1)) for m in matches(_repaired_at)]
-
-    def uuid_or_none(s):
-        return None if s == 'null' or s == '--' else UUID(s)
-    pending_repairs = [uuid_or_none(m.group(1)) for m in matches(_pending_repair)]
-    assert names
-    assert repaired_times
-    assert pending_repairs
-    assert len(names) == len(repaired_times) == len(pending_repairs)
-    return [SSTable(*a) for a in zip(names, repaired_times, pending_repairs)]
+    data = [SSTable(m.name, m.repaired_at, m.pending_repair) for m in get_node_sstable_metadata(node, keyspace)]
+    assert data
+    return data
 
 @since('4.0')
 class TransientReplicationBase(Tester):
@@ -1,4 +1,25 @@
+import pytest
+
+from tools.versions import prefetch_versions
 from .upgrade_manifest import set_config
 
 def pytest_configure(config):
     set_config(config)
+
+
+def _version_slugs(item):
+    cls = getattr(item, 'cls', None)
+    upgrade_path = getattr(cls, 'UPGRADE_PATH', None)
+    if upgrade_path is not None:
+        yield upgrade_path.starting_meta.version
+        yield upgrade_path.upgrade_meta.version
+    for version_meta in getattr(cls, 'test_version_metas', None) or []:
+        yield version_meta.version
+
+
+@pytest.fixture(scope='session', autouse=True)
+def fixture_prefetch_upgrade_versions(request):
+    """
+    Fetches and builds every version used by the selected upgrade tests before the first of them runs
+    """
+    prefetch_versions(slug for item in request.session.items for slug in _version_slugs(item))
@@ -37,6 +37,7 @@ logger = logging.getLogger(__name__)
 
 @pytest.mark.upgrade_test
 class TestCQL(UpgradeTester):
+    SHARE_UPGRADED_CLUSTER = True
 
     def is_40_or_greater(self):
         return self.UPGRADE_PATH.upgrade_meta.family in ('trunk', '4.0')
@@ -2785,6 +2786,7 @@ class TestCQL(UpgradeTester):
             cursor.execute("INSERT INTO bar (id, i) VALUES (1, 2);")
             assert_one(cursor, "SELECT * FROM bar", [1, None, 2, None] if self.is_40_or_greater() else [1, 2])
 
+    @pytest.mark.no_shared_cluster
     def test_query_compact_tables_during_upgrade(self):
         """
         Check that un-upgraded sstables for compact storage tables
@@ -5408,6 +5410,7 @@ class TestCQL(UpgradeTester):
 
             assert_none(cursor, "select * from space1.table1 where a=1 and b=1")
 
+    @pytest.mark.no_shared_cluster
     @pytest.mark.skip("https://issues.apache.org/jira/browse/CASSANDRA-14961")
     def test_secondary_index_query(self):
         """
@@ -5465,6 +5468,7 @@ class TestCQL(UpgradeTester):
             logger.debug("Querying {} node".format("upgraded" if is_upgraded else "old"))
             assert_all(cursor, "SELECT k FROM ks.test WHERE v = 0", [[0]])
 
+    @pytest.mark.no_shared_cluster
     def test_tracing_prevents_startup_after_upgrading(self):
         """
         Test that after upgrading from 2.1 to 3.0, the system_traces.sessions table is properly upgraded to include
@@ -5,11 +5,15 @@ import pytest
 import logging
 
 from abc import ABCMeta
+from concurrent.futures import ThreadPoolExecutor
+from distutils.version import LooseVersion
 
-from ccmlib.common import get_version_from_build, is_win
+from ccmlib.common import is_win
 from tools.jmxutils import remove_perf_disable_shared_mem
+from tools.versions import resolve_version
 
 from dtest import Tester, create_ks
+from dtest_setup import DTestSetup
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +37,244 @@ def switch_jdks(major_version_int):
         os.environ['JAVA_HOME'] = os.environ[new_java_home]
 
 
+def start_cluster_on_starting_version(dtest_setup, upgrade_path, nodes, ordered=False, use_cache=False,
+                                      use_thrift=False, start_rpc=False, extra_config_options=None, jolokia=False):
+    """
+    Populates and starts dtest_setup's cluster on the starting version of upgrade_path
+    """
+    cluster = dtest_setup.cluster
+
+    cluster.set_install_dir(version=upgrade_path.starting_version)
+    dtest_setup.reinitialize_cluster_for_different_version()
+
+    if ordered:
+        cluster.set_partitioner("org.apache.cassandra.dht.ByteOrderedPartitioner")
+
+    if use_cache:
+        cluster.set_configuration_options(values={'row_cache_size_in_mb': 100})
+
+    if use_thrift:
+        cluster.set_configuration_options(values={'start_rpc': 'true'})
+
+    if start_rpc:
+        cluster.set_configuration_options(values={'start_rpc': True})
+
+    cluster.set_configuration_options(values={'internode_compression': 'none'})
+
+    if extra_config_options:
+        cluster.set_configuration_options(values=extra_config_options)
+
+    cluster.populate(nodes)
+    node1 = cluster.nodelist()[0]
+    dtest_setup.enable_for_jolokia = jolokia
+    if dtest_setup.enable_for_jolokia:
+        remove_perf_disable_shared_mem(node1)
+
+    cluster.start(wait_for_binary_proto=True)
+
+
+def upgrade_node(dtest_setup, upgrade_path, node, use_thrift=False):
+    """
+    Drains and stops node, and restarts it on the upgrade version of upgrade_path
+    """
+    # stop the nodes, this can fail due to https://issues.apache.org/jira/browse/CASSANDRA-8220 on MacOS
+    # for the tests that run against 2.0. You will need to run those in Linux.
+    node.drain()
+    node.stop(gently=True)
+
+    # Ignore errors before upgrade on Windows
+    # We ignore errors from 2.1, because windows 2.1
+    # support is only beta. There are frequent log errors,
+    # related to filesystem interactions that are a direct result
+    # of the lack of full functionality on 2.1 Windows, and we dont
+    # want these to pollute our results.
+    if is_win() and dtest_setup.cluster.version() <= '2.2':
+        node.mark_log_for_errors()
+
+    logger.debug('upgrading {} to {}'.format(node.name, upgrade_path.upgrade_version))
+    switch_jdks(upgrade_path.upgrade_meta.java_version)
+
+    node.set_install_dir(version=upgrade_path.upgrade_version)
+
+    node.set_log_level(logging.getLevelName(logging.root.level))
+    node.set_configuration_options(values={'internode_compression': 'none'})
+
+    if use_thrift and node.get_cassandra_version() < '4':
+        node.set_configuration_options(values={'start_rpc': 'true'})
+
+    if dtest_setup.enable_for_jolokia:
+        remove_perf_disable_shared_mem(node)
+
+    node.start(wait_for_binary_proto=True, wait_other_notice=True)
+
+
+def run_on_nodes(func, nodes):
+    """
+    Runs func(node) for all nodes at once, each on its own thread
+    :return: the results, in the order of nodes. If any call failed, the first failure is raised
+             once all of them finished
+    """
+    nodes = list(nodes)
+    if len(nodes) <= 1:
+        return [func(node) for node in nodes]
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        futures = [executor.submit(func, node) for node in nodes]
+    return [future.result() for future in futures]
+
+
+def drain_and_stop_nodes(nodes):
+    """
+    Drains and stops all nodes at once, without waiting for the other nodes to notice
+    """
+    def drain_and_stop(node):
+        logger.debug('Shutting down node: ' + node.name)
+        node.drain(block_on_log=True)
+        node.stop(wait_other_notice=False)
+
+    run_on_nodes(drain_and_stop, nodes)
+
+
+def start_nodes_together(cluster, nodes, wait_other_notice=True, **kwargs):
+    """
+    Starts nodes one after the other without waiting in between, then waits for all of them at
+    once: for their binary interfaces, and unless wait_other_notice is False, for every started
+    and already running node of the cluster to see the started nodes UP. Like for Node.start, an
+    int wait_other_notice is the timeout of the latter.
+
+    Further keyword arguments are passed on to Node.start.
+    """
+    nodes = list(nodes)
+    live_nodes = [node for node in cluster.nodelist() if node.is_live() and node not in nodes]
+    live_marks = [(node, node.mark_log()) for node in live_nodes]
+
+    for node in nodes:
+        # Node.start marks the node's log in node.mark before launching it
+        node.start(wait_other_notice=False, wait_for_binary_proto=False, **kwargs)
+
+    checks = [lambda node=node: node.wait_for_binary_interface(from_mark=node.mark) for node in nodes]
+    if wait_other_notice:
+        timeout = 120 if wait_other_notice is True else wait_other_notice
+        for node in nodes:
+            others = [other for other in nodes if other is not node] + live_nodes
+            if others:
+                checks.append(lambda node=node, others=others:
+                              node.watch_log_for_alive(others, from_mark=node.mark, timeout=timeout))
+        for node, mark in live_marks:
+            checks.append(lambda node=node, mark=mark:
+                          node.watch_log_for_alive(nodes, from_mark=mark, timeout=timeout))
+
+    run_on_nodes(lambda check: check(), checks)
+
+
+class SharedUpgradedCluster(object):
+    """
+    A mixed version cluster shared by the tests of an upgrade test class: it is started on the
+    starting version of the class' UPGRADE_PATH, node1 is upgraded once, and each test then
+    runs against it in turn instead of starting and upgrading a cluster of its own.
+
+    A test gets the cluster with all nodes up on their versions and no keyspaces but the
+    system ones, and its keyspaces are dropped when it's done. The cluster is started anew
+    when a test needs a different configuration (see prepare()), or when the previous test
+    left it in another state, e.g. by restarting nodes.
+    """
+
+    SYSTEM_KEYSPACES = ('system', 'system_auth', 'system_distributed', 'system_traces', 'system_schema',
+                        'system_views', 'system_virtual_schema')
+
+    def __init__(self, dtest_config, upgrade_path):
+        self.dtest_config = dtest_config
+        self.upgrade_path = upgrade_path
+        self.create_cluster_func = None
+        self.dtest_setup = None
+        self.config_key = None
+        self.node_state = None
+        self.reusable = False
+
+    def supported(self):
+        """
+        Schema changes don't propagate between nodes on different major versions, so tests
+        can only create their tables on a shared cluster when the upgrade stays within one
+        """
+        starting = resolve_version(self.upgrade_path.starting_version).version
+        upgraded = resolve_version(self.upgrade_path.upgrade_version).version
+        return LooseVersion(str(starting)).version[0] == LooseVersion(str(upgraded)).version[0]
+
+    def acquire(self, config_key, config, create_cluster_func):
+        """
+        :param config_key: hashable summary of config, tests with equal keys share a cluster
+        :param config: the keyword arguments to start_cluster_on_starting_version
+        :param create_cluster_func: the test's fixture_dtest_create_cluster_func, the cluster is
+                                    created with it and only shared by tests using the same one
+        :return: the shared cluster, started and upgraded with the given config
+        """
+        if self.dtest_setup is not None:
+            same_config = config_key == self.config_key and create_cluster_func == self.create_cluster_func
+            if not same_config or not self.reusable or self._current_node_state() != self.node_state:
+                logger.debug("Replacing the shared upgraded cluster")
+                self.release()
+
+        if self.dtest_setup is None:
+            self.dtest_setup = DTestSetup(dtest_config=self.dtest_config, cluster_name='shared_upgrade')
+            self.dtest_setup.initialize_cluster(create_cluster_func)
+            self.create_cluster_func = create_cluster_func
+            self.config_key = config_key
+            start_cluster_on_starting_version(self.dtest_setup, self.upgrade_path, **config)
+            upgrade_node(self.dtest_setup, self.upgrade_path, self.dtest_setup.cluster.nodelist()[0],
+                         use_thrift=config.get('use_thrift', False))
+            self.node_state = self._current_node_state()
+        else:
+            # errors logged while starting and upgrading the cluster are the first test's to check,
+            # later tests only check what was logged during their own run
+            for node in self.dtest_setup.cluster.nodelist():
+                node.mark_log_for_errors()
+
+        # the cluster is handed back clean by finish_test, or replaced by the next test
+        self.reusable = False
+        return self.dtest_setup.cluster
+
+    def finish_test(self):
+        """
+        Drops the keyspaces the test created. If that fails, or the test changed the cluster
+        otherwise, the next test gets a new cluster. The cluster is left running either way, so
+        its logs can still be checked for errors at the end of the test.
+        """
+        try:
+            self.reusable = self._current_node_state() == self.node_state and self._drop_keyspaces()
+        except Exception as e:
+            logger.warning("Failed to clean up the shared upgraded cluster: {}".format(e))
+        if not self.reusable:
+            logger.debug("The shared upgraded cluster was changed by the test, it won't be reused")
+
+    def release(self):
+        if self.dtest_setup is None:
+            return
+        dtest_setup, self.dtest_setup = self.dtest_setup, None
+        for con in dtest_setup.connections:
+            con.cluster.shutdown()
+        dtest_setup.connections = []
+        dtest_setup.cleanup_cluster()
+
+    def _current_node_state(self):
+        return [(node.name, node.get_install_dir(), node.is_running() and node.pid)
+                for node in self.dtest_setup.cluster.nodelist()]
+
+    def _drop_keyspaces(self):
+        """
+        Drops all non system keyspaces
+        :return: whether none are left
+        """
+        session = self.dtest_setup.patient_exclusive_cql_connection(self.dtest_setup.cluster.nodelist()[0])
+        try:
+            for keyspace in list(session.cluster.metadata.keyspaces):
+                if keyspace not in self.SYSTEM_KEYSPACES:
+                    session.execute('DROP KEYSPACE IF EXISTS "{}"'.format(keyspace))
+            session.cluster.refresh_schema_metadata()
+            return all(ks in self.SYSTEM_KEYSPACES for ks in session.cluster.metadata.keyspaces)
+        finally:
+            session.cluster.shutdown()
+            self.dtest_setup.connections.remove(session)
+
+
 @pytest.mark.upgrade_test
 @pytest.mark.skipif(sys.platform == 'win32', reason='Skip upgrade tests on Windows')
 class UpgradeTester(Tester, metaclass=ABCMeta):
@@ -44,6 +286,30 @@ class UpgradeTester(Tester, metaclass=ABCMeta):
     versions above 3.0, this will test the upgrade path from 3.0 to HEAD.
     """
     NODES, RF, __test__, CL, UPGRADE_PATH = 2, 1, False, None, None
+    # run the tests of the class against one SharedUpgradedCluster, unless marked no_shared_cluster
+    SHARE_UPGRADED_CLUSTER = False
+    shared_cluster = None
+
+    @pytest.fixture(scope='class')
+    def fixture_shared_upgraded_cluster(self, dtest_config):
+        if not self.SHARE_UPGRADED_CLUSTER or self.UPGRADE_PATH is None:
+            yield None
+            return
+        shared_cluster = SharedUpgradedCluster(dtest_config, self.UPGRADE_PATH)
+        if not shared_cluster.supported():
+            logger.debug("Not sharing a cluster between tests upgrading across major versions")
+            yield None
+            return
+        yield shared_cluster
+        shared_cluster.release()
+
+    @pytest.fixture(autouse=True)
+    def fixture_use_shared_upgraded_cluster(self, request, fixture_dtest_setup, fixture_shared_upgraded_cluster):
+        if request.node.get_closest_marker('no_shared_cluster') is None:
+            self.shared_cluster = fixture_shared_upgraded_cluster
+        yield
+        if fixture_dtest_setup.own_cluster is not None:
+            self.shared_cluster.finish_test()
 
     @pytest.fixture(autouse=True)
     def fixture_add_additional_log_patterns(self, fixture_dtest_setup):
@@ -81,37 +347,19 @@ class UpgradeTester(Tester, metaclass=ABCMeta):
 
         self.protocol_version = protocol_version
 
-        cluster = self.cluster
-
-        cluster.set_install_dir(version=self.UPGRADE_PATH.starting_version)
-        self.fixture_dtest_setup.reinitialize_cluster_for_different_version()
-
-        if ordered:
-            cluster.set_partitioner("org.apache.cassandra.dht.ByteOrderedPartitioner")
-
-        if use_cache:
-            cluster.set_configuration_options(values={'row_cache_size_in_mb': 100})
-
-        if use_thrift:
-            cluster.set_configuration_options(values={'start_rpc': 'true'})
-
-        start_rpc = kwargs.pop('start_rpc', False)
-        if start_rpc:
-            cluster.set_configuration_options(values={'start_rpc': True})
+        config = dict(nodes=nodes, ordered=ordered, use_cache=use_cache, use_thrift=use_thrift,
+                      start_rpc=kwargs.pop('start_rpc', False), extra_config_options=extra_config_options,
+                      jolokia=kwargs.pop('jolokia', False))
 
-        cluster.set_configuration_options(values={'internode_compression': 'none'})
-
-        if extra_config_options:
-            cluster.set_configuration_options(values=extra_config_options)
-
-        cluster.populate(nodes)
-        node1 = cluster.nodelist()[0]
-        self.fixture_dtest_setup.enable_for_jolokia = kwargs.pop('jolokia', False)
-        if self.fixture_dtest_setup.enable_for_jolokia:
-            remove_perf_disable_shared_mem(node1)
-
-        cluster.start(wait_for_binary_proto=True)
+        if self.shared_cluster is not None:
+            config_key = tuple(sorted(dict(config, extra_config_options=tuple(sorted(
+                (extra_config_options or {}).items()))).items()))
+            self.fixture_dtest_setup.borrow_cluster(self.shared_cluster.acquire(
+                config_key, config, self.fixture_dtest_setup.create_cluster_func))
+        else:
+            start_cluster_on_starting_version(self.fixture_dtest_setup, self.UPGRADE_PATH, **config)
 
+        cluster = self.cluster
         node1 = cluster.nodelist()[0]
         time.sleep(0.2)
 
@@ -136,27 +384,8 @@ class UpgradeTester(Tester, metaclass=ABCMeta):
         node1 = self.cluster.nodelist()[0]
         node2 = self.cluster.nodelist()[1]
 
-        # stop the nodes, this can fail due to https://issues.apache.org/jira/browse/CASSANDRA-8220 on MacOS
-        # for the tests that run against 2.0. You will need to run those in Linux.
-        node1.drain()
-        node1.stop(gently=True)
-
-        # Ignore errors before upgrade on Windows
-        # We ignore errors from 2.1, because windows 2.1
-        # support is only beta. There are frequent log errors,
-        # related to filesystem interactions that are a direct result
-        # of the lack of full functionality on 2.1 Windows, and we dont
-        # want these to pollute our results.
-        if is_win() and self.cluster.version() <= '2.2':
-            node1.mark_log_for_errors()
-
-        logger.debug('upgrading node1 to {}'.format(self.UPGRADE_PATH.upgrade_version))
-        switch_jdks(self.UPGRADE_PATH.upgrade_meta.java_version)
-
-        node1.set_install_dir(version=self.UPGRADE_PATH.upgrade_version)
-
         # this is a bandaid; after refactoring, upgrades should account for protocol version
-        new_version_from_build = get_version_from_build(node1.get_install_dir())
+        new_version_from_build = resolve_version(self.UPGRADE_PATH.upgrade_version).version
 
         # Check if a since annotation with a max_version was set on this test.
         # The since decorator can only check the starting version of the upgrade,
@@ -168,16 +397,12 @@ class UpgradeTester(Tester, metaclass=ABCMeta):
         if (new_version_from_build >= '3' and self.protocol_version is not None and self.protocol_version < 3):
             pytest.skip('Protocol version {} incompatible '
                         'with Cassandra version {}'.format(self.protocol_version, new_version_from_build))
-        node1.set_log_level(logging.getLevelName(logging.root.level))
-        node1.set_configuration_options(values={'internode_compression': 'none'})
-
-        if use_thrift and node1.get_cassandra_version() < '4':
-            node1.set_configuration_options(values={'start_rpc': 'true'})
 
-        if self.fixture_dtest_setup.enable_for_jolokia:
-            remove_perf_disable_shared_mem(node1)
-
-        node1.start(wait_for_binary_proto=True, wait_other_notice=True)
+        if self.shared_cluster is None:
+            upgrade_node(self.fixture_dtest_setup, self.UPGRADE_PATH, node1, use_thrift=use_thrift)
+        else:
+            # node1 of a shared cluster is already upgraded, only this test's environment needs to follow
+            switch_jdks(self.UPGRADE_PATH.upgrade_meta.java_version)
 
         sessions_and_meta = []
         if self.CL:
@@ -207,9 +432,10 @@ class UpgradeTester(Tester, metaclass=ABCMeta):
         # CASSANDRA-11396 was the impetus for this change, wherein some apparent perf noise was preventing
         # CL.ALL from being reached. The newly upgraded node needs to settle because it has just barely started, and each
         # non-upgraded node needs a chance to settle as well, because the entire cluster (or isolated nodes) may have been doing resource intensive activities
-        # immediately before.
+        # immediately before. The nodes of a shared cluster have long settled.
         for s in sessions_and_meta:
-            time.sleep(5)
+            if self.shared_cluster is None:
+                time.sleep(5)
             yield s
 
     def get_version(self):
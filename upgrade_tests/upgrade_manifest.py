@@ -3,8 +3,8 @@ import logging
 from collections import namedtuple
 
 from dtest import RUN_STATIC_UPGRADE_MATRIX
+from tools.versions import resolve_version
 
-import ccmlib.repository
 from ccmlib.common import get_version_from_build
 
 from enum import Enum
@@ -66,8 +66,7 @@ def set_version_family():
     # Prefer CASSANDRA_VERSION if it's set in the environment. If not, use CASSANDRA_DIR
     if cassandra_version_slug:
         # fetch but don't build the specified C* version
-        ccm_repo_cache_dir, _ = ccmlib.repository.setup(cassandra_version_slug)
-        current_version = get_version_from_build(ccm_repo_cache_dir)
+        current_version = resolve_version(cassandra_version_slug).version
     else:
         current_version = get_version_from_build(cassandra_dir)
 
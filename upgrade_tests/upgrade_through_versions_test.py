@@ -3,6 +3,7 @@ import os
 import pprint
 import random
 import signal
+import threading
 import time
 import uuid
 import logging
@@ -10,15 +11,16 @@ import pytest
 import psutil
 
 from collections import defaultdict, namedtuple
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, Value
 from queue import Empty, Full
 
 from cassandra import ConsistencyLevel, WriteTimeout
 from cassandra.query import SimpleStatement
 
 from dtest import RUN_STATIC_UPGRADE_MATRIX, Tester
+from tools.data import bulk_load
 from tools.misc import generate_ssl_stores, new_node
-from .upgrade_base import switch_jdks
+from .upgrade_base import drain_and_stop_nodes, run_on_nodes, start_nodes_together, switch_jdks
 from .upgrade_manifest import (build_upgrade_pairs,
                                current_2_1_x, current_2_2_x, current_3_0_x,
                                indev_3_11_x,
@@ -27,13 +29,126 @@ from .upgrade_manifest import (build_upgrade_pairs,
 logger = logging.getLogger(__name__)
 
 
-def data_writer(tester, to_verify_queue, verification_done_queue, rewrite_probability=0):
+# rows move between the continuous workload processes in lists of up to this many
+QUEUE_BATCH_SIZE = 100
+# how often the continuous workload processes hand over partial batches and report their stats
+QUEUE_FLUSH_INTERVAL_S = 0.5
+
+OpStats = namedtuple('OpStats', ['count', 'total_latency', 'max_latency'])
+
+
+class ContinuousWorkload(object):
+    """
+    Queues and shared counters connecting the test to the data_writer and data_checker processes.
+
+    Rows move through the queues in batches of up to QUEUE_BATCH_SIZE, pending_rows counts the
+    rows written but not yet verified. The writer pauses while max_pending_rows are pending
+    (0 for no limit), rather than blocking on a full queue where it couldn't notice SIGTERM.
+    The test names the phase of the upgrade the workload is in with begin_phase, and the
+    processes report the number and latency of their queries per phase through stats_queue.
+    """
+
+    def __init__(self, max_pending_rows=10000, max_rewritable_rows=500):
+        # queue of batches of writes to be verified
+        self.to_verify_queue = Queue()
+        # queue of batches of verified writes, which are update candidates
+        self.verification_done_queue = Queue(maxsize=-(-max_rewritable_rows // QUEUE_BATCH_SIZE))
+        self.max_pending_rows = max_pending_rows
+        self.pending_rows = Value('l', 0)
+        self.phase = Value('i', 0)
+        self.stats_queue = Queue()
+        # only kept up to date in the test process
+        self.phases = []
+        self.stats = {}
+
+    def begin_phase(self, label):
+        self.phases.append((label, time.time()))
+        self.phase.value = len(self.phases) - 1
+
+    def current_phase(self):
+        return self.phase.value
+
+    def add_pending_rows(self, count):
+        with self.pending_rows.get_lock():
+            self.pending_rows.value += count
+
+    def too_many_pending_rows(self):
+        return 0 < self.max_pending_rows <= self.pending_rows.value
+
+    def report_stats(self, role, stats):
+        self.stats_queue.put((role, stats.snapshot()))
+
+    def collect_stats(self):
+        # each report holds all the stats of its process so far, the last one wins
+        while True:
+            try:
+                role, stats = self.stats_queue.get_nowait()
+            except Empty:
+                return self.stats
+            self.stats[role] = stats
+
+    def log_stats(self):
+        self.collect_stats()
+        ends = [start for _, start in self.phases[1:]] + [time.time()]
+        lines = []
+        for index, (label, start) in enumerate(self.phases):
+            for role in sorted(self.stats, reverse=True):
+                stats = self.stats[role].get(index)
+                if stats is None or not stats.count:
+                    continue
+                lines.append("  {role} {label}: {count} queries in {duration:.1f}s, {rate:.1f}/s, "
+                             "mean latency {mean:.1f}ms, max {max:.1f}ms"
+                             .format(role=role, label=label, count=stats.count, duration=ends[index] - start,
+                                     rate=stats.count / max(ends[index] - start, 0.001),
+                                     mean=1000 * stats.total_latency / stats.count, max=1000 * stats.max_latency))
+        logger.info("Continuous workload throughput and latency per phase:\n" + "\n".join(lines))
+
+
+class _PhaseStats(object):
+    """
+    The number, total and maximum latency of the queries of a workload process per phase,
+    recorded from the driver's event loop thread
+    """
+
+    def __init__(self, workload):
+        self.workload = workload
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, latency):
+        phase = self.workload.current_phase()
+        with self.lock:
+            stats = self.stats.get(phase, OpStats(0, 0.0, 0.0))
+            self.stats[phase] = OpStats(stats.count + 1, stats.total_latency + latency,
+                                        max(stats.max_latency, latency))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+def _stop_on_sigterm():
+    """
+    Makes SIGTERM only ask the workload loop to stop, so it can leave at a point where no
+    rows are lost between the queues and the pending row count.
+    """
+    stopping = []
+
+    def handle_sigterm(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    return stopping
+
+
+def data_writer(tester, workload, rewrite_probability=0):
     """
     Process for writing/rewriting data continuously.
 
-    Pushes to a queue to be consumed by data_checker.
+    Keeps a bounded number of writes in flight through bulk_load, and pushes the completed
+    ones in batches to a queue to be consumed by data_checker.
 
-    Pulls from a queue of already-verified rows written by data_checker that it can overwrite.
+    Pulls batches from a queue of already-verified rows written by data_checker that it can overwrite.
 
     Intended to be run using multiprocessing.
     """
@@ -43,45 +158,80 @@ def data_writer(tester, to_verify_queue, verification_done_queue, rewrite_probab
     prepared = session.prepare("UPDATE cf SET v=? WHERE k=?")
     prepared.consistency_level = ConsistencyLevel.QUORUM
 
-    def handle_sigterm(signum, frame):
-        # need to close queue gracefully if possible, or the data_checker process
-        # can't seem to empty the queue and test failures result.
-        to_verify_queue.close()
-        exit(0)
-
-    signal.signal(signal.SIGTERM, handle_sigterm)
+    stats = _PhaseStats(workload)
+    lock = threading.Lock()
+    written = []
+    stopping = _stop_on_sigterm()
+
+    def on_written(args, rows, latency):
+        stats.record(latency)
+        val, key = args
+        with lock:
+            written.append((key, val))
+
+    def flush():
+        with lock:
+            batch = written[:]
+            del written[:]
+        if batch:
+            # counted before they're queued, so the test never sees fewer pending rows than there are
+            workload.add_pending_rows(len(batch))
+            for i in range(0, len(batch), QUEUE_BATCH_SIZE):
+                workload.to_verify_queue.put(batch[i:i + QUEUE_BATCH_SIZE])
+        workload.report_stats('write', stats)
+
+    def writes():
+        rewritable = []
+        last_flush = time.time()
+        while not stopping:
+            if len(written) >= QUEUE_BATCH_SIZE or time.time() - last_flush >= QUEUE_FLUSH_INTERVAL_S:
+                flush()
+                last_flush = time.time()
+
+            if workload.too_many_pending_rows():
+                # let the checker catch up
+                time.sleep(0.1)
+                continue
 
-    while True:
-        try:
             key = None
 
             if (rewrite_probability > 0) and (random.randint(0, 100) <= rewrite_probability):
-                try:
-                    key = verification_done_queue.get_nowait()
-                except Empty:
-                    # we wanted a re-write but the re-writable queue was empty. oh well.
-                    pass
+                if not rewritable:
+                    try:
+                        rewritable = workload.verification_done_queue.get_nowait()
+                    except Empty:
+                        # we wanted a re-write but the re-writable queue was empty. oh well.
+                        pass
+                if rewritable:
+                    key = rewritable.pop()
 
             key = key or uuid.uuid4()
 
             val = uuid.uuid4()
 
-            session.execute(prepared, (val, key))
+            yield (val, key)
 
-            to_verify_queue.put((key, val,))
-        except Exception:
-            logger.debug("Error in data writer process!")
-            to_verify_queue.close()
-            raise
+    try:
+        bulk_load(session, prepared, writes(), callback=on_written)
+        # hand over everything that was written before stopping
+        flush()
+    except Exception:
+        logger.debug("Error in data writer process!")
+        raise
+    finally:
+        # need to close queue gracefully if possible, or the data_checker process
+        # can't seem to empty the queue and test failures result.
+        workload.to_verify_queue.close()
 
 
-def data_checker(tester, to_verify_queue, verification_done_queue):
+def data_checker(tester, workload):
     """
     Process for checking data continuously.
 
-    Pulls from a queue written to by data_writer to know what to verify.
+    Pulls batches from a queue written to by data_writer to know what to verify, and keeps a
+    bounded number of reads in flight through bulk_load.
 
-    Pushes to a queue to tell data_writer what's been verified and could be a candidate for re-writing.
+    Pushes batches to a queue to tell data_writer what's been verified and could be a candidate for re-writing.
 
     Intended to be run using multiprocessing.
     """
@@ -91,39 +241,65 @@ def data_checker(tester, to_verify_queue, verification_done_queue):
     prepared = session.prepare("SELECT v FROM cf WHERE k=?")
     prepared.consistency_level = ConsistencyLevel.QUORUM
 
-    def handle_sigterm(signum, frame):
-        # need to close queue gracefully if possible, or the data_checker process
-        # can't seem to empty the queue and test failures result.
-        verification_done_queue.close()
-        exit(0)
-
-    signal.signal(signal.SIGTERM, handle_sigterm)
-
-    while True:
-        try:
-            # here we could block, but if the writer process terminates early with an empty queue
-            # we would end up blocking indefinitely
-            (key, expected_val) = to_verify_queue.get_nowait()
-
-            actual_val = session.execute(prepared, (key,))[0][0]
-        except Empty:
-            time.sleep(0.1)  # let's not eat CPU if the queue is empty
-            continue
-        except Exception:
-            logger.debug("Error in data verifier process!")
-            verification_done_queue.close()
-            raise
-        else:
+    stats = _PhaseStats(workload)
+    lock = threading.Lock()
+    # the value each key being read is expected to have, a key is only pending verification once at a time
+    expected = {}
+    verified = []
+    stopping = _stop_on_sigterm()
+
+    def on_read(args, rows, latency):
+        stats.record(latency)
+        key, = args
+        with lock:
+            expected_val = expected.pop(key)
+        assert expected_val == rows[0][0], "Data did not match expected value!"
+        with lock:
+            verified.append(key)
+
+    def flush():
+        with lock:
+            batch = verified[:]
+            del verified[:]
+        if batch:
+            workload.add_pending_rows(-len(batch))
             try:
-                verification_done_queue.put_nowait(key)
+                workload.verification_done_queue.put_nowait(batch[:QUEUE_BATCH_SIZE])
             except Full:
-                # the rewritable queue is full, not a big deal. drop this one.
+                # the rewritable queue is full, not a big deal. drop these.
                 # we keep the rewritable queue held to a modest max size
                 # and allow dropping some rewritables because we don't want to
                 # rewrite rows in the same sequence as originally written
                 pass
+        workload.report_stats('verify', stats)
+
+    def reads():
+        last_flush = time.time()
+        while not stopping:
+            if len(verified) >= QUEUE_BATCH_SIZE or time.time() - last_flush >= QUEUE_FLUSH_INTERVAL_S:
+                flush()
+                last_flush = time.time()
 
-        assert expected_val == actual_val, "Data did not match expected value!"
+            try:
+                # a timeout rather than blocking, so we notice being stopped even if
+                # the writer process terminated early with an empty queue
+                batch = workload.to_verify_queue.get(timeout=0.1)
+            except Empty:
+                continue
+
+            for key, expected_val in batch:
+                with lock:
+                    expected[key] = expected_val
+                yield (key,)
+
+    try:
+        bulk_load(session, prepared, reads(), callback=on_read)
+        flush()
+    except Exception:
+        logger.debug("Error in data verifier process!")
+        raise
+    finally:
+        workload.verification_done_queue.close()
 
 
 def counter_incrementer(tester, to_verify_queue, verification_done_queue, rewrite_probability=0):
@@ -338,11 +514,12 @@ class TestUpgrade(Tester):
 
         if rolling:
             # start up processes to write and verify data
-            write_proc, verify_proc, verification_queue = self._start_continuous_write_and_verify(wait_for_rowcount=5000)
+            write_proc, verify_proc, workload = self._start_continuous_write_and_verify(wait_for_rowcount=5000)
 
             # upgrade through versions
             for version_meta in self.test_version_metas[1:]:
                 for num, node in enumerate(self.cluster.nodelist()):
+                    workload.begin_phase('upgrading {} to {}'.format(node.name, version_meta.version))
                     # sleep (sigh) because driver needs extra time to keep up with topo and make quorum possible
                     # this is ok, because a real world upgrade would proceed much slower than this programmatic one
                     # additionally this should provide more time for timeouts and other issues to crop up as well, which we could
@@ -358,13 +535,19 @@ class TestUpgrade(Tester):
                 self.cluster.set_install_dir(version=version_meta.version)
                 self.fixture_dtest_setup.reinitialize_cluster_for_different_version()
 
-            # Stop write processes
+            # Stop write processes, it hands over the writes it has in flight before exiting
+            workload.begin_phase('verifying remaining writes')
             write_proc.terminate()
+            write_proc.join(60)
             # wait for the verification queue's to empty (and check all rows) before continuing
-            self._wait_until_queue_condition('writes pending verification', verification_queue, operator.le, 0, max_wait_s=1200)
+            self._wait_until_queue_condition('writes pending verification', workload.pending_rows, operator.le, 0,
+                                             max_wait_s=300, subprocs=[verify_proc])
             self._check_on_subprocs([verify_proc])  # make sure the verification processes are running still
 
+            verify_proc.terminate()
+            verify_proc.join(60)
             self._terminate_subprocs()
+            workload.log_stats()
         # not a rolling upgrade, do everything in parallel:
         else:
             # upgrade through versions
@@ -424,6 +607,8 @@ class TestUpgrade(Tester):
         Upgrade Nodes - if *partial* is True, only upgrade those nodes
         that are specified by *nodes*, otherwise ignore *nodes* specified
         and upgrade all nodes.
+
+        The nodes are drained and stopped all at once, and started together on the new version.
         """
         logger.debug('Upgrading {nodes} to {version}'.format(nodes=[n.name for n in nodes] if nodes is not None else 'all nodes', version=version_meta.version))
         switch_jdks(version_meta.java_version)
@@ -431,17 +616,15 @@ class TestUpgrade(Tester):
         if not partial:
             nodes = self.cluster.nodelist()
 
-        for node in nodes:
-            logger.debug('Shutting down node: ' + node.name)
-            node.drain()
-            node.watch_log_for("DRAINED")
-            node.stop(wait_other_notice=False)
+        drain_and_stop_nodes(nodes)
 
         for node in nodes:
             node.set_install_dir(version=version_meta.version)
             logger.debug("Set new cassandra dir for %s: %s" % (node.name, node.get_install_dir()))
             if internode_ssl and (version_meta.family == 'trunk' or version_meta.family >= '4.0'):
                 node.set_configuration_options({'server_encryption_options': {'enabled': True, 'enable_legacy_ssl_storage_port': True}})
+            # Setup log4j / logback again (necessary moving from 2.0 -> 2.1):
+            node.set_log_level("INFO")
 
         # hacky? yes. We could probably extend ccm to allow this publicly.
         # the topology file needs to be written before any nodes are started
@@ -449,12 +632,9 @@ class TestUpgrade(Tester):
         self.cluster._Cluster__update_topology_files()
 
         # Restart nodes on new version
-        for node in nodes:
-            logger.debug('Starting %s on new version (%s)' % (node.name, version_meta.version))
-            # Setup log4j / logback again (necessary moving from 2.0 -> 2.1):
-            node.set_log_level("INFO")
-            node.start(wait_other_notice=240, wait_for_binary_proto=True)
-            node.nodetool('upgradesstables -a')
+        logger.debug('Starting {} on new version ({})'.format([node.name for node in nodes], version_meta.version))
+        start_nodes_together(self.cluster, nodes, wait_other_notice=240)
+        run_on_nodes(lambda node: node.nodetool('upgradesstables -a'), nodes)
 
     def _log_current_ver(self, current_version_meta):
         """
@@ -521,95 +701,92 @@ class TestUpgrade(Tester):
                 assert x == k
                 assert str(x) == v
 
-    def _wait_until_queue_condition(self, label, queue, opfunc, required_len, max_wait_s=600):
+    def _wait_until_queue_condition(self, label, pending_rows, opfunc, required_len, max_wait_s=600, subprocs=()):
         """
-        Waits up to max_wait_s for queue size to return True when evaluated against a condition function from the operator module.
+        Waits up to max_wait_s for the number of rows in a ContinuousWorkload's queues to return True when
+        evaluated against a condition function from the operator module.
 
         Label is just a string identifier for easier debugging.
 
-        On Mac OS X may not be able to check queue size, in which case it will not block.
-
-        If time runs out, raises RuntimeError.
+        If any of the given subprocesses dies in the meantime, or time runs out, raises RuntimeError.
         """
         wait_end_time = time.time() + max_wait_s
+        next_log_time = time.time() + 30
 
         while time.time() < wait_end_time:
-            try:
-                qsize = queue.qsize()
-            except NotImplementedError:
-                logger.debug("Queue size may not be checkable on Mac OS X. Test will continue without waiting.")
-                break
-            if opfunc(qsize, required_len):
-                logger.debug("{} queue size ({}) is '{}' to {}. Continuing.".format(label, qsize, opfunc.__name__, required_len))
+            pending = pending_rows.value
+            if opfunc(pending, required_len):
+                logger.debug("{} queue size ({}) is '{}' to {}. Continuing.".format(label, pending, opfunc.__name__, required_len))
                 break
 
-            if divmod(round(time.time()), 30)[1] == 0:
-                logger.debug("{} queue size is at {}, target is to reach '{}' {}".format(label, qsize, opfunc.__name__, required_len))
+            if time.time() >= next_log_time:
+                logger.debug("{} queue size is at {}, target is to reach '{}' {}".format(label, pending, opfunc.__name__, required_len))
+                next_log_time += 30
 
+            # no point waiting for processes that can't change the queue size anymore
+            self._check_on_subprocs(subprocs)
             time.sleep(0.1)
             continue
         else:
-            raise RuntimeError("Ran out of time waiting for queue size ({}) to be '{}' to {}. Aborting.".format(qsize, opfunc.__name__, required_len))
+            raise RuntimeError("Ran out of time waiting for queue size ({}) to be '{}' to {}. Aborting.".format(pending, opfunc.__name__, required_len))
 
     def _start_continuous_write_and_verify(self, wait_for_rowcount=0, max_wait_s=600):
         """
-        Starts a writer process, a verifier process, a queue to track writes,
-        and a queue to track successful verifications (which are rewrite candidates).
+        Starts a writer process, a verifier process, and the ContinuousWorkload with the queues to track
+        writes and successful verifications (which are rewrite candidates) between them.
 
         wait_for_rowcount provides a number of rows to write before unblocking and continuing.
 
-        Returns the writer process, verifier process, and the to_verify_queue.
+        Returns the writer process, verifier process, and the workload.
         """
-        # queue of writes to be verified
-        to_verify_queue = Queue(10000)
-        # queue of verified writes, which are update candidates
-        verification_done_queue = Queue(maxsize=500)
+        workload = ContinuousWorkload()
+        workload.begin_phase('before upgrading ({})'.format(self.test_version_metas[0].version))
 
-        writer = Process(target=data_writer, args=(self, to_verify_queue, verification_done_queue, 25))
+        writer = Process(target=data_writer, args=(self, workload, 25))
         # daemon subprocesses are killed automagically when the parent process exits
         writer.daemon = True
         self.fixture_dtest_setup.subprocs.append(writer)
         writer.start()
 
         if wait_for_rowcount > 0:
-            self._wait_until_queue_condition('rows written (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s)
+            self._wait_until_queue_condition('rows written (but not verified)', workload.pending_rows, operator.ge, wait_for_rowcount,
+                                             max_wait_s=max_wait_s, subprocs=[writer])
 
-        verifier = Process(target=data_checker, args=(self, to_verify_queue, verification_done_queue))
+        verifier = Process(target=data_checker, args=(self, workload))
         # daemon subprocesses are killed automagically when the parent process exits
         verifier.daemon = True
         self.fixture_dtest_setup.subprocs.append(verifier)
         verifier.start()
 
-        return writer, verifier, to_verify_queue
+        return writer, verifier, workload
 
     def _start_continuous_counter_increment_and_verify(self, wait_for_rowcount=0, max_wait_s=600):
         """
-        Starts a counter incrementer process, a verifier process, a queue to track writes,
-        and a queue to track successful verifications (which are re-increment candidates).
+        Starts a counter incrementer process, a verifier process, and the ContinuousWorkload with the queues
+        to track writes and successful verifications (which are re-increment candidates) between them.
 
-        Returns the writer process, verifier process, and the to_verify_queue.
+        Returns the writer process, verifier process, and the workload.
         """
-        # queue of writes to be verified
-        to_verify_queue = Queue()
-        # queue of verified writes, which are update candidates
-        verification_done_queue = Queue(maxsize=500)
+        workload = ContinuousWorkload(max_pending_rows=0)
+        workload.begin_phase('before upgrading ({})'.format(self.test_version_metas[0].version))
 
-        incrementer = Process(target=data_writer, args=(self, to_verify_queue, verification_done_queue, 25))
+        incrementer = Process(target=data_writer, args=(self, workload, 25))
         # daemon subprocesses are killed automagically when the parent process exits
         incrementer.daemon = True
         self.fixture_dtest_setup.subprocs.append(incrementer)
         incrementer.start()
 
         if wait_for_rowcount > 0:
-            self._wait_until_queue_condition('counters incremented (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s)
+            self._wait_until_queue_condition('counters incremented (but not verified)', workload.pending_rows, operator.ge, wait_for_rowcount,
+                                             max_wait_s=max_wait_s, subprocs=[incrementer])
 
-        count_verifier = Process(target=data_checker, args=(self, to_verify_queue, verification_done_queue))
+        count_verifier = Process(target=data_checker, args=(self, workload))
         # daemon subprocesses are killed automagically when the parent process exits
         count_verifier.daemon = True
         self.fixture_dtest_setup.subprocs.append(count_verifier)
         count_verifier.start()
 
-        return incrementer, count_verifier, to_verify_queue
+        return incrementer, count_verifier, workload
 
     def _increment_counters(self, opcount=25000):
         logger.debug("performing {opcount} counter increments".format(opcount=opcount))